@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 import floq
 
@@ -40,9 +41,15 @@ def dhamiltonian(ncomp):
                                          [0.25, 0.0]])
     return dhf
 
+def scaled_hamiltonian(ncomp, freq, amplitude, controls):
+    """hamiltonian() with the controls attenuated by the factor amplitude."""
+    return hamiltonian(ncomp, freq, amplitude * controls)
+
 def spin(n_components, amplitude, split, **kwargs):
-    def _hamiltonian(controls):
-        return hamiltonian(n_components, split, amplitude * controls)
+    # A partial of a module-level function rather than a closure, so that the
+    # system can be pickled onto the workers of a floq.parallel pool.
+    _hamiltonian = functools.partial(scaled_hamiltonian, n_components, split,
+                                     amplitude)
     _dhamiltonian = dhamiltonian(n_components)
     return floq.System(_hamiltonian, _dhamiltonian, **kwargs)
 
@@ -55,19 +62,23 @@ class SpinEnsemble(floq.system.EnsembleBase):
     Commonly, the values for w will be set slightly different for each spin, and
     a_k and b_k will be multiplied by some attenuation factor for each spin.
     Fidelities etc. will then be computed as ensemble averages."""
-    def __init__(self, n_systems, n_components, omega, frequencies, amplitudes):
+    def __init__(self, n_systems, n_components, omega, frequencies, amplitudes,
+                 weights=None):
         """Initialise a SpinEnsemble instance with
           - n: number of spins
           - ncomp: number of components in the control pulse
            -> hf will have nc = 2*comp+1 components
           - omega: base frequency of control pulse
           - freqs: vector of n frequencies
-          - amps: vector of n amplitudes."""
+          - amps: vector of n amplitudes
+          - weights: vector of n weights for ensemble averages, or None to
+                     weight every spin equally."""
         self.n_systems = n_systems
         self.n_components = n_components
         self.frequency = omega
         self.frequencies = frequencies
         self.amplitudes = amplitudes
+        self.__weights = weights
         self.__systems = [spin(n_components, a, f, frequency=omega, n_zones=31)\
                           for a, f in zip(amplitudes, frequencies)]
 
@@ -75,6 +86,16 @@ class SpinEnsemble(floq.system.EnsembleBase):
     def systems(self):
         return self.__systems
 
+    @property
+    def weights(self):
+        if self.__weights is None:
+            return super().weights
+        return self.__weights
+
+    @property
+    def parameters(self):
+        return np.column_stack((self.frequencies, self.amplitudes))
+
 class RandomisedSpinEnsemble(SpinEnsemble):
     """A system of n non-interacting spins, where each spin is described by the
     Hamiltonian
@@ -100,6 +121,35 @@ class RandomisedSpinEnsemble(SpinEnsemble):
         amps = amp_width * (2 * np.random.rand(n) - 1) + np.ones(n)
         super().__init__(n, ncomp, omega, freqs, amps)
 
+class QuadratureSpinEnsemble(SpinEnsemble):
+    """A system of non-interacting spins with the same distribution of
+    detunings and amplitudes as RandomisedSpinEnsemble, but represented by a
+    Gaussian quadrature rule instead of random samples:
+    - frequencies: Gauss-Hermite nodes for a normal distribution with given
+                   FWHM and mean 0,
+    - amplitudes: Gauss-Legendre nodes for a uniform distribution with given
+                  width around 1.0.
+    The spins are weighted by the quadrature weights, so ensemble averages are
+    accurate with far fewer spins than random sampling needs."""
+    def __init__(self, n_frequencies, n_amplitudes, ncomp, omega, fwhm,
+                 amp_width):
+        """Initialise a QuadratureSpinEnsemble instance with
+            - n_frequencies: number of quadrature nodes for the detunings
+            - n_amplitudes: number of quadrature nodes for the amplitudes
+            - ncomp: number of components in the control pulse
+            - omega: base frequency of control pulse
+            - fwhm: full width at half-max of the Gaussian distribution of
+                    detunings
+            - amp_width: amplitudes are distributed uniformly around 1 with
+                         this width."""
+        sigma = fwhm / 2.35482
+        nodes, weights = floq.quadrature.tensor_product(
+            floq.quadrature.gauss_hermite(n_frequencies, 0.0, sigma),
+            floq.quadrature.gauss_legendre(n_amplitudes, 1.0 - amp_width,
+                                           1.0 + amp_width))
+        super().__init__(len(weights), ncomp, omega, nodes[:, 0], nodes[:, 1],
+                         weights)
+
 if __name__ == '__main__':
     n_components = 3
     spin_system = spin(n_components, 1.0, 0.01, frequency=2*np.pi)
@@ -1,4 +1,9 @@
-from . import optimization, system, parallel, types
+from . import optimization, system, highfrequency, monodromy, operator,\
+              ordering, parallel, quadrature, surrogate, sweep, types
 
-from .system import System
+from .system import System, LinearSystem, MonodromySystem,\
+                    HighFrequencySystem
 System.__module__ = __name__
+LinearSystem.__module__ = __name__
+MonodromySystem.__module__ = __name__
+HighFrequencySystem.__module__ = __name__
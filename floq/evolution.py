@@ -11,11 +11,15 @@ two - this contains all the information necessary to build all the other
 properties after a diagonalisation, and is cached by the `System` class.
 """
 
+import concurrent.futures
 import numba
 import numpy as np
 import scipy.sparse.linalg
 import logging
+import time
 from . import linalg, types
+from .operator import FloquetOperator, davidson
+from .ordering import fill_reducing_ordering, permute
 
 _log = logging.getLogger(__name__)
 
@@ -110,7 +114,129 @@ def _find_duplicates(array):
     # start_indices will always contain 0 first, but np.split doesn't need it.
     return filter(lambda x: x.size > 1, np.split(indices, start_indices[1:]))
 
-def diagonalise(k, h_dimension, frequency, decimals):
+def _count_below(k, shift):
+    """
+    Return the number of eigenvalues of the Hermitian sparse matrix `k` which
+    are below `shift`, or `None` if `k - shift` is singular.  By Sylvester's law
+    of inertia, this is the number of negative pivots of a factorisation of
+    `k - shift` which only pivots symmetrically (along the diagonal).
+    """
+    identity = scipy.sparse.identity(k.shape[0], dtype=k.dtype, format='csc')
+    try:
+        factor = scipy.sparse.linalg.splu(
+            (k - shift*identity).tocsc(), permc_spec='MMD_AT_PLUS_A',
+            diag_pivot_thresh=0.0, options={'SymmetricMode': True})
+    except RuntimeError:
+        return None
+    if not np.array_equal(factor.perm_r, factor.perm_c):
+        raise RuntimeError("Could not factorise the shifted Floquet matrix"
+                           " symmetrically to count its eigenvalues.")
+    return np.count_nonzero(factor.U.diagonal().real < 0)
+
+def _slice_boundary(k, shift, nudge):
+    """
+    Return `(shift, count)` for a boundary between spectrum slices, moving the
+    boundary up by `nudge` (and then further) if it lands exactly on an
+    eigenvalue.
+    """
+    for _ in range(10):
+        count = _count_below(k, shift)
+        if count is not None:
+            return shift, count
+        shift, nudge = shift + nudge, 2*nudge
+    raise RuntimeError("Could not place a spectrum slice boundary between"
+                       " eigenvalues.")
+
+def _solve_slice(k, lower, upper, count):
+    """
+    Find the `count` eigenpairs of the Hermitian sparse matrix `k` with
+    eigenvalues in `[lower, upper)`, by shift-invert about the middle of the
+    interval.  These are always the `count` eigenvalues nearest the middle, but
+    a few more are asked for so ARPACK converges them reliably.
+    """
+    size = k.shape[0]
+    if count == 0:
+        return np.zeros(0), np.zeros((size, 0), dtype=k.dtype)
+    centre = 0.5 * (lower + upper)
+    n_wanted = min(count + max(2, count//4), size - 1)
+    while True:
+        eigenvalues, eigenvectors =\
+            scipy.sparse.linalg.eigsh(k, k=n_wanted, sigma=centre)
+        if np.count_nonzero((eigenvalues >= lower) & (eigenvalues < upper))\
+           >= count:
+            keep = np.argsort(np.abs(eigenvalues - centre))[:count]
+            return eigenvalues[keep], eigenvectors[:, keep]
+        if n_wanted == size - 1:
+            raise RuntimeError("Could not find every eigenvalue in a slice of"
+                               " the spectrum.")
+        n_wanted = min(2*n_wanted, size - 1)
+
+def _spectrum_slices(k, h_dimension, edge, n_slices, decimals):
+    """
+    Find the eigenpairs of the Hermitian sparse Floquet matrix `k` in the first
+    Brillouin zone by splitting the zone into `n_slices` intervals, and solving
+    each one with its own shift in a separate thread.  The zone is widened
+    slightly, so states on its edges are not lost to rounding; the slices
+    themselves are half-open, so no state is found twice.
+
+    The number of eigenvalues in each slice is counted exactly beforehand from
+    the inertia of `k` at the slice boundaries, so a slice is only accepted
+    once it holds all of its states, and a `RuntimeError` is raised if the
+    zone does not hold at least `h_dimension` of them.
+    """
+    tolerance = 10.0**-decimals
+    boundaries = np.linspace(-edge, edge, n_slices + 1)
+    boundaries[0] -= tolerance
+    boundaries[-1] += tolerance
+    # The factorisations and ARPACK iterations spend their time in compiled
+    # code, so threads can work on several slices at once.
+    with concurrent.futures.ThreadPoolExecutor(n_slices) as executor:
+        counted = list(executor.map(
+            lambda shift: _slice_boundary(k, shift, 0.1*tolerance),
+            boundaries))
+        boundaries = [shift for shift, _ in counted]
+        counts = np.array([count for _, count in counted])
+        if counts[-1] - counts[0] < h_dimension:
+            raise RuntimeError(
+                f"Only {counts[-1] - counts[0]} of the {h_dimension} states are"
+                " in the first Brillouin zone of the truncated Floquet matrix."
+                "  Try increasing the number of zones.")
+        slices = list(executor.map(_solve_slice, [k] * n_slices,
+                                   boundaries[:-1], boundaries[1:],
+                                   np.diff(counts)))
+    _log.debug(f"Spectrum slicing found {counts[-1] - counts[0]} states in"
+               f" slices of {list(np.diff(counts))}.")
+    return (np.concatenate([values for values, _ in slices]),
+            np.hstack([vectors for _, vectors in slices]))
+
+def _reordered_shift_invert(solve, k, h_dimension, v0=None):
+    """
+    Find the `2 * h_dimension` eigenpairs of the sparse matrix `k` nearest zero
+    with the ARPACK routine `solve` in shift-invert mode, factorising `k` in
+    the fill-reducing order for its pattern.  The eigenvectors are returned in
+    the original order of `k`.
+    """
+    ordering = fill_reducing_ordering(k, h_dimension)
+    permutation = ordering.permutation
+    permuted = permute(k, permutation)
+    start = time.perf_counter()
+    factor = scipy.sparse.linalg.splu(permuted,
+                                      permc_spec=ordering.column_spec)
+    _log.debug(f"Factorised the reordered Floquet matrix with LU fill"
+               f" {factor.L.nnz + factor.U.nnz} in"
+               f" {time.perf_counter() - start:.3g}s.")
+    inverse = scipy.sparse.linalg.LinearOperator(
+        permuted.shape, matvec=factor.solve,
+        dtype=np.result_type(permuted.dtype, np.float64))
+    eigenvalues, permuted_vectors =\
+        solve(permuted, k=2*h_dimension, sigma=0.0, OPinv=inverse,
+              v0=None if v0 is None else v0[permutation])
+    eigenvectors = np.empty_like(permuted_vectors)
+    eigenvectors[permutation] = permuted_vectors
+    return eigenvalues, eigenvectors
+
+def diagonalise(k, h_dimension, frequency, decimals, guess=None, solver=None,
+                slices=None, reorder=False):
     """
     Find the eigenvalues and eigenvectors of the Floquet matrix `k`
     corresponding to the first "Brillioun zone".  The eigenvectors corresponding
@@ -128,6 +254,15 @@ def diagonalise(k, h_dimension, frequency, decimals):
         the Hamiltonian, and the latter should largely be taken care of by the
         code.
 
+        If `k` has a real dtype, it must be symmetric (see
+        `is_real_symmetric()`), and it is solved with the real symmetric
+        eigensolvers.
+
+        `k` can also be a matrix-free `floq.operator.FloquetOperator`, in
+        which case the shift-invert solves are done iteratively with GMRES,
+        preconditioned by the inverse of the block diagonal of `k`, or exactly
+        by a matrix continued fraction if `k` is block tridiagonal.
+
     h_dimension: int -- The dimension of the Hamiltonian.
 
     frequency: float --
@@ -137,6 +272,40 @@ def diagonalise(k, h_dimension, frequency, decimals):
         The number of decimal places to use as a precision for orthogonalisation
         and comparison of degenerate eigenvalues.
 
+    guess: np.array(dtype=np.complex128,
+                    shape=(h_dimension, n_zones, h_dimension)) | None --
+        Optionally, the first-zone eigenvectors of a nearby Floquet matrix, such
+        as a neighbouring member of an ensemble.  The iterative (sparse) solver
+        starts from the span of these vectors, which speeds up convergence when
+        the two matrices are close.  The dense solver ignores the guess.
+
+    solver: None | 'general' | 'tridiagonal' | 'davidson' | 'slicing' --
+        The eigensolver to use.  By default (or with 'general') this is chosen
+        from the type of `k` as described above.  'tridiagonal' is the same,
+        but checks that `k` is a block-tridiagonal
+        `floq.operator.FloquetOperator`.  With 'davidson', `k` must be a
+        `floq.operator.FloquetOperator`, and the eigenpairs nearest zero are
+        found by `floq.operator.davidson()`, preconditioned by the inverse of
+        the block diagonal of `k`, so `k` is never factorised and no inner
+        linear solves are needed.
+
+        With 'slicing', `k` must be a `scipy.sparse` matrix.  The first zone is
+        split into `slices` intervals, each solved by shift-invert about its
+        own centre, concurrently.  Eigenvalues near the zone edges then
+        converge as well as those near zero, and counting the eigenvalues below
+        each slice boundary (from the inertia of a factorisation) guarantees
+        that none are missed.
+
+    slices: int > 0 | None --
+        The number of spectrum slices for `solver='slicing'`.  Defaults to the
+        number of available cores, but at least two.
+
+    reorder: bool --
+        Whether to permute a `scipy.sparse` matrix `k` before its shift-invert
+        factorisation, with the fill-reducing ordering chosen for its sparsity
+        pattern by `floq.ordering.fill_reducing_ordering()`.  The eigenvectors
+        are returned in the original order.
+
     Returns --
     eigenvalues: 1D np.array of float --
         The eigenvalues of the `k` matrix which fall within the first Brillouin
@@ -149,14 +318,63 @@ def diagonalise(k, h_dimension, frequency, decimals):
         Floquet kets corresponding to a certain (potentially degenerate)
         quasi-energy.
     """
-    if scipy.sparse.issparse(k):
+    real = not np.issubdtype(k.dtype, np.complexfloating)
+    if solver not in (None, 'general', 'tridiagonal', 'davidson', 'slicing'):
+        raise ValueError(f"Unknown eigensolver '{solver}'.")
+    if solver == 'tridiagonal'\
+       and not (isinstance(k, FloquetOperator) and k.tridiagonal):
+        raise ValueError("The tridiagonal solver needs the Floquet matrix as a"
+                         " block-tridiagonal floq.operator.FloquetOperator.")
+    if solver == 'slicing':
+        if not scipy.sparse.issparse(k):
+            raise ValueError("Spectrum slicing needs the Floquet matrix in"
+                             " scipy.sparse form.")
+        if slices is None:
+            from .parallel.threads import available_cores
+            slices = max(2, available_cores())
+        eigenvalues, eigenvectors =\
+            _spectrum_slices(k, h_dimension, 0.5*frequency, slices, decimals)
+    elif solver == 'davidson':
+        if not isinstance(k, FloquetOperator):
+            raise ValueError("The Davidson solver needs the Floquet matrix as"
+                             " a floq.operator.FloquetOperator.")
+        v0 = None if guess is None else guess.reshape(h_dimension, -1).T
+        # Twice as many as needed, for the same reason as the sparse case.
+        eigenvalues, eigenvectors =\
+            davidson(k, 2*h_dimension, guess=v0, tol=10.0**-(decimals + 2))
+    elif isinstance(k, FloquetOperator):
+        # Without a factorisation, the shift-invert solves are iterative.
+        v0 = None if guess is None\
+             else np.sum(guess.reshape(h_dimension, -1), axis=0)
+        inverse = k.shift_invert(0.0)
+        if real:
+            v0 = None if v0 is None else np.real(v0)
+            eigenvalues, eigenvectors =\
+                scipy.sparse.linalg.eigsh(k, k=2*h_dimension, sigma=0.0,
+                                          OPinv=inverse, v0=v0)
+        else:
+            eigenvalues, eigenvectors =\
+                scipy.sparse.linalg.eigs(k, k=2*h_dimension, sigma=0.0,
+                                         OPinv=inverse, v0=v0)
+    elif scipy.sparse.issparse(k):
         # We get twice as many eigenvalues as necessary so we can guarantee we
         # have a full set in the first Brillouin zone, even if all of them fall
         # on the very edge of the zone.  If this were to happen and we were only
         # taking the absolutely necessary number of eigenvalues, we would
         # sometimes duplicate an eigenvector without intending to.
-        eigenvalues, eigenvectors =\
-            scipy.sparse.linalg.eigs(k, k=2*h_dimension, sigma=0.0)
+        v0 = None if guess is None\
+             else np.sum(guess.reshape(h_dimension, -1), axis=0)
+        if real:
+            v0 = None if v0 is None else np.real(v0)
+        solve = scipy.sparse.linalg.eigsh if real else scipy.sparse.linalg.eigs
+        if reorder:
+            eigenvalues, eigenvectors =\
+                _reordered_shift_invert(solve, k, h_dimension, v0)
+        else:
+            eigenvalues, eigenvectors =\
+                solve(k, k=2*h_dimension, sigma=0.0, v0=v0)
+    elif real:
+        eigenvalues, eigenvectors = np.linalg.eigh(k)
     else:
         eigenvalues, eigenvectors = np.linalg.eig(k)
     eigenvalues = np.round(np.real(eigenvalues), decimals=decimals)
@@ -167,11 +385,14 @@ def diagonalise(k, h_dimension, frequency, decimals):
     for degeneracy in _find_duplicates(eigenvalues):
         eigenvectors[degeneracy] = linalg.gram_schmidt(eigenvectors[degeneracy])
     n_zones = k.shape[0] // h_dimension
+    # A real `k` is only solved in real arithmetic; everything after this works
+    # with complex vectors.
+    eigenvectors = eigenvectors.astype(np.complex128, copy=False)
     return eigenvalues, eigenvectors.reshape(h_dimension, n_zones, h_dimension)
 
 
-@numba.njit
-def _k_ijv_constructor(hamiltonian, n_zones, frequency):
+@numba.njit(cache=True, nogil=True)
+def _k_ijv_constructor(hamiltonian, n_zones, frequency, hermitian=False):
     """
     Returns a tuple of
         values, (row_indices, col_indices)
@@ -181,13 +402,18 @@ def _k_ijv_constructor(hamiltonian, n_zones, frequency):
     and other associated `scipy` pages for more information.  This triplet form
     can be passed to the `coo`, `csc` or `csr` sparse matrix constructors,
     resulting in an efficient creation.
+
+    If `hermitian`, only the modes `>= 0` are stored in `hamiltonian`, and each
+    block of a positive mode is also written transposed and conjugated in the
+    mirror-image position as the block of the negative mode.
     """
     nonzeros = [matrix.nonzero() for matrix in hamiltonian.matrix]
     rows, cols = [x[0] for x in nonzeros], [x[1] for x in nonzeros]
     dimension = hamiltonian.matrix[0].shape[0]
     n_elements = dimension * n_zones # include extra space for diagonal
     for mode, row in zip(hamiltonian.mode, rows):
-        n_elements += row.size * (n_zones - abs(mode))
+        copies = 2 if hermitian and mode != 0 else 1
+        n_elements += copies * row.size * (n_zones - abs(mode))
     row_out = np.empty(n_elements, dtype=np.int64)
     col_out = np.empty_like(row_out)
     val_out = np.empty(n_elements, dtype=np.complex128)
@@ -202,6 +428,11 @@ def _k_ijv_constructor(hamiltonian, n_zones, frequency):
             col_out[start : start+row.size] = col + (start_col+j)*dimension
             val_out[start : start+row.size] = val
             start += row.size
+            if hermitian and mode != 0:
+                row_out[start : start+row.size] = col + (start_col+j)*dimension
+                col_out[start : start+row.size] = row + (start_row+j)*dimension
+                val_out[start : start+row.size] = np.conj(val)
+                start += row.size
     # When converting a `coo`-style matrix to `csc` or `csr`, duplicated
     # coordinates have their values summed.  I add the diagonal `1, n*frequency`
     # operator values here as completely separated entries in the sparse matrix,
@@ -216,7 +447,39 @@ def _k_ijv_constructor(hamiltonian, n_zones, frequency):
         start += dimension
     return val_out, (row_out, col_out)
 
-@numba.njit
+def _k_ijv_sparse_blocks(hamiltonian, n_zones, frequency, hermitian=False):
+    """
+    The same as `_k_ijv_constructor()`, but for Fourier blocks which may be
+    `scipy.sparse` matrices, so only their stored elements are ever touched.
+    Each block is tiled down its diagonal of `K` with vectorised index
+    arithmetic.
+    """
+    dimension = hamiltonian.matrix[0].shape[0]
+    rows, cols, values = [], [], []
+    for mode, matrix in zip(hamiltonian.mode, hamiltonian.matrix):
+        block = scipy.sparse.coo_matrix(matrix)
+        n_blocks = n_zones - abs(mode)
+        if n_blocks <= 0:
+            continue
+        offsets = dimension * np.arange(n_blocks, dtype=np.int64)[:, np.newaxis]
+        rows.append((block.row + max(0, mode)*dimension + offsets).ravel())
+        cols.append((block.col + max(0, -mode)*dimension + offsets).ravel())
+        values.append(np.tile(block.data, n_blocks))
+        if hermitian and mode != 0:
+            rows.append(cols[-1])
+            cols.append(rows[-2])
+            values.append(np.conj(values[-1]))
+    # The `n * frequency` diagonal, summed in on conversion as in the dense
+    # version.
+    indices = np.arange(n_zones * dimension, dtype=np.int64)
+    rows.append(indices)
+    cols.append(indices)
+    values.append(np.repeat((np.arange(n_zones) - n_zones//2) * frequency,
+                            dimension))
+    return (np.concatenate(values).astype(np.complex128),
+            (np.concatenate(rows), np.concatenate(cols)))
+
+@numba.njit(cache=True, nogil=True)
 def _add_block(block, matrix, dim_block, n_block, row, col):
     start_row = row * dim_block
     start_col = col * dim_block
@@ -224,15 +487,76 @@ def _add_block(block, matrix, dim_block, n_block, row, col):
     stop_col = start_col + dim_block
     matrix[start_row:stop_row, start_col:stop_col] += block
 
-@numba.njit
-def assemble_k(hamiltonian, n_zones, frequency):
+def _has_sparse_blocks(operator):
+    return any(scipy.sparse.issparse(matrix) for matrix in operator.matrix)
+
+def _dense_blocks(operator):
+    """The operator with any `scipy.sparse` blocks converted to dense."""
+    if not _has_sparse_blocks(operator):
+        return operator
+    return types.TransformedMatrix(
+        tuple(operator.mode),
+        tuple(np.asarray(matrix.toarray() if scipy.sparse.issparse(matrix)
+                         else matrix, dtype=np.complex128)
+              for matrix in operator.matrix))
+
+def _real_blocks(operator):
+    """The operator with each block replaced by its (float64) real part."""
+    return types.TransformedMatrix(
+        tuple(operator.mode),
+        tuple(matrix.real.astype(np.float64) for matrix in operator.matrix))
+
+def is_real_symmetric(hamiltonian, hermitian=False):
+    """
+    Whether the Floquet matrix of `hamiltonian` is real symmetric, so can be
+    assembled and diagonalised in real arithmetic.  This is the case when every
+    Fourier block is real and symmetric and `H_m = H_{-m}`, which is common for
+    cosine drives of real-valued models.  With `hermitian`, only the modes
+    `>= 0` are given, and the last condition then holds automatically.
+    """
+    def is_zero(matrix):
+        if scipy.sparse.issparse(matrix):
+            return matrix.count_nonzero() == 0
+        return not np.any(matrix)
+    blocks = dict(zip(hamiltonian.mode, hamiltonian.matrix))
+    for mode, matrix in blocks.items():
+        if not (is_zero(matrix.imag) and is_zero(matrix - matrix.T)):
+            return False
+        if hermitian:
+            continue
+        mirror = blocks.get(-mode)
+        if not (is_zero(matrix) if mirror is None else is_zero(matrix-mirror)):
+            return False
+    return True
+
+def assemble_k(hamiltonian, n_zones, frequency, hermitian=False, real=False):
+    """
+    Assemble `K` as a dense matrix.  Any `scipy.sparse` Fourier blocks are
+    converted to dense first.  If `hermitian`, only the modes `>= 0` are given,
+    and the others are their conjugate transposes.  If `real`, `K` is built as
+    float64 from the real parts of the blocks (see `is_real_symmetric()`).
+    """
+    hamiltonian = _dense_blocks(hamiltonian)
+    size = n_zones * hamiltonian.matrix[0].shape[0]
+    if real:
+        hamiltonian = _real_blocks(hamiltonian)
+        k = np.zeros((size, size), dtype=np.float64)
+    else:
+        k = np.zeros((size, size), dtype=np.complex128)
+    _assemble_k_dense(hamiltonian, n_zones, frequency, hermitian, k)
+    return k
+
+@numba.njit(cache=True, nogil=True)
+def _assemble_k_dense(hamiltonian, n_zones, frequency, hermitian, k):
     dimension = hamiltonian.matrix[0].shape[0]
-    k = np.zeros((n_zones*dimension, n_zones*dimension), dtype=np.complex128)
     for mode, matrix in zip(hamiltonian.mode, hamiltonian.matrix):
         n_blocks = n_zones - abs(mode)
         start_row, start_col = max(0, mode), max(0, -mode)
         for j in range(n_blocks):
             _add_block(matrix, k, dimension, n_zones, start_row+j, start_col+j)
+            if hermitian and mode != 0:
+                _add_block(np.conj(matrix.T), k, dimension, n_zones,
+                           start_col+j, start_row+j)
         if mode == 0:
             block = np.eye(dimension) * frequency
             zone_max = (n_zones - 1) // 2
@@ -240,18 +564,60 @@ def assemble_k(hamiltonian, n_zones, frequency):
                 _add_block(block*zone, k, dimension, n_zones, j, j)
     return k
 
-def assemble_k_sparse(hamiltonian, n_zones, frequency):
+def assemble_k_sparse(hamiltonian, n_zones, frequency, hermitian=False,
+                      real=False):
     """
     Directly assemble `K` as a sparse matrix in `csc` (Compressed Sparse Column)
     format.  The sparser `K` is, the more efficient this way of doing things is.
+    If `hermitian`, only the modes `>= 0` are given, and the blocks of the
+    negative modes are generated from them.  If `real`, `K` is stored as
+    float64 (see `is_real_symmetric()`).
     """
-    elements = _k_ijv_constructor(hamiltonian, n_zones, frequency)
+    if _has_sparse_blocks(hamiltonian):
+        elements = _k_ijv_sparse_blocks(hamiltonian, n_zones, frequency,
+                                        hermitian)
+    else:
+        elements = _k_ijv_constructor(hamiltonian, n_zones, frequency,
+                                      hermitian)
     size = n_zones * hamiltonian.matrix[0].shape[0]
+    if real:
+        elements = (np.real(elements[0]), elements[1])
     # Use `csc` format for efficiency in the diagonalisation routine.
     return scipy.sparse.csc_matrix(elements, shape=(size, size))
 
+def common_sparsity(matrices):
+    """
+    Put several sparse matrices of the same shape onto one shared `csc`
+    sparsity pattern (the union of all of theirs), so that any linear
+    combination of them is a single dot product of the coefficients with the
+    stacked data, without re-sorting or re-indexing.
 
-@numba.njit
+    Returns --
+    indices, indptr: 1D np.array of int --
+        The `csc` row indices and column pointers of the shared pattern.
+    data: np.array(dtype=np.complex128, shape=(len(matrices), n_nonzero)) --
+        The values of each matrix on the shared pattern.  The linear combination
+        with coefficients `c` is then
+            scipy.sparse.csc_matrix((c @ data, indices, indptr), shape=shape).
+    """
+    matrices = [scipy.sparse.csc_matrix(matrix) for matrix in matrices]
+    for matrix in matrices:
+        matrix.sum_duplicates()
+    matrices = [matrix.tocoo() for matrix in matrices]
+    n_rows, n_cols = matrices[0].shape
+    keys = [matrix.col.astype(np.int64)*n_rows + matrix.row
+            for matrix in matrices]
+    # Sorting by these keys is the column-major order that `csc` needs.
+    pattern = np.unique(np.concatenate(keys))
+    indices = pattern % n_rows
+    indptr = np.searchsorted(pattern // n_rows, np.arange(n_cols + 1))
+    data = np.zeros((len(matrices), pattern.size), dtype=np.complex128)
+    for i, (matrix, key) in enumerate(zip(matrices, keys)):
+        data[i, np.searchsorted(pattern, key)] = matrix.data
+    return indices, indptr, data
+
+
+@numba.njit(cache=True, nogil=True)
 def _dense_to_sparse(matrix):
     """
     Convert a dense 2D numpy array of complex into the custom
@@ -266,15 +632,44 @@ def _dense_to_sparse(matrix):
         value[i] = matrix[row[i], col[i]]
     return types.ColumnSparseMatrix(in_column, row, value)
 
-@numba.njit
-def _single_dk_sparse(dhamiltonian, n_zones):
+def _sparse_to_column_sparse(matrix):
     """
-    Create a single sparse matrix for a single derivative.
+    Convert a `scipy.sparse` matrix into the custom `ColumnSparseMatrix` format,
+    which is exactly `csc` without the column pointers.
+    """
+    matrix = scipy.sparse.csc_matrix(matrix, dtype=np.complex128)
+    matrix.eliminate_zeros()
+    matrix.sum_duplicates()
+    return types.ColumnSparseMatrix(np.diff(matrix.indptr).astype(np.int64),
+                                    matrix.indices.astype(np.int64),
+                                    matrix.data)
+
+def _single_dk_sparse(dhamiltonian, n_zones, hermitian=False):
+    """
+    Create a single sparse matrix for a single derivative.  The Fourier blocks
+    may be dense or `scipy.sparse`.
     """
     dimension = dhamiltonian.matrix[0].shape[0]
-    matrices = [_dense_to_sparse(op) for op in dhamiltonian.matrix]
+    modes, blocks = list(dhamiltonian.mode), list(dhamiltonian.matrix)
+    if hermitian:
+        for mode, block in zip(dhamiltonian.mode, dhamiltonian.matrix):
+            if mode != 0:
+                modes.append(-mode)
+                blocks.append(block.conj().T)
+    matrices = tuple(_sparse_to_column_sparse(op) if scipy.sparse.issparse(op)
+                     else _dense_to_sparse(np.asarray(op, dtype=np.complex128))
+                     for op in blocks)
+    modes = np.array(modes, dtype=np.int64)
+    return _lift_column_sparse(modes, matrices, dimension, n_zones)
+
+@numba.njit(cache=True, nogil=True)
+def _lift_column_sparse(modes, matrices, dimension, n_zones):
+    """
+    Tile the column-sparse Fourier blocks `matrices` (with Fourier modes
+    `modes`) into the column-sparse derivative of the Floquet matrix.
+    """
     n_elements = 0
-    for i, mode in enumerate(dhamiltonian.mode):
+    for i, mode in enumerate(modes):
         n_elements += matrices[i].value.size * (n_zones - abs(mode))
     in_column = np.zeros(n_zones * dimension, dtype=np.int64)
     row = np.empty(n_elements, dtype=np.int64)
@@ -285,7 +680,7 @@ def _single_dk_sparse(dhamiltonian, n_zones):
     for zone_column in range(n_zones):
         for block_column in range(dimension):
             mode_lower, mode_upper = -zone_column, n_zones - zone_column
-            for j, mode in enumerate(dhamiltonian.mode):
+            for j, mode in enumerate(modes):
                 if not mode_lower <= mode < mode_upper:
                     continue
                 n_to_add = matrices[j].in_column[block_column]
@@ -300,21 +695,22 @@ def _single_dk_sparse(dhamiltonian, n_zones):
         block_mid_row += 1
     return types.ColumnSparseMatrix(in_column, row, value)
 
-@numba.njit
-def assemble_dk(dhamiltonians, n_zones):
+def assemble_dk(dhamiltonians, n_zones, hermitian=False):
     """
     Creates the `dK` matrix as a list of the custom `ColumnSparseMatrix` tuple.
     The only operation we need with the output matrix is an inner product `<x|M`
     so the column sparse format is very efficient.
 
     I use this poor-man's sparse matrix beacuse `numba` doesn't know about
-    `scipy.sparse` matrices.
+    `scipy.sparse` matrices.  The loop is in Python so that the derivatives
+    need not all populate the same Fourier modes.
     """
-    return [_single_dk_sparse(op, n_zones) for op in dhamiltonians]
+    return [_single_dk_sparse(op, n_zones, hermitian) for op in dhamiltonians]
 
 
 def eigensystem(hamiltonian, dhamiltonian, n_zones, frequency, decimals=8,
-                sparse=True):
+                sparse=True, guess=None, hermitian=False, real=None,
+                matrix_free=False, solver=None, slices=None, reorder=False):
     """
     Calculate the time-invariant eigensystem of the Floquet system.  This needs
     to be recalculated whenever the Hamiltonian (or its derivatives) change, but
@@ -347,18 +743,85 @@ def eigensystem(hamiltonian, dhamiltonian, n_zones, frequency, decimals=8,
 
     sparse: bool -- Whether to use sparse matrix algebra.
 
+    guess: Eigensystem | None --
+        Optionally, the eigensystem of a nearby problem (for example the same
+        system at slightly different controls, or a neighbouring member of an
+        ensemble) to use as a starting point for the iterative solver.  It is
+        ignored if its shape does not match this problem.
+
+    hermitian: bool --
+        Whether `hamiltonian` and `dhamiltonian` only hold their Fourier modes
+        `>= 0`, with each negative mode the conjugate transpose of the positive
+        one, `H_{-m} = H_m^dagger`.
+
+    real: bool | None --
+        Whether to assemble and diagonalise the Floquet matrix in real
+        arithmetic, which is only correct if it is real symmetric (see
+        `is_real_symmetric()`).  If `None`, this is detected from `hamiltonian`.
+        The returned `Eigensystem` is complex either way.
+
+    matrix_free: bool --
+        Whether to use a `floq.operator.FloquetOperator` rather than assembling
+        the Floquet matrix at all.  This needs far less memory when there are
+        many zones, but each solve is slower.  `sparse` is then ignored.
+
+    solver: None | 'general' | 'tridiagonal' | 'davidson' | 'slicing',
+    slices: int | None --
+        The eigensolver, as for `diagonalise()`.  'davidson' always works
+        matrix-free, and its cost scales with `dimension * n_zones`.
+        'slicing' always assembles the sparse matrix.
+
+        'tridiagonal' needs a Hamiltonian with only the modes -1, 0 and 1, and
+        then works matrix-free with exact shift-invert solves by a matrix
+        continued fraction (see `floq.operator`), in time linear in `n_zones`.
+        With `solver=None`, this is chosen automatically for such Hamiltonians
+        when `sparse` is set, none of the blocks are `scipy.sparse` (which
+        SuperLU handles better) and `reorder` is not set.  'general' always
+        uses the path chosen by `sparse` and `matrix_free`.
+
+    reorder: bool --
+        Whether to factorise the sparse Floquet matrix in a fill-reducing
+        order, as for `diagonalise()`.
+
     Returns:
     Eigensystem --
         A collection of parameters that are not time-dependent, which can be
         passed to the time-specific functions.
     """
     dimension = hamiltonian.matrix[0].shape[0]
-    k = assemble_k_sparse(hamiltonian, n_zones, frequency) if sparse\
-        else assemble_k(hamiltonian, n_zones, frequency)
+    if real is None:
+        real = is_real_symmetric(hamiltonian, hermitian)
+    if solver is None and sparse and not matrix_free and not reorder\
+       and not _has_sparse_blocks(hamiltonian)\
+       and all(abs(mode) <= 1 for mode in hamiltonian.mode):
+        solver = 'tridiagonal'
+    if matrix_free or solver in ('davidson', 'tridiagonal'):
+        k = FloquetOperator(hamiltonian, n_zones, frequency, hermitian, real)
+    else:
+        assemble = assemble_k_sparse if sparse or solver == 'slicing'\
+                   else assemble_k
+        k = assemble(hamiltonian, n_zones, frequency, hermitian, real)
     k_derivatives = None if dhamiltonian is None\
-                    else assemble_dk(dhamiltonian, n_zones)
-    quasienergies, k_eigenvectors = diagonalise(k, dimension, frequency,
-                                                decimals)
+                    else assemble_dk(dhamiltonian, n_zones, hermitian)
+    return eigensystem_from_k(k, k_derivatives, dimension, frequency, decimals,
+                              guess, solver, slices, reorder)
+
+def eigensystem_from_k(k, k_derivatives, dimension, frequency, decimals=8,
+                       guess=None, solver=None, slices=None, reorder=False):
+    """
+    Calculate the eigensystem of an already assembled Floquet matrix `k`
+    (dense, `scipy.sparse` or a `floq.operator.FloquetOperator`), with its
+    control derivatives `k_derivatives` as output by `assemble_dk()` (or
+    `None`).  See `eigensystem()` for the other arguments.
+    """
+    n_zones = k.shape[0] // dimension
+    if guess is not None\
+       and guess.k_eigenvectors.shape != (dimension, n_zones, dimension):
+        guess = None
+    quasienergies, k_eigenvectors =\
+        diagonalise(k, dimension, frequency, decimals,
+                    None if guess is None else guess.k_eigenvectors, solver,
+                    slices, reorder)
     # Sum the eigenvectors along the Fourier-mode axis at `time = 0` to contract
     # the abstract Hilbert space back to the original one.
     initial_floquet_bras = np.conj(np.sum(k_eigenvectors, axis=1))
@@ -369,7 +832,7 @@ def eigensystem(hamiltonian, dhamiltonian, n_zones, frequency, decimals=8,
                              k_derivatives)
 
 
-@numba.njit
+@numba.njit(cache=True, nogil=True)
 def current_floquet_kets(eigensystem, time):
     """
     Get the Floquet basis kets at a given time.  These are the
@@ -380,7 +843,7 @@ def current_floquet_kets(eigensystem, time):
     weights = weights.reshape((1, -1, 1))
     return np.sum(weights * eigensystem.k_eigenvectors, axis=1)
 
-@numba.njit
+@numba.njit(cache=True, nogil=True)
 def d_current_floquet_kets(eigensystem, time):
     """
     Get the time derivatives of the Floquet basis kets
@@ -394,7 +857,7 @@ def d_current_floquet_kets(eigensystem, time):
     return np.sum(weights * eigensystem.k_eigenvectors, axis=1)
 
 
-@numba.njit
+@numba.njit(cache=True, nogil=True)
 def u(eigensystem, time):
     """
     Calculate the time-evolution operator at a certain time, using a
@@ -413,7 +876,7 @@ def u(eigensystem, time):
     return out
 
 
-@numba.njit
+@numba.njit(cache=True, nogil=True)
 def du_dt(eigensystem, time):
     """
     Calculate the time derivative of a time-evolution operator at a certain
@@ -440,7 +903,7 @@ def du_dt(eigensystem, time):
     return out
 
 
-@numba.njit
+@numba.njit(cache=True, nogil=True)
 def _conjugate_rotate_into(out, input, amount):
     """
     Equivalent to `out = np.conj(np.roll(input, amount, axis=0))`, but `roll()`
@@ -457,7 +920,7 @@ def _conjugate_rotate_into(out, input, amount):
     else:
         out[:] = np.conj(input)
 
-@numba.njit
+@numba.njit(cache=True, nogil=True)
 def _column_sparse_ldot(vector, matrix):
     out = np.zeros_like(vector)
     i = 0
@@ -467,7 +930,7 @@ def _column_sparse_ldot(vector, matrix):
             i += 1
     return out
 
-@numba.njit
+@numba.njit(cache=True, nogil=True)
 def integral_factors(eigensystem, time):
     """
     Calculate the "integral factors" for use in the control-derivatives of the
@@ -498,26 +961,25 @@ def integral_factors(eigensystem, time):
                     out[diff_index, i, j] = numer / denom
     return out
 
-@numba.njit
-def combined_factors(eigensystem, time):
+@numba.njit(cache=True, nogil=True)
+def k_derivative_expectations(eigensystem):
     """
-    Calculate the "combined factors" for use in the control-derivatives of the
-    time evolution operator.  These are the
-        f(j, j'; delta mu)
-    from equations (1.50) and (2.7) in Marcel's thesis.
+    Calculate the matrix elements of the control derivatives of the Floquet
+    matrix between the (zone-shifted) eigenvectors,
+        <phi_i(delta mu)| dK/dc_p |phi_j>,
+    which are the time-independent parts of the combined factors.  They only
+    depend on the eigensystem, so can be shared between many different times.
     """
     n_parameters = len(eigensystem.k_derivatives)
     n_zones = eigensystem.k_eigenvectors.shape[1]
     dimension = eigensystem.k_eigenvectors.shape[2]
-    factors = np.empty((2*n_zones - 1, dimension, dimension, n_parameters),
-                       dtype=np.complex128)
+    out = np.empty((2*n_zones - 1, dimension, dimension, n_parameters),
+                   dtype=np.complex128)
     rolled_k_eigenbra = np.zeros((n_zones, dimension),
                                  dtype=np.complex128)
     expectation_left = np.empty((n_parameters, n_zones * dimension),
                                 dtype=np.complex128)
     k_eigenkets = eigensystem.k_eigenvectors
-    energies = eigensystem.quasienergies
-    integral_terms = integral_factors(eigensystem, time)
     for diff_index, diff in enumerate(range(1 - n_zones, n_zones)):
         for i in range(dimension):
             _conjugate_rotate_into(rolled_k_eigenbra, k_eigenkets[i], diff)
@@ -527,27 +989,43 @@ def combined_factors(eigensystem, time):
                     _column_sparse_ldot(bra, eigensystem.k_derivatives[p])
             for j in range(dimension):
                 for parameter in range(n_parameters):
-                    expectation = expectation_left[parameter]\
-                                  @ k_eigenkets[j].ravel()
-                    factors[diff_index, i, j, parameter] =\
-                        integral_terms[diff_index, i, j] * expectation
-    return factors
+                    out[diff_index, i, j, parameter] =\
+                        expectation_left[parameter] @ k_eigenkets[j].ravel()
+    return out
 
+@numba.njit(cache=True, nogil=True)
+def _combine(integral_terms, expectations):
+    out = np.empty_like(expectations)
+    for parameter in range(expectations.shape[3]):
+        out[:, :, :, parameter] = integral_terms\
+                                  * expectations[:, :, :, parameter]
+    return out
 
-@numba.njit
-def du_dcontrols(eigensystem, time):
+@numba.njit(cache=True, nogil=True)
+def combined_factors(eigensystem, time):
     """
-    Calculate the derivatives of time-evolution operator with respect to the
-    control parameters of the Hamiltonian at a certain time, using a
-    pre-computed eigensystem.  This is only possible if the eigensystem was
-    created using the Hamiltonian derivatives as well.
+    Calculate the "combined factors" for use in the control-derivatives of the
+    time evolution operator.  These are the
+        f(j, j'; delta mu)
+    from equations (1.50) and (2.7) in Marcel's thesis.
+    """
+    return _combine(integral_factors(eigensystem, time),
+                    k_derivative_expectations(eigensystem))
+
+
+@numba.njit(cache=True, nogil=True)
+def du_dcontrols_with_expectations(eigensystem, time, expectations):
+    """
+    Calculate `du_dcontrols(eigensystem, time)` using the pre-computed output of
+    `k_derivative_expectations(eigensystem)`, so that the derivatives at many
+    times only need the expectations calculating once.
     """
     n_parameters = len(eigensystem.k_derivatives)
     n_zones, dimension = eigensystem.k_eigenvectors.shape[1:3]
     out = np.zeros((n_parameters, dimension, dimension), dtype=np.complex128)
     if n_parameters == 0:
         return out
-    factors = combined_factors(eigensystem, time)
+    factors = _combine(integral_factors(eigensystem, time), expectations)
     current_kets = current_floquet_kets(eigensystem, time)
     k_eigenbras = np.conj(eigensystem.k_eigenvectors)
     for i in range(dimension):
@@ -559,3 +1037,206 @@ def du_dcontrols(eigensystem, time):
             for parameter in range(n_parameters):
                 out[parameter] += np.outer(current_kets[i], bra[parameter])
     return out
+
+@numba.njit(cache=True, nogil=True)
+def du_dcontrols(eigensystem, time):
+    """
+    Calculate the derivatives of time-evolution operator with respect to the
+    control parameters of the Hamiltonian at a certain time, using a
+    pre-computed eigensystem.  This is only possible if the eigensystem was
+    created using the Hamiltonian derivatives as well.
+    """
+    if len(eigensystem.k_derivatives) == 0:
+        dimension = eigensystem.quasienergies.shape[0]
+        return np.zeros((0, dimension, dimension), dtype=np.complex128)
+    return du_dcontrols_with_expectations(
+        eigensystem, time, k_derivative_expectations(eigensystem))
+
+
+# Below this spread of its points, a divided difference of `exp` is summed as a
+# Taylor series about their mean rather than differenced, which would cancel.
+_SERIES_SPREAD = 1e-2
+
+@numba.njit(cache=True, nogil=True)
+def _exp_difference_1(a, b):
+    """The first divided difference of `exp` at `a` and `b`."""
+    half = 0.5 * (a - b)
+    if abs(half) < 1e-3:
+        squared = half * half
+        ratio = 1.0 + squared/6.0 + squared*squared/120.0
+    else:
+        ratio = np.sinh(half) / half
+    return np.exp(0.5 * (a + b)) * ratio
+
+@numba.njit(cache=True, nogil=True)
+def _exp_difference_2(a, b, c):
+    """
+    The second divided difference of `exp` at `a`, `b` and `c`, which is
+    symmetric in its arguments.  The two points furthest apart are used as the
+    ends, so the final division is by the largest available separation.
+    """
+    ab, bc, ac = abs(a - b), abs(b - c), abs(a - c)
+    spread = max(ab, bc, ac)
+    if spread < _SERIES_SPREAD:
+        # exp(m) sum_k h_k(a-m, b-m, c-m) / (k+2)!, with the complete
+        # homogeneous polynomials h_k built from the power sums by Newton's
+        # identities (the first power sum is zero about the mean).
+        mean = (a + b + c) / 3.0
+        da, db, dc = a - mean, b - mean, c - mean
+        powers = np.zeros(7, dtype=np.complex128)
+        homogeneous = np.zeros(7, dtype=np.complex128)
+        pa, pb, pc = da, db, dc
+        for k in range(1, 7):
+            powers[k] = pa + pb + pc
+            pa, pb, pc = pa*da, pb*db, pc*dc
+        homogeneous[0] = 1.0
+        total = 0.5
+        factorial = 2.0
+        for k in range(1, 7):
+            value = 0.0j
+            for i in range(1, k + 1):
+                value += powers[i] * homogeneous[k - i]
+            homogeneous[k] = value / k
+            factorial *= k + 2
+            total += homogeneous[k] / factorial
+        return np.exp(mean) * total
+    if ac == spread:
+        first, middle, last = a, b, c
+    elif ab == spread:
+        first, middle, last = a, c, b
+    else:
+        first, middle, last = b, a, c
+    return (_exp_difference_1(middle, last) - _exp_difference_1(first, middle))\
+           / (last - first)
+
+@numba.njit(cache=True, nogil=True)
+def _conjugate_shift_into(out, input, amount):
+    """
+    Equivalent to `_conjugate_rotate_into()`, but the zones shifted off one end
+    are dropped and the other end is zero-filled, rather than wrapping around.
+    """
+    out[:] = 0.0
+    if amount >= 0:
+        out[amount:] = np.conj(input[:input.shape[0] - amount])
+    else:
+        out[:amount] = np.conj(input[-amount:])
+
+@numba.njit(cache=True, nogil=True)
+def shifted_expectations(eigensystem):
+    """
+    Calculate the matrix elements
+        <phi_i shifted by D zones| dK/dc_p |phi_j>
+    for every shift `D` from `1 - n_zones` to `n_zones - 1`, like
+    `k_derivative_expectations()`, except that zones are not wrapped around.
+    These are then the Fourier coefficients of `<phi_i(t)|dH/dc_p|phi_j(t)>`,
+    in the same shape `(2 n_zones - 1, dimension, dimension, n_parameters)`.
+    """
+    n_parameters = len(eigensystem.k_derivatives)
+    n_zones = eigensystem.k_eigenvectors.shape[1]
+    dimension = eigensystem.k_eigenvectors.shape[2]
+    out = np.empty((2*n_zones - 1, dimension, dimension, n_parameters),
+                   dtype=np.complex128)
+    shifted_k_eigenbra = np.zeros((n_zones, dimension), dtype=np.complex128)
+    expectation_left = np.empty((n_parameters, n_zones * dimension),
+                                dtype=np.complex128)
+    k_eigenkets = eigensystem.k_eigenvectors
+    for diff_index, diff in enumerate(range(1 - n_zones, n_zones)):
+        for i in range(dimension):
+            _conjugate_shift_into(shifted_k_eigenbra, k_eigenkets[i], diff)
+            bra = shifted_k_eigenbra.ravel()
+            for p in range(n_parameters):
+                expectation_left[p] =\
+                    _column_sparse_ldot(bra, eigensystem.k_derivatives[p])
+            for j in range(dimension):
+                for parameter in range(n_parameters):
+                    out[diff_index, i, j, parameter] =\
+                        expectation_left[parameter] @ k_eigenkets[j].ravel()
+    return out
+
+@numba.njit(cache=True, nogil=True)
+def _second_order_factors(expectations, differences, energies, frequency,
+                          time):
+    """
+    Calculate
+        out[a, b, i, k] = sum_{j, D1, D2} M_a[D1, i, j] M_b[D2, j, k]
+                          * exp[z_i, z_j(D1), z_k(D1 + D2)],
+    where `M_p[D]` are the `shifted_expectations()` for parameter `p` at the
+    zone shifts `differences`, `exp[...]` is the second divided difference of `exp`, and
+        z_j(D) = -i (energies[j] - D frequency) time.
+    This is the doubly time-ordered integral of the second-order term of
+    `d2u_dcontrols()`, divided by `time^2`.
+    """
+    n_differences, dimension = expectations.shape[0], expectations.shape[1]
+    n_parameters = expectations.shape[3]
+    out = np.zeros((n_parameters, n_parameters, dimension, dimension),
+                   dtype=np.complex128)
+    inner = np.empty(n_parameters, dtype=np.complex128)
+    for i in range(dimension):
+        z_i = -1j * time * energies[i]
+        for j in range(dimension):
+            for first in range(n_differences):
+                shift = differences[first]
+                z_j = -1j * time * (energies[j] - shift*frequency)
+                left = expectations[first, i, j]
+                for k in range(dimension):
+                    inner[:] = 0.0
+                    for second in range(n_differences):
+                        total = shift + differences[second]
+                        z_k = -1j * time * (energies[k] - total*frequency)
+                        factor = _exp_difference_2(z_i, z_j, z_k)
+                        right = expectations[second, j, k]
+                        for b in range(n_parameters):
+                            inner[b] += right[b] * factor
+                    for a in range(n_parameters):
+                        for b in range(n_parameters):
+                            out[a, b, i, k] += left[a] * inner[b]
+    return out
+
+def d2u_dcontrols(eigensystem, time, k_second_derivatives=None, cutoff=1e-14):
+    """
+    Calculate the second derivatives of the time-evolution operator with
+    respect to each pair of control parameters at a certain time, with shape
+    `(n_parameters, n_parameters, dimension, dimension)`, using a pre-computed
+    eigensystem (which, as for `du_dcontrols()`, must have been created with
+    the Hamiltonian derivatives).
+
+    These are the second-order Dyson terms
+        -sum_{i,j,k} |phi_i(t)> <phi_i|dK_a|phi_j> <phi_j|dK_b|phi_k> <phi_k(0)|
+         * (doubly time-ordered integral of the phases) + (a <-> b),
+    summed over the zone shifts of the matrix elements, plus the first-order
+    term of the second derivatives of the Hamiltonian.  The integrals are
+    second divided differences of `exp` at the (shifted) quasienergies.
+    `k_second_derivatives` are the lifts (as from `assemble_dk()`) of the
+    second derivatives `d^2 H / dc_a dc_b` for `a <= b` in row-major order, or
+    `None` if the Hamiltonian is linear in the controls, when the result is
+    exact up to the precision of the eigensystem.
+
+    Zone shifts whose matrix elements are all below `cutoff` times the largest
+    are left out of the sums, which then cost
+    `O(dimension^3 n_shifts (n_shifts n_parameters + n_parameters^2))`.
+    """
+    n_parameters = len(eigensystem.k_derivatives)
+    n_zones, dimension = eigensystem.k_eigenvectors.shape[1:3]
+    out = np.zeros((n_parameters, n_parameters, dimension, dimension),
+                   dtype=np.complex128)
+    if n_parameters == 0:
+        return out
+    expectations = shifted_expectations(eigensystem)
+    scales = np.max(np.abs(expectations), axis=(1, 2, 3))
+    keep = scales > cutoff * np.max(scales)
+    differences = np.arange(1.0 - n_zones, n_zones)[keep]
+    factors = _second_order_factors(np.ascontiguousarray(expectations[keep]),
+                                    differences, eigensystem.quasienergies,
+                                    eigensystem.frequency, time)
+    factors = factors + np.swapaxes(factors, 0, 1)
+    kets = current_floquet_kets(eigensystem, time)
+    out -= time**2 * (kets.T @ factors @ eigensystem.initial_floquet_bras)
+    if k_second_derivatives is not None:
+        pairs = du_dcontrols(eigensystem._replace(
+                                 k_derivatives=list(k_second_derivatives)),
+                             time)
+        rows, columns = np.triu_indices(n_parameters)
+        out[rows, columns] += pairs
+        out[columns[rows != columns], rows[rows != columns]]\
+            += pairs[rows != columns]
+    return out
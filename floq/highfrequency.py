@@ -0,0 +1,319 @@
+"""
+A high-frequency (van Vleck) expansion engine for Floquet systems, which
+neither builds the Floquet matrix nor integrates over a period.  When the
+frequency is large compared with the drive, the evolution factorises as
+    U(t) = exp(-i K(t)) exp(-i H_eff t) exp(i K(0)),
+with a time-independent effective Hamiltonian `H_eff` and a periodic,
+Hermitian kick operator `K(t)` (the micromotion), both as series in
+`1 / frequency` built from commutators of the Fourier blocks of the
+Hamiltonian.  To lowest orders (with `H(t) = sum_m H_m exp(i m frequency t)`)
+    H_eff = H_0 + sum_{m > 0} [H_m, H_{-m}] / (m frequency) + ...,
+    K(t) = -i sum_{m != 0} H_m exp(i m frequency t) / (m frequency) + ....
+The stroboscopic Floquet-Magnus Hamiltonian of any starting time `t0` is the
+same operator in another gauge, `exp(-i K(t0)) H_eff exp(i K(t0))`.
+
+Every order is found by the same recursion.  The rotating frame
+`exp(i K(t))` transforms the Hamiltonian into
+    sum_k ad_{iK}^k(H) / k! - sum_k ad_{iK}^k(dK/dt) / (k+1)!,
+and at each order in `1 / frequency` the terms which are already known are
+collected: their mean is the next term of `H_eff`, and their oscillating part
+must be cancelled by the time derivative of the next term of `K`, which fixes
+it.  The control derivatives are carried through the recursion alongside the
+operators themselves (every operator is stored with its derivatives stacked
+along the first axis), so they are exact derivatives of the truncated series.
+
+Nothing here depends on the number of zones: the expansion costs a number of
+`dim x dim` products set by the order and the number of Fourier modes, and
+`u()` and `du_dcontrols()` need only three eigendecompositions.  The residual
+of the Schroedinger equation of the truncated propagator is sampled over a
+period to estimate the error of `U(T)`, so callers (such as
+`floq.HighFrequencySystem`) can fall back to the full Floquet solve when the
+expansion is not good enough.  The estimate comes from sampling, so it is not
+a guaranteed bound.
+"""
+
+import numpy as np
+from .monodromy import _at, _exp_divided_differences, _time_domain,\
+                       fourier_eigensystem
+
+# The fewest times per period the residual is sampled at.
+_MIN_ERROR_SAMPLES = 32
+
+def _product(a, b):
+    """
+    The product of two operators stored with their control derivatives, as
+    arrays of shape `(1 + n_controls, dim, dim)`.
+    """
+    out = a[0] @ b
+    out[1:] += a[1:] @ b[0]
+    return out
+
+def _accumulate(into, key, value):
+    if key in into:
+        into[key] = into[key] + value
+    else:
+        into[key] = value
+
+def _commutator(a, b, max_order):
+    """
+    The commutator of two graded operators, dictionaries mapping
+    `(order, mode)` to stacked operators, dropping orders above `max_order`.
+    """
+    out = {}
+    for (order_a, mode_a), x in a.items():
+        for (order_b, mode_b), y in b.items():
+            if order_a + order_b <= max_order:
+                _accumulate(out, (order_a + order_b, mode_a + mode_b),
+                            _product(x, y) - _product(y, x))
+    return out
+
+def _transformed_order(hamiltonian, kick, frequency, order):
+    """
+    The terms of the Hamiltonian in the rotating frame of the graded `kick`
+    at exactly `order`, not including the time derivative of the unknown term
+    of the kick at `order + 1`, as a dictionary of `mode: stacked operator`.
+    """
+    generator = {key: 1j*value for key, value in kick.items()}
+    derivative = {(kick_order - 1, mode): 1j*mode*frequency*value
+                  for (kick_order, mode), value in kick.items()}
+    total = {}
+    for start, weight in ((hamiltonian, 1), (derivative, -1)):
+        # The k-th terms of the two series are ad^k / k! and ad^k / (k+1)!.
+        term, denominator = start, 1 if weight > 0 else 2
+        for key, value in term.items():
+            _accumulate(total, key, weight * value)
+        for k in range(1, order + 1):
+            term = _commutator(generator, term, order)
+            term = {key: value / (k + denominator - 1)
+                    for key, value in term.items()}
+            for key, value in term.items():
+                _accumulate(total, key, weight * value)
+    return {mode: value for (term_order, mode), value in total.items()
+            if term_order == order}
+
+def _stack(hamiltonian, dhamiltonians, hermitian):
+    """
+    The Fourier modes of the Hamiltonian and its control derivatives as a
+    graded operator of order zero, each mode stacked with its derivatives.
+    """
+    operators = [_time_domain(hamiltonian, hermitian)]\
+                + [_time_domain(dh, hermitian) for dh in dhamiltonians]
+    dimension = operators[0][1].shape[-1]
+    out = {}
+    for index, (modes, matrices) in enumerate(operators):
+        for mode, matrix in zip(modes, matrices):
+            if (0, mode) not in out:
+                out[0, mode] = np.zeros((len(operators), dimension, dimension),
+                                        dtype=np.complex128)
+            out[0, mode][index] += matrix
+    return out
+
+def _exponential(generator):
+    """
+    `exp(-i generator)` of a Hermitian `generator` stored with its control
+    derivatives, with the derivatives of the exponential from the
+    Daleckii-Krein formula.  Returns `(exponential, derivatives)`.
+    """
+    value = generator[0]
+    values, vectors = np.linalg.eigh(0.5 * (value + np.conj(value.T)))
+    adjoint = np.conj(vectors.T)
+    exponential = (vectors * np.exp(-1j * values)) @ adjoint
+    derivatives = vectors @ ((adjoint @ generator[1:] @ vectors)
+                             * _exp_divided_differences(values)) @ adjoint
+    return exponential, derivatives
+
+
+class Expansion:
+    """
+    The high-frequency expansion of a periodic Hamiltonian to a given order in
+    `1 / frequency`, from which everything else is calculated.  This is the
+    high-frequency counterpart of `types.Eigensystem`.
+
+    Attributes --
+    frequency: float
+    period: float
+    order: int
+    effective_hamiltonian: 2D np.array of complex --
+        The van Vleck effective Hamiltonian, including every term up to
+        `frequency^-order`.
+    kick_modes: 1D np.array of int
+    kick: np.array(shape=(n_modes, dim, dim)) --
+        The Fourier blocks of the kick operator at `kick_modes`, including
+        every term up to `frequency^-(order + 1)`.
+    quasienergies: 1D np.array of float --
+        The eigenvalues of `effective_hamiltonian`, folded into the first
+        Brillouin zone.
+    error: float --
+        The estimate of `|U(T) - U_exact(T)|` over one period (see
+        `error_estimate()`).
+    """
+    def __init__(self, hamiltonian, dhamiltonian, frequency, order=2,
+                 hermitian=False, error_samples=None):
+        """
+        Arguments --
+        hamiltonian: types.TransformedMatrix
+        dhamiltonian: iterable of types.TransformedMatrix | None
+        frequency: float
+        order: int >= 0 --
+            The highest power of `1 / frequency` kept in the effective
+            Hamiltonian.  The kick operator is kept to one order higher, so
+            that the error of the propagator over a period falls as
+            `frequency^-(order + 1)`.  The cost grows quickly with the order.
+        hermitian: bool --
+            Whether only the modes `>= 0` are given, as for
+            `floq.evolution.eigensystem()`.
+        error_samples: int > 0 | None --
+            The number of times per period the residual is sampled at for the
+            error estimate, by default enough to resolve the kick operator.
+        """
+        if order < 0:
+            raise ValueError("The order of the expansion must be at least 0.")
+        self.frequency = frequency
+        self.period = 2*np.pi / frequency
+        self.order = order
+        self.hermitian = hermitian
+        self._dhamiltonian = dhamiltonian
+        self._time_hamiltonian = _time_domain(hamiltonian, hermitian)
+        stacked = _stack(hamiltonian,
+                         () if dhamiltonian is None else dhamiltonian,
+                         hermitian)
+        dimension = self._time_hamiltonian[1].shape[-1]
+        n_stacked = 1 + (0 if dhamiltonian is None else len(dhamiltonian))
+        effective = np.zeros((n_stacked, dimension, dimension),
+                             dtype=np.complex128)
+        kick = {}
+        for n in range(order + 1):
+            terms = _transformed_order(stacked, kick, frequency, n)
+            for mode, value in terms.items():
+                if mode == 0:
+                    effective += value
+                else:
+                    kick[n + 1, mode] = value / (1j * mode * frequency)
+        kick_modes = sorted({mode for _, mode in kick})
+        self._effective = effective
+        self._kick = np.zeros((len(kick_modes),) + self._effective.shape,
+                              dtype=np.complex128)
+        for (_, mode), value in kick.items():
+            self._kick[kick_modes.index(mode)] += value
+        self.kick_modes = np.array(kick_modes, dtype=np.int64)
+        self.effective_hamiltonian = self._effective[0]
+        self.kick = self._kick[:, 0]
+        values, vectors = np.linalg.eigh(
+            0.5 * (self.effective_hamiltonian
+                   + np.conj(self.effective_hamiltonian.T)))
+        zones = np.round(values / frequency)
+        sort = np.argsort(values - zones*frequency)
+        self.quasienergies = (values - zones*frequency)[sort]
+        self._zones = zones[sort]
+        self._states = vectors[:, sort]
+        self._initial = _exponential(-self._kick_at(0.0))
+        if error_samples is None:
+            highest = max((abs(mode) for mode in kick_modes), default=0)
+            error_samples = max(_MIN_ERROR_SAMPLES, 8*highest)
+        self.error = error_estimate(self, error_samples)
+        self._eigensystems = {}
+
+    def _kick_at(self, time):
+        """The kick operator at `time`, stacked with its derivatives."""
+        return _at((self.kick_modes, self._kick), self.frequency, time)
+
+    def micromotion(self, time):
+        """The periodic micromotion operator `exp(-i K(time))`."""
+        return _exponential(self._kick_at(time)[:1])[0]
+
+    def floquet_hamiltonian(self, time=0.0):
+        """
+        The stroboscopic Floquet-Magnus Hamiltonian of periods starting at
+        `time`, `exp(-i K(time)) H_eff exp(i K(time))`.
+        """
+        micromotion = self.micromotion(time)
+        return micromotion @ self.effective_hamiltonian\
+               @ np.conj(micromotion.T)
+
+
+def error_estimate(expansion, n_samples=_MIN_ERROR_SAMPLES):
+    """
+    Estimate the error of the propagator of `expansion` over one period.  The
+    truncated propagator `V(t)` exactly solves the Schroedinger equation of
+        H(t) + G(t),   G(t) = i (dV/dt) V^dagger - H(t),
+    so `|V(t) - U(t)| <= integral_0^t |G(s)| ds` in the spectral norm.  The
+    residual `G` is periodic, and is sampled at `n_samples` evenly spaced times
+    to integrate it over one period.  That integral would be a bound, but the
+    sampled mean only estimates it: a residual peaked between the samples is
+    underestimated, so the result is not a guaranteed bound.
+    """
+    frequency = expansion.frequency
+    times = expansion.period * np.arange(n_samples) / n_samples
+    modes = expansion.kick_modes
+    # The time derivative of the kick takes the place of the derivatives with
+    # respect to the controls, to differentiate the micromotion in time.
+    kick = (modes, np.stack([expansion.kick,
+                             1j * frequency * modes[:, np.newaxis, np.newaxis]
+                             * expansion.kick], axis=1))
+    norms = np.empty(n_samples)
+    for n, time in enumerate(times):
+        micromotion, derivative = _exponential(_at(kick, frequency, time))
+        adjoint = np.conj(micromotion.T)
+        residual = micromotion @ expansion.effective_hamiltonian @ adjoint\
+                   + 1j * derivative[0] @ adjoint\
+                   - _at(expansion._time_hamiltonian, frequency, time)
+        norms[n] = np.linalg.norm(residual, 2)
+    return expansion.period * np.mean(norms)
+
+def error_estimate_at(expansion, time):
+    """
+    Estimate `|U(time) - U_exact(time)|` in the spectral norm from the
+    estimated error over one period (see `error_estimate()`).  The integral of
+    the periodic residual grows linearly with the number of periods started,
+    so this is exactly as reliable as the estimate over one period.  It says
+    nothing about the error of `du_dcontrols()`, which is typically several
+    times larger.
+    """
+    return expansion.error * max(1, np.ceil(abs(time) / expansion.period))
+
+def u(expansion, time):
+    """The time-evolution operator at `time`."""
+    final, _ = _exponential(expansion._kick_at(time)[:1])
+    evolution, _ = _exponential(time * expansion._effective[:1])
+    return final @ evolution @ expansion._initial[0]
+
+def du_dt(expansion, time):
+    """The time derivative of the time-evolution operator at `time`."""
+    hamiltonian = _at(expansion._time_hamiltonian, expansion.frequency, time)
+    return -1j * hamiltonian @ u(expansion, time)
+
+def du_dcontrols(expansion, time):
+    """
+    The derivatives of the time-evolution operator at `time` with respect to
+    each of the controls, with shape `(n_controls, dim, dim)`.
+    """
+    if expansion._dhamiltonian is None:
+        raise ValueError("The derivatives of the Hamiltonian were not given.")
+    final, dfinal = _exponential(expansion._kick_at(time))
+    evolution, devolution = _exponential(time * expansion._effective)
+    initial, dinitial = expansion._initial
+    return dfinal @ evolution @ initial\
+           + final @ devolution @ initial\
+           + final @ evolution @ dinitial
+
+def eigensystem(expansion, n_zones, decimals=8):
+    """
+    Return the `types.Eigensystem` of the Floquet matrix with `n_zones` zones
+    equivalent to `expansion`.  The Floquet modes are
+        |phi_j(t)> = exp(-i n_j frequency t) exp(-i K(t)) |state_j>,
+    where `|state_j>` are the eigenvectors of the effective Hamiltonian and
+    `n_j` the zones their eigenvalues were folded from.
+    """
+    if n_zones in expansion._eigensystems:
+        return expansion._eigensystems[n_zones]
+    n_samples = max(2*n_zones, _MIN_ERROR_SAMPLES)
+    times = expansion.period * np.arange(n_samples) / n_samples
+    modes = np.array([
+        expansion.micromotion(time) @ expansion._states
+        * np.exp(-1j * expansion.frequency * time * expansion._zones)
+        for time in times])
+    out = fourier_eigensystem(expansion.frequency, expansion.quasienergies,
+                              modes, expansion._dhamiltonian, n_zones,
+                              expansion.hermitian, decimals)
+    expansion._eigensystems[n_zones] = out
+    return out
@@ -47,6 +47,55 @@ def gram_schmidt(vecs):
     return result
 
 
+def _as_operators(dus):
+    """The derivatives `dus` as one contiguous (n_params, dim, dim) array."""
+    return np.ascontiguousarray(dus, dtype=np.complex128)
+
+def _subspace_indices(subspace, dimension):
+    if subspace is None:
+        return np.arange(dimension)
+    return np.ascontiguousarray(subspace, dtype=np.int64)
+
+@numba.njit(cache=True, nogil=True)
+def _bra_operators_ket(bra, operators, ket, out):
+    """out[p] = <bra| operators[p] |ket>, without temporaries."""
+    for p in range(operators.shape[0]):
+        total = 0.0j
+        for i in range(operators.shape[1]):
+            row = 0.0j
+            for j in range(operators.shape[2]):
+                row += operators[p, i, j] * ket[j]
+            total += np.conj(bra[i]) * row
+        out[p] = total
+
+@numba.njit(cache=True, nogil=True)
+def _subspace_overlaps(left, operators, subspace, out):
+    """
+    out[p] = sum_{ij} conj(left[i, j]) operators[p, s_i, s_j], where `s` is
+    `subspace` and `left` is a (len(s), len(s)) matrix.  With `left` the target
+    this is tr(target^dagger U_s), the trace of the product on the subspace.
+    """
+    n = subspace.shape[0]
+    for p in range(operators.shape[0]):
+        total = 0.0j
+        for i in range(n):
+            for j in range(n):
+                total += np.conj(left[i, j])\
+                         * operators[p, subspace[i], subspace[j]]
+        out[p] = total
+
+def _overlaps(left, operators, subspace):
+    operators = _as_operators(operators)
+    subspace = _subspace_indices(subspace, operators.shape[1])
+    left = np.ascontiguousarray(left, dtype=np.complex128)
+    out = np.empty(operators.shape[0], dtype=np.complex128)
+    _subspace_overlaps(left, operators, subspace, out)
+    return out
+
+def _restrict(u, subspace):
+    return u if subspace is None else u[np.ix_(subspace, subspace)]
+
+
 def transfer_fidelity(u, initial, final):
     """Compute how well the unitary u transfers an initial state |i> to a final
     state |f>, quantified by fid = |<f| u |i>|^2 = <f| u |i><i| u |f>.
@@ -56,14 +105,26 @@ def transfer_fidelity(u, initial, final):
 
 def d_transfer_fidelity(u, dus, initial, final):
     """Calculate the gradient of the transfer fidelity:
-        fid' = (<f|u|i><i|u|f>)'z
+        fid' = (<f|u|i><i|u|f>)'
              = <f|u'|i><i|u|f> + <f|u|i><i|u'|f>
-             = 2 Re(<f|u'|i><i|u|f>)."""
-    iuf = inner(initial, np.conj(u.T), final)
-    fui = inner(final, u, initial)
-    return np.real(np.array([inner(final, du, initial) * iuf +
-                             inner(initial, np.conj(du.T), final) * fui
-                             for du in dus]))
+             = 2 Re(<f|u'|i> conj(<f|u|i>))."""
+    dus = _as_operators(dus)
+    final = np.ascontiguousarray(final, dtype=np.complex128).reshape(-1)
+    initial = np.ascontiguousarray(initial, dtype=np.complex128).reshape(-1)
+    d_amplitudes = np.empty(dus.shape[0], dtype=np.complex128)
+    _bra_operators_ket(final, dus, initial, d_amplitudes)
+    return 2 * np.real(d_amplitudes * np.conj(inner(final, u, initial)))
+
+def d2_transfer_fidelity(u, dus, d2us, initial, final):
+    """Calculate the Hessian of the transfer fidelity:
+        fid'' = 2 Re(<f|u'|i> conj(<f|u'|i>)^T + <f|u''|i> conj(<f|u|i>))."""
+    final = np.asarray(final, dtype=np.complex128).reshape(-1)
+    initial = np.asarray(initial, dtype=np.complex128).reshape(-1)
+    d_amplitudes = np.conj(final) @ np.asarray(dus) @ initial
+    d2_amplitudes = np.conj(final) @ np.asarray(d2us) @ initial
+    amplitude = np.conj(final) @ u @ initial
+    return 2 * np.real(np.outer(d_amplitudes, np.conj(d_amplitudes))
+                       + d2_amplitudes * np.conj(amplitude))
 
 
 def transfer_distance(u, initial, final):
@@ -75,6 +136,10 @@ def d_transfer_distance(u, dus, initial, final):
     """Gradient of the transfer distance."""
     return -d_transfer_fidelity(u, dus, initial, final)
 
+def d2_transfer_distance(u, dus, d2us, initial, final):
+    """Hessian of the transfer distance."""
+    return -d2_transfer_fidelity(u, dus, d2us, initial, final)
+
 
 def operator_fidelity(u, target):
     """Calculate the operator fidelity between the unitaries
@@ -84,8 +149,17 @@ def operator_fidelity(u, target):
     return hilbert_schmidt_product(target, u).real / u.shape[0]
 
 def d_operator_fidelity(u, dus, target):
-    """Calculate the gradient of the operator fidelity."""
-    return np.array([operator_fidelity(du, target) for du in dus])
+    """Calculate the gradient of the operator fidelity, for all the parameters
+    in one compiled pass over the (n_params, dim, dim) array dus."""
+    return np.real(_overlaps(target, dus, None)) / u.shape[0]
+
+def d2_operator_fidelity(u, d2us, target):
+    """Calculate the Hessian of the operator fidelity from the
+    (n_params, n_params, dim, dim) array of second derivatives d2us, since the
+    fidelity is linear in u."""
+    d2us = np.asarray(d2us)
+    flat = d2us.reshape(d2us.shape[:2] + (-1,))
+    return np.real(flat @ np.conj(np.ravel(target))) / u.shape[0]
 
 
 def operator_distance(u, target):
@@ -103,12 +177,65 @@ def d_operator_distance(u, dus, target):
     """Calculate the gradient of the operator distance."""
     return -d_operator_fidelity(u, dus, target)
 
+def d2_operator_distance(u, d2us, target):
+    """Calculate the Hessian of the operator distance."""
+    return -d2_operator_fidelity(u, d2us, target)
+
+
+def subspace_gate_fidelity(u, target, subspace=None):
+    """Calculate the phase-insensitive fidelity of the gate u on a subspace,
+        |tr(target^dagger u_s)|^2 / d^2,
+    where u_s is u restricted to the rows and columns `subspace` (an array of
+    indices, or None for the whole space), and target is the d x d gate on the
+    subspace.  Any population leaking out of the subspace lowers this."""
+    overlap = hilbert_schmidt_product(target, _restrict(u, subspace))
+    return np.abs(overlap)**2 / target.shape[0]**2
+
+def d_subspace_gate_fidelity(u, dus, target, subspace=None):
+    """Calculate the gradient of the subspace gate fidelity."""
+    overlap = hilbert_schmidt_product(target, _restrict(u, subspace))
+    d_overlaps = _overlaps(target, dus, subspace)
+    return 2 * np.real(np.conj(overlap) * d_overlaps) / target.shape[0]**2
+
+def leakage(u, subspace):
+    """Calculate the average probability of leaving the subspace with indices
+    `subspace` under u, starting from a state in it:
+        1 - |u_s|_F^2 / d."""
+    u_s = _restrict(u, subspace)
+    return 1.0 - np.real(np.vdot(u_s, u_s)) / u_s.shape[0]
+
+def d_leakage(u, dus, subspace):
+    """Calculate the gradient of the leakage."""
+    u_s = _restrict(u, subspace)
+    return -2 * np.real(_overlaps(u_s, dus, subspace)) / u_s.shape[0]
+
+def average_gate_fidelity(u, target, subspace=None):
+    """Calculate the gate fidelity averaged uniformly over pure input states
+    in the subspace (Nielsen, Phys. Lett. A 303, 249 (2002)):
+        (|tr(target^dagger u_s)|^2 + tr(u_s^dagger u_s)) / (d (d + 1)).
+    The second term makes this correct even when u_s is not unitary because
+    of leakage."""
+    u_s = _restrict(u, subspace)
+    d = target.shape[0]
+    overlap = hilbert_schmidt_product(target, u_s)
+    return (np.abs(overlap)**2 + np.real(np.vdot(u_s, u_s))) / (d*(d + 1))
+
+def d_average_gate_fidelity(u, dus, target, subspace=None):
+    """Calculate the gradient of the average gate fidelity."""
+    u_s = _restrict(u, subspace)
+    d = target.shape[0]
+    overlap = hilbert_schmidt_product(target, u_s)
+    d_overlaps = _overlaps(target, dus, subspace)
+    d_norms = _overlaps(u_s, dus, subspace)
+    return 2 * np.real(np.conj(overlap)*d_overlaps + d_norms) / (d*(d + 1))
+
 
 def inner(left, operator, right):
-    """Compute <left|operator|right>."""
-    leftconj = np.transpose(np.conj(left))
-    return np.conj(left.T) @ operator @ right
+    """Compute <left|operator|right>.  This is a scalar for 1D kets, and a
+    (1, 1) array for column-vector kets."""
+    return np.conj(left.T) @ (operator @ right)
 
 def hilbert_schmidt_product(a, b):
-    """Compute the Hilbert-Schmidt inner product between operators a and b."""
-    return np.trace(np.conj(a.T) @ b)
+    """Compute the Hilbert-Schmidt inner product between operators a and b,
+    tr(a^dagger b), without forming the matrix product."""
+    return np.vdot(a, b)
@@ -0,0 +1,286 @@
+"""
+A time-domain engine for Floquet systems, which never builds the extended
+Floquet space.  The Schroedinger equation is integrated over one period of the
+Hamiltonian
+    H(t) = sum_m H_m exp(i m frequency t),
+built from the same `types.TransformedMatrix` as the Floquet matrix, and the
+evolution at any later time follows from powers of the one-period propagator
+`U(T)` (the monodromy matrix).  Each period costs `n_steps` products and
+eigendecompositions of `dim x dim` matrices, against a solve of size
+`n_zones * dim` for the Floquet matrix, so this is much cheaper for weakly
+driven systems which still need many zones.
+
+The integrator takes fourth-order Magnus steps with two Gauss-Legendre nodes.
+Each step is exponentiated exactly through the eigendecomposition of its
+Hermitian generator, so the propagators are unitary to rounding error.  The
+control derivatives are the exact derivatives of this discrete propagator:
+each step's exponential is differentiated in the eigenbasis of its generator
+(the Daleckii-Krein formula), and carried through the product of steps.  Beyond
+the first period, the powers of `U(T)` are differentiated in its eigenbasis in
+the same way.
+
+The quasienergies are the phases of the eigenvalues of `U(T)`, and the Floquet
+modes are recovered from the propagators on the grid by a discrete Fourier
+transform, so `eigensystem()` gives a `types.Eigensystem` which can be used
+anywhere the Floquet-matrix one can.
+"""
+
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+from . import types
+from .evolution import assemble_dk
+
+# The Gauss-Legendre nodes of a step, as fractions of its length, and the
+# weight of the commutator term of the fourth-order Magnus expansion.
+_NODES = (0.5 - np.sqrt(3)/6, 0.5 + np.sqrt(3)/6)
+_COMMUTATOR = np.sqrt(3) / 12
+
+def _time_domain(operator, hermitian):
+    """
+    Return `(modes, matrices)` of `operator` as dense arrays, with the negative
+    modes filled in if `hermitian`.
+    """
+    modes, matrices = [], []
+    for mode, matrix in zip(operator.mode, operator.matrix):
+        matrix = matrix.toarray() if scipy.sparse.issparse(matrix) else matrix
+        matrix = np.asarray(matrix, dtype=np.complex128)
+        modes.append(mode)
+        matrices.append(matrix)
+        if hermitian and mode != 0:
+            modes.append(-mode)
+            matrices.append(np.conj(matrix.T))
+    return np.array(modes), np.array(matrices)
+
+def _at(operator, frequency, time):
+    """The time-domain operator at `time`."""
+    modes, matrices = operator
+    return np.tensordot(np.exp(1j * frequency * time * modes), matrices,
+                        axes=1)
+
+def _exp_divided_differences(values):
+    """
+    The divided differences of `exp(-i x)` between every pair of `values`,
+    `(exp(-i x_j) - exp(-i x_k)) / (x_j - x_k)`, with the derivative on the
+    diagonal, in a form which is stable for close values.
+    """
+    difference = values[:, np.newaxis] - values[np.newaxis, :]
+    mean = 0.5 * (values[:, np.newaxis] + values[np.newaxis, :])
+    return -1j * np.exp(-1j * mean) * np.sinc(difference / (2*np.pi))
+
+def _power_divided_differences(phases, power):
+    """
+    The divided differences of `z^power` between every pair of the unit
+    complex numbers `exp(-i phases)`, with the derivative on the diagonal.
+    """
+    difference = phases[:, np.newaxis] - phases[np.newaxis, :]
+    # Take the shorter way round the circle, so the only zero of the
+    # denominator is at zero difference.
+    difference = difference - 2*np.pi*np.round(difference / (2*np.pi))
+    mean = phases[:, np.newaxis] - 0.5*difference
+    denominator = np.sin(0.5 * difference)
+    small = np.abs(denominator) < 1e-12
+    ratio = np.where(small, power,
+                     np.sin(0.5 * power * difference)
+                     / np.where(small, 1.0, denominator))
+    return np.exp(-1j * (power - 1) * mean) * ratio
+
+def _step(hamiltonian, dhamiltonians, frequency, start, size):
+    """
+    Return the propagator of one fourth-order Magnus step of length `size` from
+    `start`, and its derivatives with respect to each control as an array of
+    shape `(n_controls, dim, dim)`.
+    """
+    h1 = _at(hamiltonian, frequency, start + _NODES[0]*size)
+    h2 = _at(hamiltonian, frequency, start + _NODES[1]*size)
+    # `exp(-i generator)` is the step, with a Hermitian generator.
+    generator = 0.5*size*(h1 + h2) - 1j*_COMMUTATOR*size**2 * (h2@h1 - h1@h2)
+    values, vectors = np.linalg.eigh(0.5 * (generator + np.conj(generator.T)))
+    adjoint = np.conj(vectors.T)
+    step = (vectors * np.exp(-1j * values)) @ adjoint
+    if not dhamiltonians:
+        return step, np.zeros((0,) + step.shape, dtype=np.complex128)
+    d1 = np.array([_at(dh, frequency, start + _NODES[0]*size)
+                   for dh in dhamiltonians])
+    d2 = np.array([_at(dh, frequency, start + _NODES[1]*size)
+                   for dh in dhamiltonians])
+    dgenerator = 0.5*size*(d1 + d2)\
+                 - 1j*_COMMUTATOR*size**2 * (d2@h1 - h1@d2 + h2@d1 - d1@h2)
+    dstep = vectors @ ((adjoint @ dgenerator @ vectors)
+                       * _exp_divided_differences(values)) @ adjoint
+    return step, dstep
+
+
+class Monodromy:
+    """
+    The propagators of a periodic Hamiltonian at `n_steps + 1` evenly spaced
+    times over its first period, and their control derivatives, from which
+    everything else is calculated.  This is the time-domain counterpart of
+    `types.Eigensystem`.
+
+    Attributes --
+    frequency: float
+    period: float
+    n_steps: int
+    propagators: np.array(shape=(n_steps + 1, dim, dim))
+    derivatives: np.array(shape=(n_steps + 1, n_controls, dim, dim)) | None
+    quasienergies: 1D np.array of float --
+        The quasienergies, in the first Brillouin zone.
+    states: 2D np.array of complex --
+        The eigenvectors of `U(T)` (the Floquet states at `t = 0`) as columns,
+        in the same order as `quasienergies`.
+    """
+    def __init__(self, hamiltonian, dhamiltonian, frequency, n_steps=256,
+                 hermitian=False):
+        """
+        Arguments --
+        hamiltonian: types.TransformedMatrix
+        dhamiltonian: iterable of types.TransformedMatrix | None
+        frequency: float
+        n_steps: int > 0 -- The number of integration steps per period.
+        hermitian: bool --
+            Whether only the modes `>= 0` are given, as for
+            `floq.evolution.eigensystem()`.
+        """
+        self.frequency = frequency
+        self.period = 2*np.pi / frequency
+        self.n_steps = n_steps
+        self.hermitian = hermitian
+        self._dhamiltonian = dhamiltonian
+        self._time_hamiltonian = _time_domain(hamiltonian, hermitian)
+        self._time_dhamiltonians = []\
+            if dhamiltonian is None\
+            else [_time_domain(dh, hermitian) for dh in dhamiltonian]
+        self._eigensystems = {}
+        dimension = hamiltonian.matrix[0].shape[0]
+        size = self.period / n_steps
+        propagators = np.empty((n_steps + 1, dimension, dimension),
+                               dtype=np.complex128)
+        propagators[0] = np.eye(dimension)
+        derivatives = np.zeros((n_steps + 1, len(self._time_dhamiltonians),
+                                dimension, dimension), dtype=np.complex128)
+        for n in range(n_steps):
+            step, dstep = _step(self._time_hamiltonian,
+                                self._time_dhamiltonians, frequency, n*size,
+                                size)
+            propagators[n + 1] = step @ propagators[n]
+            derivatives[n + 1] = dstep @ propagators[n] + step @ derivatives[n]
+        self.propagators = propagators
+        self.derivatives = None if dhamiltonian is None else derivatives
+        # `U(T)` is normal, so its complex Schur form is diagonal and the
+        # Schur vectors are orthonormal eigenvectors, even when degenerate.
+        form, states = scipy.linalg.schur(propagators[-1], output='complex')
+        phases = -np.angle(np.diag(form))
+        order = np.argsort(phases)
+        self._phases = phases[order]
+        self.quasienergies = self._phases / self.period
+        self.states = states[:, order]
+
+    def _locate(self, time):
+        """
+        Split `time` into a whole number of periods, a grid point of the first
+        period, and a remainder shorter than one step.
+        """
+        periods = int(np.floor(time / self.period))
+        offset = time - periods*self.period
+        size = self.period / self.n_steps
+        index = min(int(offset // size), self.n_steps - 1)
+        return periods, index, offset - index*size
+
+    def _within_period(self, index, remainder, derivatives=False):
+        """The propagator (and its derivatives) at a time in the first period."""
+        propagator = self.propagators[index]
+        derivative = None if not derivatives else self.derivatives[index]
+        if remainder <= 1e-14 * self.period:
+            return propagator, derivative
+        step, dstep = _step(self._time_hamiltonian,
+                            self._time_dhamiltonians if derivatives else [],
+                            self.frequency,
+                            index * self.period / self.n_steps, remainder)
+        if derivatives:
+            derivative = dstep @ propagator + step @ derivative
+        return step @ propagator, derivative
+
+    def _power(self, periods):
+        """`U(T)^periods`."""
+        return (self.states * np.exp(-1j * periods * self._phases))\
+               @ np.conj(self.states.T)
+
+
+def u(monodromy, time):
+    """The time-evolution operator at `time`."""
+    periods, index, remainder = monodromy._locate(time)
+    within, _ = monodromy._within_period(index, remainder)
+    return within @ monodromy._power(periods)
+
+def du_dt(monodromy, time):
+    """The time derivative of the time-evolution operator at `time`."""
+    hamiltonian = _at(monodromy._time_hamiltonian, monodromy.frequency, time)
+    return -1j * hamiltonian @ u(monodromy, time)
+
+def du_dcontrols(monodromy, time):
+    """
+    The derivatives of the time-evolution operator at `time` with respect to
+    each of the controls, with shape `(n_controls, dim, dim)`.
+    """
+    if monodromy.derivatives is None:
+        raise ValueError("The derivatives of the Hamiltonian were not given.")
+    periods, index, remainder = monodromy._locate(time)
+    within, dwithin = monodromy._within_period(index, remainder, True)
+    power = monodromy._power(periods)
+    if periods == 0:
+        return dwithin @ power
+    states, adjoint = monodromy.states, np.conj(monodromy.states.T)
+    dperiod = adjoint @ monodromy.derivatives[-1] @ states
+    dpower = states @ (dperiod * _power_divided_differences(monodromy._phases,
+                                                            periods))\
+             @ adjoint
+    return dwithin @ power + within @ dpower
+
+def fourier_eigensystem(frequency, quasienergies, modes, dhamiltonian, n_zones,
+                        hermitian=False, decimals=8):
+    """
+    Return the `types.Eigensystem` with `n_zones` zones of the Floquet modes
+    sampled at `n_samples` evenly spaced times over the first period, given as
+    an array of shape `(n_samples, dim, n_states)` with the modes as columns.
+    Their Fourier components are the blocks of the eigenvectors of the Floquet
+    matrix, so this needs at least as many samples as there are zones.
+    """
+    n_samples = modes.shape[0]
+    if n_samples < n_zones:
+        raise ValueError(f"{n_samples} samples per period cannot resolve"
+                         f" the Fourier components of {n_zones} zones.")
+    components = np.fft.fft(modes, axis=0) / n_samples
+    fourier_modes = np.arange((1-n_zones)//2, 1 + (n_zones//2))
+    # Shape `(dim, n_zones, dim)`, indexed by state, zone and then component.
+    k_eigenvectors = np.ascontiguousarray(
+        np.transpose(components[fourier_modes % n_samples], (2, 0, 1)))
+    initial_floquet_bras = np.conj(np.sum(k_eigenvectors, axis=1))
+    abstract_ket_coefficients = 1j * frequency * fourier_modes
+    k_derivatives = None if dhamiltonian is None\
+                    else assemble_dk(dhamiltonian, n_zones, hermitian)
+    return types.Eigensystem(frequency,
+                             np.round(quasienergies, decimals=decimals),
+                             k_eigenvectors, initial_floquet_bras,
+                             abstract_ket_coefficients, k_derivatives)
+
+def eigensystem(monodromy, n_zones, decimals=8):
+    """
+    Return the `types.Eigensystem` of the Floquet matrix with `n_zones` zones
+    equivalent to `monodromy`.  The Floquet modes
+        |phi_j(t)> = exp(i quasienergy_j t) U(t) |state_j>
+    are sampled on the integration grid (see `fourier_eigensystem()`), so this
+    needs at least as many steps per period as there are zones.
+    """
+    if n_zones in monodromy._eigensystems:
+        return monodromy._eigensystems[n_zones]
+    n_steps = monodromy.n_steps
+    times = monodromy.period * np.arange(n_steps) / n_steps
+    quasienergies = monodromy.quasienergies
+    modes = np.exp(1j * np.outer(times, quasienergies))[:, np.newaxis, :]\
+            * (monodromy.propagators[:-1] @ monodromy.states)
+    out = fourier_eigensystem(monodromy.frequency, quasienergies, modes,
+                              monodromy._dhamiltonian, n_zones,
+                              monodromy.hermitian, decimals)
+    monodromy._eigensystems[n_zones] = out
+    return out
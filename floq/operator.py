@@ -0,0 +1,475 @@
+"""
+A matrix-free form of the Floquet matrix `K`, for problems too large to store
+even the sparse matrix.  `K` is block Toeplitz, with the block in zone-row `r`
+and zone-column `c` equal to `H_{r-c}` (plus `n * frequency` on the diagonal of
+zone `n`), so it can be applied to a vector directly from the Fourier blocks of
+the Hamiltonian with one `dim x dim` product per populated mode.  The storage
+is then the blocks themselves, independent of the number of zones.
+
+When only the modes -1, 0 and 1 are populated, `K` is block tridiagonal, and
+`K - shift` can be inverted exactly by block Gaussian elimination from one end
+of the zones to the other.  The pivot blocks of the elimination are the levels
+of a matrix continued fraction,
+    D_0 = A_0,   D_n = A_n - H_1 D_{n-1}^-1 H_{-1},
+where `A_n` is the diagonal block of zone `n` minus the shift, so the cost of
+both the factorisation and each solve is `O(n_zones dim^3)` and
+`O(n_zones dim^2)` respectively, with only `dim x dim` products.  The
+elimination does not pivot between zones, so a pivot block is singular
+whenever a leading run of zones has an eigenvalue at the shift, even if
+`K - shift` is not.  The condition number of every pivot is checked, and if
+any is too large the band form of `K - shift` is factorised by LAPACK's banded
+LU with partial pivoting instead, which is exact but several times slower.
+"""
+
+import copy
+import numba
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+
+# The largest condition number of a pivot block of the continued fraction
+# before the pivoted band factorisation is used instead.
+_PIVOT_CONDITION = 1e6
+
+class FloquetOperator(scipy.sparse.linalg.LinearOperator):
+    """
+    The Floquet matrix of a Fourier-transformed Hamiltonian as a
+    `scipy.sparse.linalg.LinearOperator`.  The vectors it acts on are laid out
+    zone-major, the same as the assembled matrix from
+    `floq.evolution.assemble_k_sparse()`.
+
+    This can be passed to `floq.evolution.diagonalise()` in place of the
+    matrix, and `floq.System` uses it with `matrix_free=True`.
+    """
+    def __init__(self, hamiltonian, n_zones, frequency, hermitian=False,
+                 real=False):
+        """
+        Arguments --
+        hamiltonian: types.TransformedMatrix --
+            The Fourier blocks, which may be dense or `scipy.sparse`.
+
+        n_zones: odd int > 0, frequency: float --
+            As for `floq.evolution.assemble_k()`.
+
+        hermitian: bool --
+            Whether only the modes `>= 0` are given, with
+            `H_{-m} = H_m^dagger`.
+
+        real: bool --
+            Whether to work in real arithmetic, for a real symmetric `K` (see
+            `floq.evolution.is_real_symmetric()`).
+        """
+        self.dimension = hamiltonian.matrix[0].shape[0]
+        self.n_zones = n_zones
+        self.frequency = frequency
+        dtype = np.float64 if real else np.complex128
+        blocks = {}
+        def add(mode, matrix):
+            matrix = matrix.astype(dtype)
+            blocks[mode] = matrix if mode not in blocks\
+                           else blocks[mode] + matrix
+        for mode, matrix in zip(hamiltonian.mode, hamiltonian.matrix):
+            if abs(mode) >= n_zones:
+                continue
+            matrix = matrix.real if real else matrix
+            add(mode, matrix)
+            if hermitian and mode != 0:
+                add(-mode, matrix.conj().T)
+        self.blocks = blocks
+        self.zone_energies = frequency * (np.arange(n_zones) - n_zones//2)
+        size = n_zones * self.dimension
+        super().__init__(dtype=dtype, shape=(size, size))
+
+    def _matmat(self, vectors):
+        n_vectors = vectors.shape[1]
+        vectors = vectors.reshape(self.n_zones, self.dimension, n_vectors)
+        dtype = np.result_type(self.dtype, vectors.dtype)
+        out = self.zone_energies.reshape(-1, 1, 1) * vectors.astype(dtype)
+        for mode, block in self.blocks.items():
+            # Zone-rows `r` take `H_m` times zone-columns `r - m`.
+            rows = slice(max(0, mode), self.n_zones + min(0, mode))
+            cols = slice(max(0, -mode), self.n_zones - max(0, mode))
+            source = vectors[cols]
+            n_blocks = source.shape[0]
+            # Put the zones side by side, so each mode is one product.
+            flat = source.transpose(1, 0, 2).reshape(self.dimension, -1)
+            product = np.asarray(block @ flat)
+            out[rows] += product.reshape(self.dimension, n_blocks, n_vectors)\
+                                .transpose(1, 0, 2)
+        return out.reshape(-1, n_vectors)
+
+    def _matvec(self, vector):
+        return self._matmat(vector.reshape(-1, 1)).reshape(-1)
+
+    def _adjoint(self):
+        # Block `(r, c)` of `K^dagger` is `H_{c-r}^dagger`, so its mode `m` is
+        # `H_{-m}^dagger`.  The zone energies are real.
+        adjoint = copy.copy(self)
+        adjoint.blocks = {-mode: block.conj().T
+                          for mode, block in self.blocks.items()}
+        adjoint._h0_eigen = None
+        return adjoint
+
+    def _h0_eigensystem(self):
+        """
+        The eigendecomposition `(values, vectors, inverse)` of the zero-mode
+        block, computed once, where `inverse` takes vectors into its eigenbasis.
+        The block is only treated as Hermitian if it is, and otherwise the
+        eigenvectors are not orthonormal, so `inverse` comes from their LU
+        factorisation rather than the conjugate transpose.
+        """
+        if getattr(self, '_h0_eigen', None) is None:
+            h0 = self.blocks.get(0)
+            if h0 is None:
+                h0 = np.zeros((self.dimension, self.dimension),
+                              dtype=self.dtype)
+            elif scipy.sparse.issparse(h0):
+                h0 = h0.toarray()
+            if np.allclose(h0, np.conj(h0.T), rtol=0.0,
+                           atol=1e-12 * max(1.0, np.max(np.abs(h0)))):
+                values, vectors = scipy.linalg.eigh(h0)
+                inverse = np.conj(vectors.T)
+            else:
+                values, vectors = scipy.linalg.eig(h0)
+                inverse = scipy.linalg.lu_solve(scipy.linalg.lu_factor(vectors),
+                                                np.eye(self.dimension))
+            self._h0_eigen = values, vectors, inverse
+        return self._h0_eigen
+
+    def block_diagonal_solve(self, vectors, shifts=0.0, floor=None):
+        """
+        Apply the inverse of the block diagonal of `K - shift`, which is
+        `H_0 + n frequency - shift` in zone `n`, to the columns of `vectors`.
+        `shifts` is a scalar or one shift per column.  One eigendecomposition
+        of `H_0` serves every zone and shift.  Eigenvalues of the diagonal
+        blocks smaller in magnitude than `floor` (by default a hundredth of the
+        frequency) are clamped to it, to keep this well conditioned near the
+        shift.
+        """
+        floor = 0.01 * self.frequency if floor is None else floor
+        values, eigenvectors, inverse = self._h0_eigensystem()
+        n_vectors = vectors.shape[1]
+        shifts = np.broadcast_to(np.asarray(shifts, dtype=np.float64),
+                                 (n_vectors,))
+        x = vectors.reshape(self.n_zones, self.dimension, n_vectors)
+        x = inverse @ x
+        shifted = values[np.newaxis, :, np.newaxis]\
+                  + self.zone_energies[:, np.newaxis, np.newaxis]\
+                  - shifts[np.newaxis, np.newaxis, :]
+        # Clamp the magnitude, keeping the sign (or the phase, if complex).
+        magnitudes = np.abs(shifted)
+        direction = np.divide(shifted, magnitudes, where=magnitudes > 0,
+                              out=np.ones_like(shifted))
+        shifted = np.where(magnitudes < floor, floor*direction, shifted)
+        x = x / shifted
+        return (eigenvectors @ x).reshape(-1, n_vectors)
+
+    def preconditioner(self, shift=0.0, floor=None):
+        """
+        Return an approximate inverse of `K - shift`, as a `LinearOperator`,
+        from the exact inverse of its block diagonal (see
+        `block_diagonal_solve()`).
+        """
+        def apply(x):
+            return self.block_diagonal_solve(x, shift, floor)
+        dtype = np.result_type(self.dtype, self._h0_eigensystem()[1].dtype)
+        return scipy.sparse.linalg.LinearOperator(
+            self.shape, matvec=lambda x: apply(x.reshape(-1, 1)).reshape(-1),
+            matmat=apply, dtype=dtype)
+
+    @property
+    def tridiagonal(self):
+        """Whether only the modes -1, 0 and 1 are present."""
+        return all(abs(mode) <= 1 for mode in self.blocks)
+
+    def _dense_block(self, mode):
+        block = self.blocks.get(mode)
+        if block is None:
+            return np.zeros((self.dimension, self.dimension), dtype=self.dtype)
+        if scipy.sparse.issparse(block):
+            block = block.toarray()
+        return np.ascontiguousarray(block, dtype=self.dtype)
+
+    def _band(self, shift):
+        """
+        `K - shift` in the LAPACK band storage of `gbtrf`, with room for the
+        fill-in of the pivoting, and the number of sub- and super-diagonals.
+        """
+        dimension, n_zones = self.dimension, self.n_zones
+        bandwidth = 2*dimension - 1
+        size = self.shape[0]
+        band = np.zeros((3*bandwidth + 1, size), dtype=self.dtype)
+        local = np.arange(dimension)
+        for mode in (-1, 0, 1):
+            block = self._dense_block(mode)
+            if mode == 0:
+                block = block - shift*np.eye(dimension, dtype=self.dtype)
+            # Zone-row `r` holds `H_m` in zone-column `r - m`.
+            for zone in range(max(0, mode), n_zones + min(0, mode)):
+                rows = zone*dimension + local
+                cols = (zone - mode)*dimension + local
+                band[2*bandwidth + rows[:, np.newaxis] - cols, cols] = block
+        diagonal = np.arange(size)
+        band[2*bandwidth, diagonal] +=\
+            np.repeat(self.zone_energies, dimension).astype(self.dtype)
+        return band, bandwidth
+
+    def tridiagonal_inverse(self, shift=0.0):
+        """
+        Return the exact `(K - shift)^-1` as a `LinearOperator`, for a
+        block-tridiagonal `K` (see `tridiagonal`).  `K - shift` is factorised
+        here, once, by block elimination (a matrix continued fraction), taking
+        `O(n_zones dim^3)` time and `O(n_zones dim^2)` memory, and then each
+        application takes `O(n_zones dim^2)`.  If a pivot block of the
+        elimination is badly conditioned, the pivoted band factorisation is
+        used instead.  The blocks are dense, so this is best suited to
+        Hamiltonians whose blocks are not very sparse.
+
+        Raises --
+        ValueError: if `K` is not block tridiagonal.
+        np.linalg.LinAlgError: if `K - shift` is exactly singular.
+        """
+        if not self.tridiagonal:
+            raise ValueError("The Floquet matrix is only block tridiagonal if"
+                             " the Hamiltonian has no modes beyond -1 and 1.")
+        lower, upper = self._dense_block(1), self._dense_block(-1)
+        try:
+            inverses, couplings, conditions = _continued_fraction(
+                self._dense_block(0), self.zone_energies - shift, lower, upper)
+        except np.linalg.LinAlgError:
+            # An exactly singular pivot.
+            return self._band_inverse(shift)
+        if not np.all(conditions < _PIVOT_CONDITION):
+            return self._band_inverse(shift)
+        def solve(x):
+            n_vectors = x.shape[1]
+            x = np.ascontiguousarray(
+                x.reshape(self.n_zones, self.dimension, n_vectors),
+                dtype=inverses.dtype)
+            return _block_tridiagonal_solve(inverses, couplings, lower, x)\
+                   .reshape(-1, n_vectors)
+        return self._inverse_operator(solve)
+
+    def _band_inverse(self, shift):
+        """`(K - shift)^-1` from the pivoted band factorisation of `K`."""
+        band, bandwidth = self._band(shift)
+        factorise, solve = scipy.linalg.get_lapack_funcs(('gbtrf', 'gbtrs'),
+                                                         (band,))
+        factors, pivots, info = factorise(band, bandwidth, bandwidth,
+                                          overwrite_ab=True)
+        if info > 0:
+            raise np.linalg.LinAlgError(f"The shifted Floquet matrix is"
+                                        f" singular at shift {shift}.")
+        def band_solve(x):
+            out, info = solve(factors, bandwidth, bandwidth, x, pivots)
+            return out
+        return self._inverse_operator(band_solve)
+
+    def _inverse_operator(self, solve):
+        """
+        Wrap a function solving `K - shift` in the operator's dtype for a 2D
+        array of right-hand sides as a `LinearOperator`.
+        """
+        def apply(x):
+            dtype = np.result_type(self.dtype, x.dtype)
+            if dtype != self.dtype:
+                # Complex vectors against a real factorisation.
+                return apply(np.real(x)) + 1j*apply(np.imag(x))
+            return solve(np.asarray(x, dtype=dtype))
+        return scipy.sparse.linalg.LinearOperator(
+            self.shape, matvec=lambda x: apply(x.reshape(-1, 1)).reshape(-1),
+            matmat=apply, dtype=self.dtype)
+
+    def shift_invert(self, shift=0.0, tol=1e-12):
+        """
+        Return `(K - shift)^-1` as a `LinearOperator`, for shift-invert
+        iterative eigensolvers which cannot factorise `K`.  For a
+        block-tridiagonal `K` this is `tridiagonal_inverse()`; otherwise it is
+        applied by solving with preconditioned GMRES.
+        """
+        if self.tridiagonal:
+            return self.tridiagonal_inverse(shift)
+        shifted = self if shift == 0.0 else\
+                  self - shift * scipy.sparse.linalg.aslinearoperator(
+                      scipy.sparse.identity(self.shape[0], dtype=self.dtype))
+        preconditioner = self.preconditioner(shift)
+        def solve(vector):
+            solution, info = scipy.sparse.linalg.gmres(
+                shifted, vector, rtol=tol, atol=0.0, restart=50,
+                maxiter=self.shape[0], M=preconditioner)
+            if info != 0:
+                raise RuntimeError("The iterative solve of the shifted Floquet"
+                                   " matrix did not converge.")
+            return solution
+        return scipy.sparse.linalg.LinearOperator(self.shape, matvec=solve,
+                                                  dtype=self.dtype)
+
+
+@numba.njit(cache=True, nogil=True)
+def _continued_fraction(diagonal, zone_energies, lower, upper):
+    """
+    Eliminate the block-tridiagonal matrix with diagonal blocks
+    `diagonal + e_n` (for each `e_n` in `zone_energies`), sub-diagonal blocks
+    `lower` and super-diagonal blocks `upper`.  Returns the inverses of the
+    pivot blocks `D_n`, the products `D_n^-1 upper`, and the 1-norm condition
+    number of each pivot.
+    """
+    n_zones, dimension = zone_energies.shape[0], diagonal.shape[0]
+    inverses = np.empty((n_zones, dimension, dimension), dtype=diagonal.dtype)
+    couplings = np.empty_like(inverses)
+    conditions = np.empty(n_zones, dtype=np.float64)
+    identity = np.eye(dimension, dtype=diagonal.dtype)
+    for zone in range(n_zones):
+        pivot = diagonal + zone_energies[zone] * identity
+        if zone > 0:
+            pivot = pivot - lower @ couplings[zone - 1]
+        inverses[zone] = np.linalg.inv(pivot)
+        couplings[zone] = inverses[zone] @ upper
+        conditions[zone] = np.linalg.norm(pivot, 1)\
+                           * np.linalg.norm(inverses[zone], 1)
+    return inverses, couplings, conditions
+
+@numba.njit(cache=True, nogil=True)
+def _block_tridiagonal_solve(inverses, couplings, lower, rhs):
+    """
+    Solve the block-tridiagonal system eliminated by `_continued_fraction()`
+    for the right-hand sides `rhs`, of shape `(n_zones, dimension, n_vectors)`.
+    """
+    n_zones = rhs.shape[0]
+    out = np.empty_like(rhs)
+    out[0] = inverses[0] @ rhs[0]
+    for zone in range(1, n_zones):
+        out[zone] = inverses[zone] @ (rhs[zone] - lower @ out[zone - 1])
+    for zone in range(n_zones - 2, -1, -1):
+        out[zone] = out[zone] - couplings[zone] @ out[zone + 1]
+    return out
+
+
+def _orthonormal_columns(vectors, basis=None, drop=1e-8):
+    """
+    Orthonormalise the columns of `vectors` against `basis` (which must have
+    orthonormal columns) and each other, dropping any which are numerically
+    in the span of the others.
+    """
+    norms = np.linalg.norm(vectors, axis=0)
+    vectors = vectors / np.where(norms > 0, norms, 1.0)
+    if basis is not None:
+        # Twice is enough (Kahan-Parlett).
+        for _ in range(2):
+            vectors = vectors - basis @ (np.conj(basis.T) @ vectors)
+    vectors = vectors[:, np.linalg.norm(vectors, axis=0) > drop]
+    if vectors.shape[1] == 0:
+        return vectors
+    q, r = scipy.linalg.qr(vectors, mode='economic')
+    return q[:, np.abs(np.diag(r)) > drop]
+
+def _orthonormal_ritz_vectors(vectors, drop=1e-8):
+    """
+    Orthonormalise the converged Ritz vectors (the columns of `vectors`) in
+    place of one another, so each column still belongs to the same Ritz value.
+    Vectors of distinct eigenvalues are already orthogonal to within the
+    residuals, so this only mixes those of (nearly) degenerate ones.
+    """
+    q, r = scipy.linalg.qr(vectors, mode='economic')
+    diagonal = np.diag(r)
+    if np.any(np.abs(diagonal) <= drop):
+        raise RuntimeError("The Davidson eigensolver converged to linearly"
+                           " dependent eigenvectors.")
+    # Undo the phase QR puts on each column.
+    return q * (diagonal / np.abs(diagonal))[np.newaxis, :]
+
+def davidson(operator, n_values, guess=None, tol=1e-10, max_iterations=500,
+             max_subspace=None):
+    """
+    Find the `n_values` eigenpairs of the Floquet operator with eigenvalues
+    closest to zero, with a preconditioned block Davidson method.  Only
+    products with `operator` and solves with its block diagonal are needed, so
+    `K` is never assembled or factorised and the cost scales with
+    `dim * n_zones`.
+
+    The search space starts from the eigenvectors of the block diagonal
+    `H_0 + n frequency` (the states of the undriven problem) closest to zero,
+    together with any `guess`.  Each iteration takes the Rayleigh-Ritz
+    approximations closest to zero, and expands the space with their residuals
+    preconditioned by the inverse of `H_0 + n frequency - theta`, which is the
+    dominant part of `K - theta`.
+
+    Arguments --
+    operator: FloquetOperator -- The Hermitian Floquet matrix.
+    n_values: int -- The number of eigenpairs to find.
+    guess: 2D np.array | None --
+        Optionally, approximate eigenvectors as columns, such as those of a
+        nearby problem.
+    tol: float -- The largest residual norm of a converged eigenpair.
+    max_iterations: int
+    max_subspace: int | None --
+        The largest search space before restarting from the current Ritz
+        vectors, by default four times `n_values`.
+
+    Returns --
+    eigenvalues: 1D np.array of float
+    eigenvectors: 2D np.array, with the orthonormal eigenvectors as the
+        columns, in the same order as `eigenvalues`
+    """
+    size = operator.shape[0]
+    n_values = min(n_values, size)
+    max_subspace = min(size, max_subspace or 4*n_values)
+    values, vectors, _ = operator._h0_eigensystem()
+    unperturbed = values[np.newaxis, :] + operator.zone_energies[:, np.newaxis]
+    nearest = np.argsort(np.abs(unperturbed), axis=None)[:n_values]
+    zones, states = np.unravel_index(nearest, unperturbed.shape)
+    dtype = np.result_type(operator.dtype, vectors.dtype)
+    start = np.zeros((operator.n_zones, operator.dimension, n_values),
+                     dtype=dtype)
+    start[zones, :, np.arange(n_values)] = vectors[:, states].T
+    start = start.reshape(size, n_values)
+    if guess is not None:
+        start = np.hstack([np.asarray(guess, dtype=dtype), start])
+    basis = _orthonormal_columns(start)
+    image = operator @ basis
+    projected = np.conj(basis.T) @ image
+    gram = np.conj(image.T) @ image
+    for _ in range(max_iterations):
+        # Harmonic Rayleigh-Ritz about zero: the reciprocals of the
+        # eigenvalues of `V^dagger K V` with respect to `(KV)^dagger KV` are
+        # the largest for the eigenvalues of `K` nearest zero, without the
+        # spurious interior values of the ordinary projection.
+        reciprocals, ritz_vectors = scipy.linalg.eigh(
+            0.5 * (projected + np.conj(projected.T)),
+            0.5 * (gram + np.conj(gram.T)))
+        wanted = np.argsort(-np.abs(reciprocals))[:n_values]
+        approximations = basis @ ritz_vectors[:, wanted]
+        applied = image @ ritz_vectors[:, wanted]
+        scale = np.linalg.norm(approximations, axis=0)
+        approximations, applied = approximations / scale, applied / scale
+        ritz_values = np.real(np.sum(np.conj(approximations) * applied, axis=0))
+        residuals = applied - approximations * ritz_values[np.newaxis, :]
+        unconverged = np.linalg.norm(residuals, axis=0) > tol
+        if not np.any(unconverged):
+            return ritz_values, _orthonormal_ritz_vectors(approximations)
+        corrections = operator.block_diagonal_solve(
+            residuals[:, unconverged], ritz_values[unconverged])
+        if basis.shape[1] + corrections.shape[1] > max_subspace:
+            # Restart from the current approximations, keeping their images.
+            basis, triangle = scipy.linalg.qr(approximations, mode='economic')
+            image = scipy.linalg.solve_triangular(triangle, applied.T,
+                                                  trans='T').T
+            projected = np.conj(basis.T) @ image
+            gram = np.conj(image.T) @ image
+        corrections = _orthonormal_columns(corrections, basis)
+        if corrections.shape[1] == 0:
+            break
+        new_image = operator @ corrections
+        # Only the new rows and columns of the projections need computing.
+        projected = np.block([
+            [projected, np.conj(basis.T) @ new_image],
+            [np.conj(corrections.T) @ image,
+             np.conj(corrections.T) @ new_image]])
+        image_overlap = np.conj(image.T) @ new_image
+        gram = np.block([[gram, image_overlap],
+                         [np.conj(image_overlap.T),
+                          np.conj(new_image.T) @ new_image]])
+        basis = np.hstack([basis, corrections])
+        image = np.hstack([image, new_image])
+    raise RuntimeError("The Davidson eigensolver did not converge.")
@@ -2,8 +2,11 @@
 a ParametricSystem and computes f and df for given controls."""
 import logging
 from ..linalg import d_operator_distance, operator_distance
+from ..linalg import d2_operator_distance, d2_transfer_distance
 from ..linalg import transfer_distance, d_transfer_distance
 import numpy as np
+from .. import evolution
+from ..system import _compare_args, _compare_kwargs
 
 class FidelityBase(object):
     """Defines how to calculate a fidelity and its gradient.
@@ -19,7 +22,9 @@ class FidelityBase(object):
     Sub-classes can optionally implement:
         penalty(controls_and_t)
         d_penalty(controls_and_t),
-        _iterate(controls_and_t), which gets called on each iteration.
+        _iterate(controls_and_t), which gets called on each iteration,
+        _f_batch(batch), _df_batch(batch), which evaluate many rows of
+            controls at once (by default one at a time).
 
     The __init__ should take the form __init__(self, system, **kwargs)
     for compatibility with EnsembleFidelity.
@@ -27,8 +32,18 @@ class FidelityBase(object):
     Methods:
         f(controls_and_t): returns a real number, the fidelity,
         df(controls_and_t): returns its gradient,
+        hessian(controls_and_t), hessp(controls_and_t, vector): the Hessian
+            and Hessian-vector product, for fidelities which implement
+            _hessian,
+        gauss_newton(controls_and_t): a positive semi-definite approximation
+            to the Hessian, for fidelities which implement _gauss_newton,
+        f_batch(batch), df_batch(batch): the same for each row of a 2D array,
         iterate(controls_and_t): expected to be called after each iteration by
                                  an Optimizer.
+        record_iteration(f, controls_and_t): the same as iterate(), for
+                                 optimizers which already know the fidelity
+                                 f at the new controls (or None if they never
+                                 evaluate it).
 
     Attributes:
         system: the system (or ensemble) under consideration.
@@ -36,6 +51,7 @@ class FidelityBase(object):
     def __init__(self, system):
         self.system = system
         self.iterations = 0
+        self._last_hessian = None
 
     def f(self, *args, **kwargs):
         return self._f(*args, **kwargs) + self.penalty(*args, **kwargs)
@@ -53,9 +69,68 @@ class FidelityBase(object):
         logging.info("Currently at iteration {} and f={}"\
                      .format(self.iterations, f))
 
+    def record_iteration(self, f, *args, **kwargs):
+        """Like iterate(), but logs the already known fidelity f at the new
+        controls instead of evaluating it again, or no fidelity at all if f is
+        None, for optimizers which never evaluate it."""
+        self.iterations += 1
+        self._iterate(*args, **kwargs)
+        if f is None:
+            logging.info("Currently at iteration {}".format(self.iterations))
+        else:
+            logging.info("Currently at iteration {} and f={}"\
+                         .format(self.iterations, f))
+
+    def hessian(self, *args, **kwargs):
+        """Return the Hessian matrix of the fidelity (including the penalty),
+        for fidelities which implement _hessian.  These use the analytic
+        second derivatives of U (see floq.System.d2u_dcontrols()), from the
+        same eigensystem as the gradient, which are exact when the Hamiltonian
+        is linear in the controls."""
+        return self._hessian(*args, **kwargs)\
+               + self.d2_penalty(*args, **kwargs)
+
+    def hessp(self, controls, vector, *args, **kwargs):
+        """Return the product of the Hessian with `vector`.  The Hessian at the
+        last controls is kept, so that the many products at one point needed
+        by methods such as Newton-CG only calculate it once."""
+        point = (np.array(controls),) + args
+        if self._last_hessian is None\
+           or not _compare_args(self._last_hessian[0], point)\
+           or not _compare_kwargs(self._last_hessian[1], kwargs):
+            self._last_hessian = (point, kwargs.copy(),
+                                  self.hessian(controls, *args, **kwargs))
+        return self._last_hessian[2] @ np.asarray(vector)
+
+    def gauss_newton(self, *args, **kwargs):
+        """Return the Gauss-Newton approximation to the Hessian, which is
+        positive semi-definite, only needs first derivatives of U, and is exact
+        where the fidelity is perfect."""
+        return self._gauss_newton(*args, **kwargs)\
+               + self.d2_penalty(*args, **kwargs)
+
     def reset_iterations(self):
         self.iterations = 0
 
+    def f_batch(self, batch, *args, threads=None, **kwargs):
+        """Return the fidelity for every row of the 2D array of controls
+        `batch` as a 1D array.  Sub-classes can override _f_batch() to share
+        work between the rows, using up to `threads` threads."""
+        out = np.array(self._f_batch(batch, *args, threads=threads, **kwargs),
+                       dtype=np.float64)
+        for i, row in enumerate(batch):
+            out[i] += self.penalty(row, *args, **kwargs)
+        return out
+
+    def df_batch(self, batch, *args, threads=None, **kwargs):
+        """Return the gradient for every row of the 2D array of controls
+        `batch`, stacked along the first axis."""
+        out = np.array(self._df_batch(batch, *args, threads=threads, **kwargs),
+                       dtype=np.float64)
+        for i, row in enumerate(batch):
+            out[i] += self.d_penalty(row, *args, **kwargs)
+        return out
+
     def _f(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -65,25 +140,275 @@ class FidelityBase(object):
     def _iterate(self, *args, **kwargs):
         pass
 
+    def _f_batch(self, batch, *args, threads=None, **kwargs):
+        return [self._f(row, *args, **kwargs) for row in batch]
+
+    def _df_batch(self, batch, *args, threads=None, **kwargs):
+        return [self._df(row, *args, **kwargs) for row in batch]
+
+    def _hessian(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def _gauss_newton(self, *args, **kwargs):
+        raise NotImplementedError
+
     def penalty(self, *args, **kwargs):
         return 0.0
 
     def d_penalty(self, *args, **kwargs):
         return 0.0
 
+    def d2_penalty(self, *args, **kwargs):
+        return 0.0
+
+def ensemble_weights(ensemble):
+    """Return the normalised weights of the members of an ensemble.  Ensembles
+    which do not define weights have all their members weighted equally."""
+    weights = getattr(ensemble, 'weights', None)
+    if weights is None:
+        weights = np.ones(len(ensemble.systems))
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights / np.sum(weights)
+
 class EnsembleFidelity(FidelityBase):
     """With a given Ensemble, and a FidelityComputer, calculate the average
-    fidelity over the whole ensemble."""
-    def __init__(self, ensemble, fidelity, **kwargs):
+    fidelity over the whole ensemble.  The average is weighted by the
+    ensemble's weights, if it has any.
+
+    With `continuation=True`, the members are evaluated in the ensemble's
+    continuation_order(), so that neighbours have similar parameters, and each
+    member's system is warm-started from the eigensystem its predecessor has
+    just found.  This turns the ensemble sweep into a continuation path."""
+    def __init__(self, ensemble, fidelity, continuation=False, **kwargs):
         super().__init__(ensemble)
         self.fidelities = [fidelity(sys, **kwargs) for sys in ensemble.systems]
+        self.weights = ensemble_weights(ensemble)
+        self.continuation = continuation
+        self.order = ensemble.continuation_order() if continuation\
+                     else np.arange(len(self.fidelities))
+
+    def _evaluate(self, method, *args, **kwargs):
+        """Call `method` (a string) on each fidelity, in the evaluation order,
+        and return the results in ensemble order."""
+        out = [None] * len(self.fidelities)
+        previous = None
+        for i in self.order:
+            fid = self.fidelities[i]
+            if previous is not None:
+                guess = previous.system.eigensystem(*args, **kwargs)
+                fid.system.warm_start(guess)
+            out[i] = getattr(fid, method)(*args, **kwargs)
+            previous = fid if self.continuation else None
+        return out
 
     def _f(self, *args, **kwargs):
-        return np.mean([fid.f(*args, **kwargs) for fid in self.fidelities])
+        return np.average(self._evaluate('f', *args, **kwargs),
+                          weights=self.weights)
 
     def _df(self, *args, **kwargs):
-        return np.mean([fid.df(*args, **kwargs) for fid in self.fidelities],
-                       axis=0)
+        return np.average(self._evaluate('df', *args, **kwargs),
+                          axis=0, weights=self.weights)
+
+    def _f_batch(self, batch, *args, threads=None, **kwargs):
+        values = [fid.f_batch(batch, *args, threads=threads, **kwargs)
+                  for fid in self.fidelities]
+        return np.average(values, axis=0, weights=self.weights)
+
+    def _df_batch(self, batch, *args, threads=None, **kwargs):
+        values = [fid.df_batch(batch, *args, threads=threads, **kwargs)
+                  for fid in self.fidelities]
+        return np.average(values, axis=0, weights=self.weights)
+
+    def _hessian(self, *args, **kwargs):
+        return np.average(self._evaluate('hessian', *args, **kwargs),
+                          axis=0, weights=self.weights)
+
+    def _gauss_newton(self, *args, **kwargs):
+        return np.average([fid.gauss_newton(*args, **kwargs)
+                           for fid in self.fidelities],
+                          axis=0, weights=self.weights)
+
+class StochasticEnsembleFidelity(EnsembleFidelity):
+    """Estimate the average fidelity over a large ensemble from a random
+    mini-batch of `batch_size` members.  The batch is fixed between calls to
+    iterate(), so that the value and gradient within one optimisation step are
+    consistent, and a new batch is drawn on every iteration.  Batches are drawn
+    from a `np.random.RandomState` seeded with `seed`, so runs are reproducible.
+    Equally weighted ensembles are sampled without replacement.  Otherwise,
+    members are drawn with replacement with probability proportional to the
+    magnitude of their weight, and each sampled value is multiplied by
+    sign(w) sum(|w|), so the batch mean is still an unbiased estimate even for
+    quadrature rules with negative weights (such as sparse grids).
+
+    With `control_variate=True`, the variance of the estimates is reduced by
+    the SVRG scheme: every `anchor_interval` iterations the whole ensemble is
+    evaluated at the current controls (the "anchor"), and each estimate becomes
+        mean_batch(f_i(x) - f_i(anchor)) + mean_all(f_i(anchor)),
+    which is still unbiased, but whose variance vanishes as x approaches the
+    anchor.  This costs one full ensemble pass per anchor.
+
+    Use with an optimiser that tolerates noisy gradients, such as
+    optimizer.AdamOptimizer."""
+    def __init__(self, ensemble, fidelity, batch_size, seed=None,
+                 control_variate=False, anchor_interval=10, **kwargs):
+        super().__init__(ensemble, fidelity, **kwargs)
+        self.batch_size = min(batch_size, len(self.fidelities))
+        self.random = np.random.RandomState(seed)
+        self.control_variate = control_variate
+        self.anchor_interval = anchor_interval
+        self._anchor = None
+        self.resample()
+
+    def resample(self):
+        """Draw a new mini-batch of ensemble members."""
+        if np.allclose(self.weights, self.weights[0]):
+            self.batch = self.random.choice(len(self.fidelities),
+                                            self.batch_size, replace=False)
+            self._scales = np.ones(self.batch_size)
+        else:
+            magnitudes = np.abs(self.weights)
+            self.batch = self.random.choice(len(self.fidelities),
+                                            self.batch_size,
+                                            p=magnitudes/np.sum(magnitudes))
+            self._scales = np.sign(self.weights[self.batch])\
+                           * np.sum(magnitudes)
+
+    def set_anchor(self, *args, **kwargs):
+        """Evaluate the whole ensemble at the given controls, and use them as
+        the anchor point of the control variate."""
+        self._anchor = (args, kwargs)
+        self._anchor_f = np.array([fid.f(*args, **kwargs)
+                                   for fid in self.fidelities])
+        self._anchor_df = np.array([fid.df(*args, **kwargs)
+                                    for fid in self.fidelities])
+
+    def _batch_mean(self, values):
+        scales = self._scales.reshape((-1,) + (1,)*(np.ndim(values) - 1))
+        return np.mean(scales * np.asarray(values), axis=0)
+
+    def _estimate(self, values, anchor_values):
+        if anchor_values is None:
+            return self._batch_mean(values)
+        correction = self._batch_mean(anchor_values[self.batch])
+        return self._batch_mean(values) - correction\
+               + np.average(anchor_values, axis=0, weights=self.weights)
+
+    def _f(self, *args, **kwargs):
+        if self.control_variate and self._anchor is None:
+            self.set_anchor(*args, **kwargs)
+        values = [self.fidelities[i].f(*args, **kwargs) for i in self.batch]
+        anchor = self._anchor_f if self.control_variate else None
+        return self._estimate(values, anchor)
+
+    def _df(self, *args, **kwargs):
+        if self.control_variate and self._anchor is None:
+            self.set_anchor(*args, **kwargs)
+        values = [self.fidelities[i].df(*args, **kwargs) for i in self.batch]
+        anchor = self._anchor_df if self.control_variate else None
+        return self._estimate(values, anchor)
+
+    # Each row would need its own batch of members, so the rows are just
+    # evaluated one at a time.
+    _f_batch = FidelityBase._f_batch
+    _df_batch = FidelityBase._df_batch
+    # The Hessian of the whole ensemble would not match the sampled values and
+    # gradients.
+    _hessian = FidelityBase._hessian
+
+    def _iterate(self, *args, **kwargs):
+        self.resample()
+        if self.control_variate\
+           and self.iterations % self.anchor_interval == 0:
+            self.set_anchor(*args, **kwargs)
+
+def _stream_chunk(source, task):
+    """
+    Evaluate one chunk of a streamed ensemble average.  `source` is the tuple
+    `(ensemble, fidelity, fidelity_kwargs, weights, continuation)` and `task`
+    is `(indices, gradient, args, kwargs)`.  Returns the weighted sums of the
+    fidelities and, if `gradient`, of their gradients over the chunk.  Each
+    member is built, used and dropped in turn, passing its eigensystem on to
+    the next one if `continuation`.
+    """
+    ensemble, fidelity, fidelity_kwargs, weights, continuation = source
+    indices, gradient, args, kwargs = task
+    systems = ensemble.systems
+    f, df = 0.0, 0.0
+    guess = None
+    for i in indices:
+        fid = fidelity(systems[i], **fidelity_kwargs)
+        if guess is not None:
+            fid.system.warm_start(guess)
+        f = f + weights[i] * fid.f(*args, **kwargs)
+        if gradient:
+            df = df + weights[i] * fid.df(*args, **kwargs)
+        if continuation:
+            guess = fid.system.eigensystem(*args, **kwargs)
+    return f, df
+
+class StreamingEnsembleFidelity(FidelityBase):
+    """Calculate the weighted average fidelity over an ensemble without ever
+    holding more than one member in memory.  The members are built from the
+    ensemble (typically a `floq.system.LazyEnsemble`) as they are needed, in
+    chunks of `chunk_size`, and each member's system and eigensystem are freed
+    once its contribution has been added to the running sum.
+
+    Because nothing is kept between calls, a call to `df()` also calculates the
+    fidelity at the same time, and a following call to `f()` at the same
+    arguments reuses it.  With `continuation=True` the members are visited in
+    the ensemble's continuation_order(), and each one is warm-started from the
+    previous member of its chunk.
+
+    If `pool` (a `floq.parallel.pool.WorkerPool`) is given, the chunks are
+    shared dynamically between its workers.  The ensemble, the fidelity class
+    and its keyword arguments are then sent to every worker, so they must be
+    picklable."""
+    def __init__(self, ensemble, fidelity, chunk_size=256, continuation=False,
+                 pool=None, **kwargs):
+        super().__init__(ensemble)
+        self.chunk_size = chunk_size
+        self.continuation = continuation
+        self.weights = ensemble_weights(ensemble)
+        self.pool = pool
+        self._source = (ensemble, fidelity, kwargs, self.weights, continuation)
+        self._handle = None if pool is None else pool.broadcast(self._source)
+        self._last = None
+
+    def _chunks(self):
+        n = len(self.weights)
+        order = self.system.continuation_order() if self.continuation\
+                else np.arange(n)
+        return [order[i : i+self.chunk_size]
+                for i in range(0, n, self.chunk_size)]
+
+    def _stream(self, gradient, args, kwargs):
+        tasks = [(indices, gradient, args, kwargs)
+                 for indices in self._chunks()]
+        if self.pool is None:
+            parts = [_stream_chunk(self._source, task) for task in tasks]
+        else:
+            parts = self.pool.map(_stream_chunk, tasks, self._handle)
+        f = sum(part[0] for part in parts)
+        df = sum(part[1] for part in parts) if gradient else None
+        return f, df
+
+    def _f(self, *args, **kwargs):
+        if self._last is not None and _compare_args(self._last[0], args)\
+           and _compare_kwargs(self._last[1], kwargs):
+            return self._last[2]
+        return self._stream(False, args, kwargs)[0]
+
+    def _df(self, *args, **kwargs):
+        f, df = self._stream(True, args, kwargs)
+        self._last = (tuple(args), kwargs.copy(), f)
+        return df
+
+    def close(self):
+        """Release the ensemble from the workers of the pool, if there is
+        one."""
+        if self._handle is not None:
+            self.pool.release(self._handle)
+            self._handle = None
 
 class OperatorDistance(FidelityBase):
     """Calculate the operator distance (see core.fidelities for details) for a
@@ -102,6 +427,31 @@ class OperatorDistance(FidelityBase):
         du = self.system.du_dcontrols(self.t, *args, **kwargs)
         return d_operator_distance(u, du, self.target)
 
+    def _f_batch(self, batch, *args, threads=None, **kwargs):
+        us = self.system.u_batch(self.t, batch, *args, threads=threads,
+                                 **kwargs)
+        return [operator_distance(u, self.target) for u in us]
+
+    def _df_batch(self, batch, *args, threads=None, **kwargs):
+        eigensystems = self.system.eigensystem_batch(batch, *args,
+                                                     threads=threads, **kwargs)
+        return [d_operator_distance(evolution.u(eigensystem, self.t),
+                                    evolution.du_dcontrols(eigensystem, self.t),
+                                    self.target)
+                for eigensystem in eigensystems]
+
+    def _hessian(self, *args, **kwargs):
+        u = self.system.u(self.t, *args, **kwargs)
+        d2u = self.system.d2u_dcontrols(self.t, *args, **kwargs)
+        return d2_operator_distance(u, d2u, self.target)
+
+    def _gauss_newton(self, *args, **kwargs):
+        # For unitary U, the distance is |U - target|^2 / (2 dim), a sum of
+        # squares with residual linear in U.
+        du = self.system.du_dcontrols(self.t, *args, **kwargs)
+        flat = du.reshape(du.shape[0], -1)
+        return np.real(np.conj(flat) @ flat.T) / du.shape[1]
+
 class TransferDistance(FidelityBase):
     """Calculate the state transfer fidelity between two states |initial> and
     |final> (see core.fidelities for details) for a given ParametricSystem and a
@@ -118,5 +468,124 @@ class TransferDistance(FidelityBase):
 
     def _df(self, *args, **kwargs):
         u = self.system.u(self.t, *args, **kwargs)
-        du = self.system.du(self.t, *args, **kwargs)
+        du = self.system.du_dcontrols(self.t, *args, **kwargs)
         return d_transfer_distance(u, du, self.initial, self.final)
+
+    def _hessian(self, *args, **kwargs):
+        u = self.system.u(self.t, *args, **kwargs)
+        du = self.system.du_dcontrols(self.t, *args, **kwargs)
+        d2u = self.system.d2u_dcontrols(self.t, *args, **kwargs)
+        return d2_transfer_distance(u, du, d2u, self.initial, self.final)
+
+    def _gauss_newton(self, *args, **kwargs):
+        # The distance is |P U|i>|^2, where P projects out |final>, so the
+        # residual is P U|i>.
+        du = self.system.du_dcontrols(self.t, *args, **kwargs)
+        final = self.final.reshape(-1) / np.linalg.norm(self.final)
+        columns = du @ self.initial.reshape(-1)
+        residuals = columns - np.outer(columns @ np.conj(final), final)
+        return 2 * np.real(np.conj(residuals) @ residuals.T)
+
+    def _f_batch(self, batch, *args, threads=None, **kwargs):
+        us = self.system.u_batch(self.t, batch, *args, threads=threads,
+                                 **kwargs)
+        return [transfer_distance(u, self.initial, self.final) for u in us]
+
+    def _df_batch(self, batch, *args, threads=None, **kwargs):
+        eigensystems = self.system.eigensystem_batch(batch, *args,
+                                                     threads=threads, **kwargs)
+        return [d_transfer_distance(evolution.u(eigensystem, self.t),
+                                    evolution.du_dcontrols(eigensystem, self.t),
+                                    self.initial, self.final)
+                for eigensystem in eigensystems]
+
+class MultiOperatorDistance(FidelityBase):
+    """Calculate the operator distances to several (t, target) pairs at once,
+    for example the same gate at several durations, or several gates.  All the
+    objectives share one eigensystem of the Floquet matrix, and the parts of
+    the control derivatives which do not depend on time are calculated once
+    for all the times.
+
+    f and df return the weighted mean of the distances and their gradients.
+    `values` and `gradients` return each objective separately, in order.
+
+    Attributes:
+        objectives: list of (t, target) pairs
+        weights: normalised weight of each objective (equal by default)"""
+    def __init__(self, system, objectives, weights=None):
+        super().__init__(system)
+        self.objectives = [(t, target) for t, target in objectives]
+        if not self.objectives:
+            raise ValueError("At least one (t, target) pair is needed.")
+        if weights is None:
+            weights = np.ones(len(self.objectives))
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape != (len(self.objectives),):
+            raise ValueError("There must be one weight per objective.")
+        self.weights = weights / np.sum(weights)
+        self.times = sorted({t for t, _ in self.objectives})
+
+    def _operators(self, eigensystem, gradient):
+        """The time-evolution operator (and, if `gradient`, its derivatives)
+        at each distinct time, keyed by the time."""
+        us = {t: evolution.u(eigensystem, t) for t in self.times}
+        if not gradient:
+            return us, None
+        expectations = evolution.k_derivative_expectations(eigensystem)
+        dus = {t: evolution.du_dcontrols_with_expectations(eigensystem, t,
+                                                           expectations)
+               for t in self.times}
+        return us, dus
+
+    def _values(self, eigensystem):
+        us, _ = self._operators(eigensystem, False)
+        return np.array([operator_distance(us[t], target)
+                         for t, target in self.objectives])
+
+    def _gradients(self, eigensystem):
+        us, dus = self._operators(eigensystem, True)
+        return np.array([d_operator_distance(us[t], dus[t], target)
+                         for t, target in self.objectives])
+
+    def values(self, *args, **kwargs):
+        """Return the distance for each objective (without any penalty)."""
+        return self._values(self.system.eigensystem(*args, **kwargs))
+
+    def gradients(self, *args, **kwargs):
+        """Return the gradient of each objective as the rows of a 2D array."""
+        return self._gradients(self.system.eigensystem(*args, **kwargs))
+
+    def _f(self, *args, **kwargs):
+        return self.weights @ self.values(*args, **kwargs)
+
+    def _df(self, *args, **kwargs):
+        return self.weights @ self.gradients(*args, **kwargs)
+
+    def _f_batch(self, batch, *args, threads=None, **kwargs):
+        eigensystems = self.system.eigensystem_batch(batch, *args,
+                                                     threads=threads, **kwargs)
+        return [self.weights @ self._values(eigensystem)
+                for eigensystem in eigensystems]
+
+    def _df_batch(self, batch, *args, threads=None, **kwargs):
+        eigensystems = self.system.eigensystem_batch(batch, *args,
+                                                     threads=threads, **kwargs)
+        return [self.weights @ self._gradients(eigensystem)
+                for eigensystem in eigensystems]
+
+    def _hessian(self, *args, **kwargs):
+        out = 0.0
+        for weight, (t, target) in zip(self.weights, self.objectives):
+            u = self.system.u(t, *args, **kwargs)
+            d2u = self.system.d2u_dcontrols(t, *args, **kwargs)
+            out = out + weight*d2_operator_distance(u, d2u, target)
+        return out
+
+    def _gauss_newton(self, *args, **kwargs):
+        eigensystem = self.system.eigensystem(*args, **kwargs)
+        _, dus = self._operators(eigensystem, True)
+        out = 0.0
+        for weight, (t, _) in zip(self.weights, self.objectives):
+            flat = dus[t].reshape(dus[t].shape[0], -1)
+            out = out + weight*np.real(np.conj(flat) @ flat.T) / dus[t].shape[1]
+        return out
@@ -1,3 +1,4 @@
+import numpy as np
 import scipy.optimize as opt
 
 class OptimizerBase(object):
@@ -19,17 +20,96 @@ class SciPyOptimizer(OptimizerBase):
         method: String specifying method to be used (same as scipy.minimize)
         tol: Float specifying tolerance
         options: Dictionary of minimizer options
+        hessian: None, or the second-order information to pass to methods
+                 which use it (such as 'trust-exact', 'trust-krylov' or
+                 'Newton-CG'):
+                    'exact': the analytic Hessian, fid.hessian,
+                    'hessp': products with the analytic Hessian, fid.hessp,
+                    'gauss-newton': the Gauss-Newton approximation,
+                                    fid.gauss_newton.
 
     Methods:
         optimize: Run optimisation, returns result dictionary."""
-    def __init__(self, fid, init, method='BFGS', tol=1e-5, options={}):
+    def __init__(self, fid, init, method='BFGS', tol=1e-5, options={},
+                 hessian=None):
+        if hessian not in (None, 'exact', 'hessp', 'gauss-newton'):
+            raise ValueError(f"Unknown type of Hessian '{hessian}'.")
         self.fid = fid
         self.init = init
         self.method = method
         self.tol = tol
         self.options = options
+        self.hessian = hessian
 
     def optimize(self):
+        second_order = {}
+        if self.hessian == 'exact':
+            second_order['hess'] = self.fid.hessian
+        elif self.hessian == 'hessp':
+            second_order['hessp'] = self.fid.hessp
+        elif self.hessian == 'gauss-newton':
+            second_order['hess'] = self.fid.gauss_newton
         res = opt.minimize(self.fid.f, self.init, jac=self.fid.df, method=self.method,
-                           tol=self.tol, callback=self.fid.iterate, options=self.options)
+                           tol=self.tol, callback=self.fid.iterate, options=self.options,
+                           **second_order)
         return res
+
+class AdamOptimizer(OptimizerBase):
+    """Minimise a fidelity with the Adam method of stochastic gradient descent
+    (Kingma and Ba, arXiv:1412.6980), which is robust to noisy gradients such as
+    those from fidelity.StochasticEnsembleFidelity.  No line searches are done,
+    so each iteration costs exactly one gradient evaluation, and the fidelity
+    itself is never evaluated: the result has no `fun`, so call fid.f(result.x)
+    if the final value is needed.
+
+    Attributes:
+        fid: Fidelity object to be optimized
+        init: Array of initial control parameters
+        learning_rate: Float size of the initial steps
+        n_iterations: Int maximum number of iterations
+        decay: Float, the learning rate at iteration k is
+               learning_rate / (1 + decay*k)
+        beta1, beta2, epsilon: Floats, the Adam moment parameters
+        tol: Float, stop once the step size falls below this (or None)
+
+    Methods:
+        optimize: Run optimisation, returns result dictionary."""
+    def __init__(self, fid, init, learning_rate=0.01, n_iterations=1000,
+                 decay=0.0, beta1=0.9, beta2=0.999, epsilon=1e-8, tol=None):
+        self.fid = fid
+        self.init = init
+        self.learning_rate = learning_rate
+        self.n_iterations = n_iterations
+        self.decay = decay
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.tol = tol
+
+    def optimize(self):
+        x = np.array(self.init, dtype=np.float64)
+        first = np.zeros_like(x)
+        second = np.zeros_like(x)
+        converged = False
+        gradient, k = None, 0
+        for k in range(1, self.n_iterations + 1):
+            gradient = self.fid.df(x)
+            first = self.beta1*first + (1 - self.beta1)*gradient
+            second = self.beta2*second + (1 - self.beta2)*gradient**2
+            first_hat = first / (1 - self.beta1**k)
+            second_hat = second / (1 - self.beta2**k)
+            rate = self.learning_rate / (1 + self.decay*k)
+            step = rate * first_hat / (np.sqrt(second_hat) + self.epsilon)
+            x = x - step
+            self.fid.record_iteration(None, x)
+            if self.tol is not None and np.linalg.norm(step) < self.tol:
+                converged = True
+                break
+        if gradient is None:
+            # No iterations were run, so report the starting point.
+            gradient = self.fid.df(x)
+        message = "Step size below tolerance." if converged\
+                  else "Maximum number of iterations reached."
+        return opt.OptimizeResult(x=x, jac=gradient, nit=k,
+                                  success=converged or self.tol is None,
+                                  message=message)
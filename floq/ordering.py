@@ -0,0 +1,129 @@
+"""
+Fill-reducing orderings of the sparse Floquet matrix for shift-invert solves.
+`K` is assembled zone-major (all of zone 0, then zone 1, and so on), which is
+already banded when the blocks are dense, but can fill in badly during the LU
+factorisation when the blocks are themselves sparse, such as for lattice or
+spin-chain Hamiltonians.  Which ordering is best depends on the pattern, so a
+few candidates are tried by factorising `K` once with each, and the one with
+the least fill-in is kept.  The choice depends only on the sparsity pattern,
+so it is cached, and every later matrix with the same pattern (the same system
+at different controls, say) reuses it without any more trial factorisations.
+"""
+
+import collections
+import hashlib
+import logging
+import threading
+import time
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
+
+_log = logging.getLogger(__name__)
+
+Ordering = collections.namedtuple(
+    'Ordering', ('name', 'permutation', 'column_spec', 'fill', 'time',
+                 'trials'))
+Ordering.__doc__ = """
+A symmetric permutation of the Floquet matrix, and the SuperLU column ordering
+to factorise it with.  `fill` is the number of stored elements of the `L` and
+`U` factors of the trial factorisation and `time` how long it took in seconds.
+`trials` maps `(name, column_spec)` of every candidate to its `(fill, time)`.
+"""
+
+# The column orderings SuperLU applies on top of the symmetric permutation.
+_COLUMN_SPECS = ('COLAMD', 'MMD_AT_PLUS_A')
+
+# Orderings are small, but there's no need to remember them for patterns which
+# have not been seen for a while.
+_CACHE_SIZE = 16
+_cache = collections.OrderedDict()
+# Batch solves look orderings up from several threads at once.  The lock only
+# guards the cache itself; the trial factorisations run outside it, so two
+# threads meeting a new pattern together may both try it, which is harmless.
+_cache_lock = threading.Lock()
+
+def _pattern_key(k):
+    """A hashable key identifying the sparsity pattern of `k`."""
+    k = k.tocsc()
+    k.sort_indices()
+    digest = hashlib.sha1(np.ascontiguousarray(k.indptr).tobytes())
+    digest.update(np.ascontiguousarray(k.indices).tobytes())
+    return k.shape, k.nnz, digest.hexdigest()
+
+def candidate_permutations(k, dimension):
+    """
+    Return a dictionary of named symmetric permutations of `k`, a Floquet
+    matrix of a Hamiltonian with `dimension` states:
+        'zone-major' -- the assembled layout, unchanged;
+        'interleaved' -- state-major, with every zone of one state together;
+        'rcm' -- reverse Cuthill-McKee on the pattern of `k`.
+    """
+    size = k.shape[0]
+    n_zones = size // dimension
+    return {
+        'zone-major': np.arange(size),
+        'interleaved': np.arange(size).reshape(n_zones, dimension).T.ravel(),
+        'rcm': scipy.sparse.csgraph.reverse_cuthill_mckee(
+            scipy.sparse.csr_matrix(k), symmetric_mode=True).astype(np.int64),
+    }
+
+def permute(k, permutation):
+    """Return `k[permutation][:, permutation]`, in CSC format."""
+    k = scipy.sparse.csr_matrix(k)[permutation]
+    return k.tocsc()[:, permutation].tocsc()
+
+def _trial(k, column_spec):
+    start = time.perf_counter()
+    factor = scipy.sparse.linalg.splu(k, permc_spec=column_spec)
+    return factor.L.nnz + factor.U.nnz, time.perf_counter() - start
+
+def fill_reducing_ordering(k, dimension):
+    """
+    Return the `Ordering` of the sparse Floquet matrix `k` (with `dimension`
+    states per zone) with the least LU fill-in, trying each candidate from
+    `candidate_permutations()` with each SuperLU column ordering the first time
+    a pattern is seen, and reusing the result after that.  The fill-in and
+    factorisation time of every candidate are logged at the `INFO` level.
+    """
+    key = _pattern_key(k), dimension
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    trials = {}
+    permutations = candidate_permutations(k, dimension)
+    for name, permutation in permutations.items():
+        permuted = permute(k, permutation)
+        for column_spec in _COLUMN_SPECS:
+            try:
+                trials[name, column_spec] = _trial(permuted, column_spec)
+            except RuntimeError:
+                # `k` is exactly singular; the fill of the other candidates
+                # will do just as well for the shifted matrices.
+                continue
+    if not trials:
+        raise RuntimeError("Could not factorise the Floquet matrix with any"
+                           " ordering.")
+    (name, column_spec), (fill, elapsed) =\
+        min(trials.items(), key=lambda item: item[1])
+    ordering = Ordering(name, permutations[name], column_spec, fill, elapsed,
+                        trials)
+    original = trials.get(('zone-major', 'COLAMD'))
+    _log.info(
+        f"Ordering a {k.shape[0]}x{k.shape[0]} Floquet matrix as '{name}'"
+        f" with {column_spec}: LU fill {fill} in {elapsed:.3g}s"
+        + ("" if original is None else
+           f", against {original[0]} in {original[1]:.3g}s unordered")
+        + ".")
+    with _cache_lock:
+        _cache[key] = ordering
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return ordering
+
+def clear_cache():
+    """Forget all the orderings chosen so far."""
+    with _cache_lock:
+        _cache.clear()
@@ -1 +1 @@
-from . import simple_ensemble, worker
+from . import linesearch, multistart, pool, simple_ensemble, threads, worker
@@ -0,0 +1,146 @@
+"""
+BFGS with a parallel, speculative line search.  In an ordinary line search the
+trial step lengths are tried one after another, and on a single large system
+every trial is a full diagonalisation of the Floquet matrix, which leaves all
+but one core idle.  Here a whole set of step lengths along the search direction
+is evaluated at once on a `WorkerPool`, one per worker, and the best step which
+satisfies the strong Wolfe conditions is taken.  Most iterations then cost the
+wall time of a single fidelity-and-gradient evaluation.
+"""
+
+import logging
+import numpy as np
+import scipy.optimize as opt
+from ..optimization.optimizer import OptimizerBase
+
+_log = logging.getLogger(__name__)
+
+def _evaluate(fid, x):
+    """The fidelity and its gradient at `x`, sharing one eigensystem."""
+    return fid.f(x), fid.df(x)
+
+def _record_iteration(fid, f, x):
+    """Tell a worker's copy of the fidelity about an accepted step, so that it
+    iterates (for example resamples a stochastic ensemble) with the parent."""
+    fid.record_iteration(f, x)
+
+
+class SpeculativeBFGSOptimizer(OptimizerBase):
+    """Minimise a fidelity with BFGS, evaluating several trial step lengths of
+    each line search concurrently.
+
+    The trial steps are powers of two around the unit step (for example
+    0.25, 0.5, 1, 2 with four candidates).  Of those satisfying the strong Wolfe
+    conditions, the one with the lowest fidelity is accepted; failing that, the
+    lowest one with sufficient decrease; and failing that, a new set of shorter
+    steps is tried.
+
+    Attributes:
+        fid: Fidelity object to be optimized.  With a pool, this is sent to
+             every worker, so must be picklable, and every copy is iterated
+             along with it after each accepted step.
+        init: Array of initial control parameters
+        pool: WorkerPool | None, the pool to evaluate trial steps on.  Without
+              one, the trials are evaluated in turn.
+        n_candidates: Int, the number of trial steps per round, by default
+                      the number of workers (or 4 without a pool)
+        gtol: Float, stop once the largest gradient component is below this
+        max_iterations: Int
+        c1, c2: Floats, the Wolfe condition parameters
+        max_rounds: Int, the most rounds of trial steps in one line search
+
+    Methods:
+        optimize: Run optimisation, returns result dictionary."""
+    def __init__(self, fid, init, pool=None, n_candidates=None, gtol=1e-5,
+                 max_iterations=200, c1=1e-4, c2=0.9, max_rounds=5):
+        self.fid = fid
+        self.init = init
+        self.pool = pool
+        if n_candidates is None:
+            n_candidates = 4 if pool is None else pool.n_workers
+        self.n_candidates = max(2, n_candidates)
+        self.gtol = gtol
+        self.max_iterations = max_iterations
+        self.c1 = c1
+        self.c2 = c2
+        self.max_rounds = max_rounds
+
+    def _evaluate_all(self, points, handle):
+        if handle is None:
+            return [_evaluate(self.fid, x) for x in points]
+        return self.pool.map(_evaluate, points, handle)
+
+    def _line_search(self, x, f, g, direction, handle):
+        """
+        Return `(alpha, f, g, n_evaluations)` for the accepted step, or `None`
+        if no step length gave a decrease.
+        """
+        slope = g @ direction
+        # Powers of two with the unit step second from the top, so there is
+        # one chance to extend the step.
+        alphas = 2.0**np.arange(2 - self.n_candidates, 2)
+        n_evaluations = 0
+        for _ in range(self.max_rounds):
+            results = self._evaluate_all([x + a*direction for a in alphas],
+                                         handle)
+            n_evaluations += len(alphas)
+            values = np.array([result[0] for result in results])
+            armijo = values <= f + self.c1*alphas*slope
+            curvature = np.array([abs(result[1] @ direction)
+                                  <= self.c2*abs(slope)
+                                  for result in results])
+            for accepted in (armijo & curvature, armijo):
+                if np.any(accepted):
+                    i = np.flatnonzero(accepted)[np.argmin(values[accepted])]
+                    return alphas[i], values[i], results[i][1], n_evaluations
+            alphas = alphas[0] * 2.0**np.arange(-self.n_candidates, 0)
+        return None
+
+    def optimize(self):
+        x = np.array(self.init, dtype=np.float64)
+        handle = None if self.pool is None else self.pool.broadcast(self.fid)
+        try:
+            f, g = _evaluate(self.fid, x)
+            n_evaluations = 1
+            inverse_hessian = np.eye(x.shape[0])
+            message = "Maximum number of iterations reached."
+            success = False
+            # Only accepted steps count as iterations.
+            iteration = 0
+            while iteration < self.max_iterations:
+                if np.max(np.abs(g)) < self.gtol:
+                    message, success = "Gradient below tolerance.", True
+                    break
+                direction = -inverse_hessian @ g
+                if g @ direction >= 0:
+                    # Not a descent direction, so restart from steepest descent.
+                    inverse_hessian = np.eye(x.shape[0])
+                    direction = -g
+                step = self._line_search(x, f, g, direction, handle)
+                if step is None:
+                    message = "Line search failed to find a decrease."
+                    break
+                alpha, f_new, g_new, evaluations = step
+                n_evaluations += evaluations
+                s, y = alpha*direction, g_new - g
+                curvature = y @ s
+                if iteration == 0 and curvature > 0:
+                    inverse_hessian *= curvature / (y @ y)
+                if curvature > 0:
+                    rho = 1.0 / curvature
+                    transform = np.eye(x.shape[0]) - rho*np.outer(s, y)
+                    inverse_hessian = transform @ inverse_hessian\
+                                      @ transform.T + rho*np.outer(s, s)
+                x, f, g = x + s, f_new, g_new
+                iteration += 1
+                self.fid.record_iteration(f, x)
+                if handle is not None:
+                    self.pool.apply(handle, _record_iteration, f, x)
+        finally:
+            if handle is not None:
+                self.pool.release(handle)
+        _log.info(f"Speculative BFGS finished after {iteration} iterations and"
+                  f" {n_evaluations} evaluations: {message}")
+        return opt.OptimizeResult(x=x, fun=f, jac=g, nit=iteration,
+                                  nfev=n_evaluations, success=success,
+                                  message=message, hess_inv=inverse_hessian)
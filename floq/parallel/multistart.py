@@ -0,0 +1,191 @@
+"""
+Multi-start optimisation.  Floquet control landscapes typically have many local
+optima, so it is common to run the same local optimiser from many different
+starting controls and keep the best result.  `MultiStartOptimizer` runs the
+starts concurrently on a `WorkerPool`, where each worker keeps its own copy of
+the fidelity (and so its own warm `System`) for all the starts it is given.
+
+The workers share a small block of memory holding the best fidelity found so
+far by any start, which is only updated under a lock shared with them.  A start which has had a few iterations to settle, but is
+still clearly worse than that, is cancelled so the worker can move on to the
+next start, and all starts are stopped early once any one reaches the `target`.
+"""
+
+import contextlib
+import logging
+import multiprocessing as mp
+import sys
+from multiprocessing import shared_memory
+import numpy as np
+import scipy.optimize as opt
+from ..optimization.optimizer import OptimizerBase
+
+_log = logging.getLogger(__name__)
+
+# Layout of the shared block: the best fidelity so far, then a stop flag.
+_BEST, _STOP = 0, 1
+
+# Attaching to a block without tracking it is only possible from Python 3.13.
+_UNTRACKED = {'track': False} if sys.version_info >= (3, 13) else {}
+
+class _Cancelled(Exception):
+    pass
+
+def _attach(shared):
+    """
+    Return the shared state as an array, and the `SharedMemory` it lives in (or
+    `None` if `shared` is already a plain array, when running serially).
+    """
+    if isinstance(shared, np.ndarray):
+        return shared, None
+    # Only the parent registers the block with the resource tracker and
+    # unlinks it.  Before Python 3.13, attaching always registers it again, but
+    # the workers share the parent's tracker, so this is a no-op there.
+    memory = shared_memory.SharedMemory(name=shared, **_UNTRACKED)
+    return np.ndarray((2,), dtype=np.float64, buffer=memory.buf), memory
+
+def uniform_starts(n_starts, lower, upper, seed=None):
+    """
+    Draw `n_starts` starting control vectors uniformly from the box between
+    `lower` and `upper` (arrays with one entry per control), as a 2D array.
+    """
+    lower, upper = np.asarray(lower, dtype=np.float64),\
+                   np.asarray(upper, dtype=np.float64)
+    random = np.random.RandomState(seed)
+    return lower + (upper - lower)*random.uniform(size=(n_starts,)
+                                                  + lower.shape)
+
+def _run_start(fid, task):
+    """
+    Run one local optimisation of `fid` from `task['init']`, sharing progress
+    through the block named by `task['shared']`, whose best fidelity is only
+    updated while holding `task['lock']` (if it is not `None`).  Returns an
+    `OptimizeResult`, with the extra fields `start` and `cancelled`.
+    """
+    state, memory = _attach(task['shared'])
+    lock = task['lock'] or contextlib.nullcontext()
+    margin, grace, target = task['margin'], task['grace'], task['target']
+    last = {'x': None, 'f': np.inf, 'best_x': np.array(task['init']),
+            'best_f': np.inf, 'iterations': 0}
+    def f(x):
+        value = fid.f(x)
+        last['x'], last['f'] = np.array(x), value
+        if value < last['best_f']:
+            last['best_x'], last['best_f'] = np.array(x), value
+        return value
+    def callback(x):
+        last['iterations'] += 1
+        fid.iterate(x)
+        value = last['f'] if last['x'] is not None\
+                and np.array_equal(last['x'], x) else f(x)
+        # Compare and set atomically, so a concurrent improvement from another
+        # start is never overwritten by a worse value.
+        with lock:
+            if value < state[_BEST]:
+                state[_BEST] = value
+        if target is not None and value <= target:
+            state[_STOP] = 1.0
+        elif state[_STOP]:
+            raise _Cancelled("Another start reached the target.")
+        if margin is not None and last['iterations'] >= grace\
+           and value > state[_BEST] + margin:
+            raise _Cancelled("Clearly worse than the best start.")
+    try:
+        if state[_STOP]:
+            raise _Cancelled("Another start reached the target.")
+        result = opt.minimize(f, task['init'], jac=fid.df,
+                              method=task['method'], tol=task['tol'],
+                              callback=callback, options=task['options'])
+        result.cancelled = False
+    except _Cancelled as cancellation:
+        result = opt.OptimizeResult(x=last['best_x'], fun=last['best_f'],
+                                    nit=last['iterations'], success=False,
+                                    message=str(cancellation), cancelled=True)
+    finally:
+        if memory is not None:
+            memory.close()
+    result.start = task['start']
+    return result
+
+
+class MultiStartOptimizer(OptimizerBase):
+    """Run a scipy.minimize local optimisation from each of several starting
+    points, concurrently on a `floq.parallel.pool.WorkerPool` if one is given
+    (otherwise one after another), and return the best.
+
+    Attributes:
+        fid: Fidelity object to be optimized.  With a pool, this is sent to
+             every worker, so must be picklable.
+        inits: 2D array, one row of initial control parameters per start
+               (see `uniform_starts`)
+        pool: WorkerPool | None
+        method, tol, options: as for SciPyOptimizer
+        margin: Float | None, cancel a start once its fidelity is more than
+                this above the best so far (None never cancels)
+        grace: Int, the number of iterations a start may run before it can
+               be cancelled
+        target: Float | None, stop every start once one reaches this fidelity
+
+    Methods:
+        optimize: Run all the starts, returns a result dictionary with the
+                  best `x` and `fun`, the index `best` of the best start,
+                  `results` (one OptimizeResult per start, in order, with a
+                  `cancelled` field) and `n_cancelled`."""
+    def __init__(self, fid, inits, pool=None, method='BFGS', tol=1e-5,
+                 options={}, margin=None, grace=5, target=None):
+        self.fid = fid
+        self.inits = np.asarray(inits, dtype=np.float64)
+        self.pool = pool
+        self.method = method
+        self.tol = tol
+        self.options = options
+        self.margin = margin
+        self.grace = grace
+        self.target = target
+
+    def _tasks(self, shared, lock=None):
+        return [{'start': i, 'init': init, 'shared': shared, 'lock': lock,
+                 'method': self.method, 'tol': self.tol,
+                 'options': self.options, 'margin': self.margin,
+                 'grace': self.grace, 'target': self.target}
+                for i, init in enumerate(self.inits)]
+
+    def optimize(self):
+        if self.pool is None:
+            state = np.array([np.inf, 0.0])
+            results = [_run_start(self.fid, task)
+                       for task in self._tasks(state)]
+        else:
+            memory = shared_memory.SharedMemory(create=True,
+                                                size=2*np.float64().nbytes)
+            # The workers are already running, so they cannot inherit a plain
+            # `multiprocessing.Lock`, but a manager's proxy can be sent to them.
+            manager = mp.get_context(self.pool.start_method).Manager()
+            handle = None
+            try:
+                state = np.ndarray((2,), dtype=np.float64, buffer=memory.buf)
+                state[:] = [np.inf, 0.0]
+                handle = self.pool.broadcast(self.fid)
+                results = self.pool.map(_run_start,
+                                        self._tasks(memory.name,
+                                                    manager.Lock()),
+                                        handle)
+            finally:
+                if handle is not None:
+                    self.pool.release(handle)
+                manager.shutdown()
+                del state
+                memory.close()
+                memory.unlink()
+        best = int(np.argmin([result.fun for result in results]))
+        n_cancelled = sum(result.cancelled for result in results)
+        _log.info(f"Multi-start: best fidelity {results[best].fun} from start"
+                  f" {best}; {n_cancelled} of {len(results)} starts"
+                  " cancelled.")
+        return opt.OptimizeResult(x=results[best].x, fun=results[best].fun,
+                                  best=best, results=results,
+                                  n_cancelled=n_cancelled,
+                                  success=bool(results[best].success
+                                               or (self.target is not None
+                                                   and results[best].fun
+                                                   <= self.target)))
@@ -0,0 +1,332 @@
+"""
+A long-lived pool of worker processes which can be shared between many fidelity
+objects and optimisation runs.  Starting a fresh process is expensive for
+`floq`, because each one has to import `numpy`, `scipy` and `numba` and then
+compile all the kernels in `floq.evolution` before it can do any useful work.
+A `WorkerPool` pays this cost once, when it is created, and then keeps its
+workers alive until it is explicitly closed.
+
+Workers are started with the 'forkserver' method where it is available (and
+'spawn' otherwise), so they never inherit half-initialised state such as BLAS
+thread pools from the parent process.  The forkserver is shared by every pool and
+keeps the environment it was started with, so if `threadpoolctl` is not
+installed to change BLAS limits at run time, 'spawn' is used instead so that
+each worker loads BLAS with its own pool's limits.  This means that everything sent to a
+worker must be picklable - in particular, Hamiltonians should be module-level
+functions or callable objects rather than closures.
+"""
+
+import contextlib
+import itertools
+import logging
+import multiprocessing as mp
+import multiprocessing.connection
+import os
+import numpy as np
+from . import threads as _threads
+
+_log = logging.getLogger(__name__)
+
+def _default_start_method():
+    methods = mp.get_all_start_methods()
+    if 'forkserver' in methods and _threads.runtime_control():
+        return 'forkserver'
+    return 'spawn'
+
+def warm_up():
+    """
+    Compile the `numba` kernels in the current process by running a small
+    two-level system through every calculation, in both sparse and dense modes.
+    This is the default start-up function of a `WorkerPool`.
+    """
+    from ..system import System
+    hamiltonian = np.zeros((3, 2, 2), dtype=np.complex128)
+    hamiltonian[0, 1, 0] = hamiltonian[2, 0, 1] = 0.1
+    hamiltonian[1] = np.diag([0.3, -0.3])
+    dhamiltonian = np.zeros((1, 3, 2, 2), dtype=np.complex128)
+    dhamiltonian[0, 0, 1, 0] = dhamiltonian[0, 2, 0, 1] = 1.0
+    for sparse in (True, False):
+        system = System(hamiltonian, dhamiltonian, n_zones=7, frequency=1.0,
+                        sparse=sparse)
+        system.u(0.5)
+        system.du_dt(0.5)
+        system.du_dcontrols(0.5)
+
+@contextlib.contextmanager
+def _environment(variables):
+    """
+    Temporarily set environment variables, so that processes started inside the
+    context inherit them before they load any BLAS libraries.
+    """
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+def _serve(connection, initialiser, budget):
+    """
+    Main loop of a worker process.  Messages are tuples of `(command, *data)`,
+    and the loop stops when `None` is received.  Every message gets exactly one
+    reply, which is a pair `(success, value)`.
+    """
+    budget.apply()
+    if initialiser is not None:
+        initialiser()
+    store = {}
+    message = connection.recv()
+    while message is not None:
+        command, data = message[0], message[1:]
+        try:
+            if command == 'store':
+                handle, value = data
+                store[handle] = value
+                out = None
+            elif command == 'release':
+                store.pop(data[0], None)
+                out = None
+            elif command == 'apply':
+                handle, function, args = data
+                out = function(store[handle], *args)
+            elif command == 'run':
+                handle, function, item = data
+                out = function(item) if handle is None\
+                      else function(store[handle], item)
+            elif command == 'call':
+                function, args = data
+                out = function(*args)
+            else:
+                raise ValueError(f"Unknown worker command '{command}'.")
+            reply = (True, out)
+        except Exception as exception:
+            reply = (False, exception)
+        connection.send(reply)
+        message = connection.recv()
+    connection.close()
+
+
+class WorkerPool:
+    """
+    A fixed-size set of persistent worker processes.  Workers are started (and
+    JIT-warmed) once when the pool is created, and may then be reused by any
+    number of fidelity objects and optimisers until `close()` is called.  The
+    pool is also a context manager, which closes itself on exit:
+
+        with floq.parallel.pool.WorkerPool(4) as pool:
+            fidelity = FidelityMaster(4, ensemble, OperatorDistance, pool=pool,
+                                      t=1.0, target=target)
+            SciPyOptimizer(fidelity, init).optimize()
+
+    Objects are placed onto the workers with `scatter()` (splitting a list of
+    objects between the workers) or `broadcast()` (a full copy on every worker),
+    which return an integer handle.  The stored objects keep any state they
+    build up (such as cached eigensystems) between calls, and are acted on with
+    `apply()` and `map()`.  Handles should be given back with `release()` when
+    they are no longer needed.
+
+    Each worker limits its BLAS and `numba` threads to its share of the cores
+    (see `floq.parallel.threads.ThreadBudget`), so that the workers do not
+    oversubscribe the machine.  `layout()` reports the limits in effect.
+    """
+    def __init__(self, n_workers=None, start_method=None, initialiser=warm_up,
+                 threads=None):
+        """
+        Arguments --
+        n_workers: int > 0 | None --
+            The number of worker processes.  Defaults to the number of CPUs.
+
+        start_method: 'forkserver' | 'spawn' | 'fork' | None --
+            The `multiprocessing` start method to use for the workers.  Defaults
+            to 'forkserver' if the platform supports it and `threadpoolctl` is
+            installed, or 'spawn' otherwise.  Without `threadpoolctl`, only
+            'spawn' workers are guaranteed to apply the BLAS limits of
+            `threads`.
+
+        initialiser: () -> None | None --
+            A picklable function called once in each worker when it starts,
+            before it accepts any work.  The default compiles the `numba`
+            kernels used by `floq.System`.
+
+        threads: floq.parallel.threads.ThreadBudget | None --
+            The thread layout each worker applies when it starts.  Defaults to
+            splitting the available cores evenly between the workers.
+        """
+        self.n_workers = n_workers or _threads.available_cores()
+        self.start_method = start_method or _default_start_method()
+        self.threads = threads or _threads.ThreadBudget.split(self.n_workers)
+        if self.start_method != 'spawn' and not _threads.runtime_control():
+            _log.warning(f"Workers started with '{self.start_method}' may not"
+                         " apply the BLAS thread limits, because threadpoolctl"
+                         " is not installed.")
+        context = mp.get_context(self.start_method)
+        self._handles = itertools.count()
+        self._placement = {}
+        self._connections = []
+        self._workers = []
+        _log.info(f"Starting {self.n_workers} workers with start method"
+                  f" '{self.start_method}' and thread layout {self.threads}.")
+        variables = {name: str(self.threads.blas_threads)
+                     for name in _threads._BLAS_VARIABLES}
+        with _environment(variables):
+            for _ in range(self.n_workers):
+                ours, theirs = context.Pipe()
+                worker = context.Process(target=_serve,
+                                         args=(theirs, initialiser,
+                                               self.threads),
+                                         daemon=True)
+                worker.start()
+                theirs.close()
+                self._connections.append(ours)
+                self._workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def closed(self):
+        return not self._workers
+
+    def _send(self, worker, *message):
+        if self.closed:
+            raise ValueError("Cannot use a closed WorkerPool.")
+        self._connections[worker].send(message)
+
+    def _gather(self, workers):
+        # Always drain every reply, so a failure on one worker doesn't leave
+        # stale messages in the other pipes.
+        replies = [self._connections[worker].recv() for worker in workers]
+        for success, value in replies:
+            if not success:
+                raise value
+        return [value for _, value in replies]
+
+    def layout(self):
+        """
+        Return the thread limits in effect on each worker, as a list of the
+        dictionaries produced by `floq.parallel.threads.current_layout()`.
+        """
+        workers = list(range(self.n_workers))
+        for worker in workers:
+            self._send(worker, 'call', _threads.current_layout, ())
+        return self._gather(workers)
+
+    def scatter(self, objects):
+        """
+        Split the list `objects` as evenly as possible between the workers, and
+        return a handle which refers to the chunks.  Workers which would receive
+        no objects are not used.
+        """
+        objects = list(objects)
+        handle = next(self._handles)
+        pieces = [chunk for chunk in chunks(objects, self.n_workers) if chunk]
+        workers = list(range(len(pieces)))
+        for worker, chunk in zip(workers, pieces):
+            self._send(worker, 'store', handle, chunk)
+        self._gather(workers)
+        self._placement[handle] = workers
+        return handle
+
+    def broadcast(self, value):
+        """
+        Store a separate copy of `value` on every worker, and return a handle
+        which refers to it.
+        """
+        handle = next(self._handles)
+        workers = list(range(self.n_workers))
+        for worker in workers:
+            self._send(worker, 'store', handle, value)
+        self._gather(workers)
+        self._placement[handle] = workers
+        return handle
+
+    def release(self, handle):
+        """Delete the objects referred to by `handle` from the workers."""
+        workers = self._placement.pop(handle, [])
+        if self.closed:
+            return
+        for worker in workers:
+            self._send(worker, 'release', handle)
+        self._gather(workers)
+
+    def apply(self, handle, function, *args):
+        """
+        Call `function(stored, *args)` on every worker holding objects from
+        `handle`, where `stored` is that worker's chunk (for `scatter()`) or
+        copy (for `broadcast()`).  The calls run concurrently, and the results
+        are returned as a list in worker order.
+        """
+        workers = self._placement[handle]
+        for worker in workers:
+            self._send(worker, 'apply', handle, function, args)
+        return self._gather(workers)
+
+    def map(self, function, iterable, handle=None):
+        """
+        Return `[function(item) for item in iterable]`, with the items shared
+        dynamically between the workers as they become free.  If `handle` is
+        given, it must come from `broadcast()`, and the calls are instead
+        `function(stored, item)` using each worker's own copy of the object.
+        """
+        items = list(iterable)
+        if handle is not None and len(self._placement[handle]) != self.n_workers:
+            raise ValueError("Mapping requires a handle from `broadcast()`.")
+        results = [None] * len(items)
+        queue = iter(enumerate(items))
+        pending = {}
+        failure = None
+        def dispatch(worker):
+            try:
+                index, item = next(queue)
+            except StopIteration:
+                return
+            self._send(worker, 'run', handle, function, item)
+            pending[self._connections[worker]] = (worker, index)
+        for worker in range(self.n_workers):
+            dispatch(worker)
+        while pending:
+            for connection in mp.connection.wait(list(pending)):
+                worker, index = pending.pop(connection)
+                success, value = connection.recv()
+                if success:
+                    results[index] = value
+                elif failure is None:
+                    failure = value
+                if failure is None:
+                    dispatch(worker)
+        if failure is not None:
+            raise failure
+        return results
+
+    def close(self):
+        """Stop all the workers, waiting for them to finish cleanly."""
+        if self.closed:
+            return
+        for connection in self._connections:
+            connection.send(None)
+        for connection, worker in zip(self._connections, self._workers):
+            worker.join()
+            connection.close()
+        self._connections, self._workers = [], []
+        self._placement = {}
+
+    def terminate(self):
+        """Kill all the workers immediately, without waiting for them."""
+        for connection, worker in zip(self._connections, self._workers):
+            worker.terminate()
+            connection.close()
+        self._connections, self._workers = [], []
+        self._placement = {}
+
+
+def chunks(l, n):
+    """Split list l into n chunks as uniformly as possible."""
+    k, m = divmod(len(l), n)
+    return [l[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
@@ -1,39 +1,41 @@
 # You got nothing to lose but your chains!
-import multiprocessing as mp
 import numpy as np
-from ..optimization.fidelity import FidelityBase
-
-def run_fid(pair):
-    fid, ctrl = pair
-    fid.f(ctrl)
-    return fid
-
-def run_dfid(pair):
-    fid, ctrl = pair
-    fid.df(ctrl)
-    return fid
+from ..optimization.fidelity import FidelityBase, ensemble_weights
+from .pool import WorkerPool
+from .worker import _sum_f, _sum_df
 
 class ParallelEnsembleFidelity(FidelityBase):
     """With a given Ensemble, and a FidelityComputer, calculate the average
-    fidelity over the whole ensemble."""
-    def __init__(self, ensemble, fidelity, **params):
+    fidelity over the whole ensemble, weighted by the ensemble's weights.
+
+    The work is shared between the processes of a `WorkerPool`.  Pass `pool` to
+    share an existing pool between several fidelities, otherwise a private pool
+    with one worker per CPU is started, which is shut down by close().  The
+    private pool's thread layout can be set with `threads`, a
+    `floq.parallel.threads.ThreadBudget`; it cannot be given with `pool`."""
+    def __init__(self, ensemble, fidelity, pool=None, threads=None, **params):
+        if pool is not None and threads is not None:
+            raise ValueError("'threads' only applies to a private pool; set the"
+                             " thread layout when creating the shared pool.")
         super(ParallelEnsembleFidelity, self).__init__(ensemble)
         self.fidelities = [fidelity(sys, **params) for sys in ensemble.systems]
-        self.pool = mp.Pool()
-
-    def f(self, controls_and_t):
-        self.dispatch_f_to_pool(controls_and_t)
-        return np.mean([fid.f(controls_and_t) for fid in self.fidelities])
+        self.n = len(self.fidelities)
+        self.weights = ensemble_weights(ensemble)
+        self._owns_pool = pool is None
+        self.pool = WorkerPool(threads=threads) if pool is None else pool
+        self._handle = self.pool.scatter(zip(self.weights, self.fidelities))
 
-    def df(self, controls_and_t):
-        self.dispatch_df_to_pool(controls_and_t)
-        return np.mean([fid.df(controls_and_t) for fid in self.fidelities],
-                       axis=0)
+    def _f(self, controls_and_t):
+        parts = self.pool.apply(self._handle, _sum_f, controls_and_t)
+        return np.sum(parts)
 
-    def dispatch_f_to_pool(self, controls_and_t):
-        items = [(fid, controls_and_t) for fid in self.fidelities]
-        self.fidelities = self.pool.map(run_fid, items)
+    def _df(self, controls_and_t):
+        parts = self.pool.apply(self._handle, _sum_df, controls_and_t)
+        return np.sum(parts, axis=0)
 
-    def dispatch_df_to_pool(self, controls_and_t):
-        items = [(fid, controls_and_t) for fid in self.fidelities]
-        self.fidelities = self.pool.map(run_dfid, items)
+    def close(self):
+        """Release the fidelities from the pool, shutting it down if it is
+        private to this object."""
+        self.pool.release(self._handle)
+        if self._owns_pool:
+            self.pool.close()
@@ -0,0 +1,156 @@
+"""
+Control of the number of threads used by each process.  `numpy.linalg` and
+`scipy.sparse.linalg` call into multi-threaded BLAS/LAPACK and ARPACK libraries,
+and `numba` has its own thread pool.  If several worker processes each start one
+thread per core, the machine ends up with (processes x cores) threads competing
+for the same cores, which is frequently slower than running serially.  A
+`ThreadBudget` divides the available cores between the processes, and is applied
+by each `WorkerPool` worker when it starts.
+
+The BLAS limits are set at run time through `threadpoolctl` if it is installed.
+Otherwise they can only be set through the standard environment variables, which
+BLAS reads once when it is loaded, so they must be in place before the process
+imports `numpy`.  `WorkerPool` does this by starting fresh ('spawn') workers
+inside an environment holding the limits whenever `threadpoolctl` is missing.
+"""
+
+import ctypes
+import glob
+import logging
+import os
+
+_log = logging.getLogger(__name__)
+
+# Environment variables read by the common BLAS/OpenMP implementations when they
+# are first loaded.
+_BLAS_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                   'NUMEXPR_NUM_THREADS')
+
+# Keep a reference to any `threadpoolctl` limiter, because the limits are undone
+# when it is garbage collected.
+_limiter = None
+
+def runtime_control():
+    """
+    Whether the BLAS thread limits of an already-running process can be changed,
+    which needs `threadpoolctl`.
+    """
+    try:
+        import threadpoolctl
+    except ImportError:
+        return False
+    return True
+
+def available_cores():
+    """The number of cores this process is allowed to run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+class ThreadBudget:
+    """
+    A layout of threads: `n_processes` processes, each of which uses up to
+    `blas_threads` threads inside BLAS/LAPACK calls and `numba_threads` threads
+    in parallel `numba` kernels.  A process only ever runs one of these at a
+    time, so both should be set to that process's share of the cores.
+    """
+    def __init__(self, n_processes=1, blas_threads=1, numba_threads=1,
+                 n_cores=None):
+        self.n_processes = n_processes
+        self.blas_threads = blas_threads
+        self.numba_threads = numba_threads
+        self.n_cores = n_cores or available_cores()
+
+    @classmethod
+    def split(cls, n_processes=None, n_cores=None):
+        """
+        Divide `n_cores` (default: all available) evenly between `n_processes`
+        processes (default: one per core).  Every process gets at least one
+        thread, and spare cores are left idle rather than oversubscribed.
+        """
+        n_cores = n_cores or available_cores()
+        n_processes = n_processes or n_cores
+        share = max(1, n_cores // n_processes)
+        if n_processes > n_cores:
+            _log.warning(f"{n_processes} processes requested on {n_cores}"
+                         " cores - the processes will be oversubscribed.")
+        return cls(n_processes, share, share, n_cores)
+
+    def apply(self):
+        """
+        Limit the threads of the current process to this budget's per-process
+        share.  Without `threadpoolctl`, BLAS libraries which are already loaded
+        keep the limits they were started with.
+        """
+        global _limiter
+        for variable in _BLAS_VARIABLES:
+            os.environ[variable] = str(self.blas_threads)
+        try:
+            import threadpoolctl
+        except ImportError:
+            blas = _openblas_threads()
+            if blas and any(threads > self.blas_threads
+                            for _, threads in blas):
+                _log.warning("threadpoolctl is not installed, so the BLAS"
+                             f" thread limit {self.blas_threads} cannot be"
+                             " applied to the loaded libraries"
+                             f" {blas}.")
+        else:
+            _limiter = threadpoolctl.threadpool_limits(self.blas_threads)
+        import numba
+        numba.set_num_threads(min(self.numba_threads,
+                                  numba.config.NUMBA_NUM_THREADS))
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(n_processes={self.n_processes},"
+                f" blas_threads={self.blas_threads},"
+                f" numba_threads={self.numba_threads},"
+                f" n_cores={self.n_cores})")
+
+    def __str__(self):
+        return (f"{self.n_processes} processes x ({self.blas_threads} BLAS,"
+                f" {self.numba_threads} numba threads) on {self.n_cores}"
+                " cores")
+
+def _openblas_threads():
+    """
+    Ask the OpenBLAS libraries shipped in the `numpy` and `scipy` wheels how
+    many threads they use, for when `threadpoolctl` is not installed.  Returns a
+    list of `(library, threads)` pairs, or None if no library could be queried.
+    """
+    import numpy
+    site = os.path.dirname(os.path.dirname(numpy.__file__))
+    symbols = ('openblas_get_num_threads', 'openblas_get_num_threads64_',
+               'scipy_openblas_get_num_threads64_',
+               'scipy_openblas_get_num_threads')
+    out = []
+    for path in sorted(glob.glob(os.path.join(site, '*.libs', '*openblas*'))):
+        try:
+            library = ctypes.CDLL(path)
+        except OSError:
+            continue
+        for symbol in symbols:
+            function = getattr(library, symbol, None)
+            if function is not None:
+                out.append(('openblas', function()))
+                break
+    return out or None
+
+def current_layout():
+    """
+    Report the thread limits actually in effect in the current process, as a
+    dictionary with keys 'pid', 'blas' and 'numba'.  The 'blas' entry is a list
+    of `(library, threads)` pairs read back from the loaded libraries, or None
+    if they cannot be queried (`threadpoolctl` is not installed and BLAS is not
+    a wheel-bundled OpenBLAS).
+    """
+    import numba
+    if not runtime_control():
+        blas = _openblas_threads()
+    else:
+        import threadpoolctl
+        blas = [(info['internal_api'], info['num_threads'])
+                for info in threadpoolctl.threadpool_info()]
+    return {'pid': os.getpid(), 'blas': blas, 'numba': numba.get_num_threads()}
@@ -1,89 +1,64 @@
 import logging
-import multiprocessing as mp
 import numpy as np
-from ..optimization.fidelity import FidelityBase
+from ..optimization.fidelity import FidelityBase, ensemble_weights
+from .pool import WorkerPool, chunks
+
+def _sum_f(pairs, controls_and_t):
+    """Weighted sum of the fidelities in a list of (weight, fidelity) pairs."""
+    return np.sum([weight * fid.f(controls_and_t) for weight, fid in pairs])
+
+def _sum_df(pairs, controls_and_t):
+    """Weighted sum of the gradients in a list of (weight, fidelity) pairs."""
+    return np.sum([weight * fid.df(controls_and_t) for weight, fid in pairs],
+                  axis=0)
 
 class FidelityMaster(FidelityBase):
     """With a given Ensemble, and a FidelityComputer, calculate the average
     fidelity over the whole ensemble by distributing the work onto nworker
-    sub-processes, which should run in parallel if there are enough cores
-    available.
+    processes of a `WorkerPool`, which should run in parallel if there are
+    enough cores available.  The average is weighted by the ensemble's weights.
 
-    Note: After use, the FidelityMaster should be forced to kill the child
-    processes by calling the kill() method. It is recommended to use a new
-    FidelityMaster thereafter."""
-    def __init__(self, nworker, ensemble, fidelity, **params):
+    The fidelities are built once and stay on the workers, so each one keeps its
+    cached eigensystem between calls.  If a `pool` is given it is shared, and
+    can be reused by other fidelities after this one is finished with;
+    otherwise a private pool of nworker processes is started, which divides the
+    cores between its workers according to `threads` (a
+    `floq.parallel.threads.ThreadBudget`, by default an even split).  A shared
+    pool keeps the layout it was created with, so `threads` cannot be given with
+    `pool`.
+
+    Note: After use, the FidelityMaster should release its workers by calling
+    the kill() method.  This only shuts down the pool if it is private."""
+    def __init__(self, nworker, ensemble, fidelity, pool=None, threads=None,
+                 **params):
+        if pool is not None and threads is not None:
+            raise ValueError("'threads' only applies to a private pool; set the"
+                             " thread layout when creating the shared pool.")
         super(FidelityMaster, self).__init__(ensemble)
         self.fidelities = [fidelity(sys, **params) for sys in ensemble.systems]
         self.n = len(ensemble.systems)
+        self.weights = ensemble_weights(ensemble)
         self.nworker = nworker
-        self.fidelities_chunked = chunks(self.fidelities, nworker)
-        self._make_workers()
-
-    def _make_workers(self):
-        """Spawn the workers, set up pipes to talk to them."""
-        in_pipes = [mp.Pipe() for i in range(self.nworker)]
-        out_pipes = [mp.Pipe() for i in range(self.nworker)]
-        self.workers = []
-        logging.info('Attempting to spawn workers')
-        for i in range(self.nworker):
-            worker = FidelityWorker(self.fidelities_chunked[i], in_pipes[i][1],\
-                                    out_pipes[i][1])
-            worker.start()
-            self.workers.append(worker)
-        logging.info('Successfully spawned workers')
-        self.ins = [in_pipes[i][0] for i in range(self.nworker)]
-        self.outs = [out_pipes[i][0] for i in range(self.nworker)]
+        self._owns_pool = pool is None
+        self.pool = WorkerPool(nworker, threads=threads) if pool is None\
+                    else pool
+        logging.info('Distributing ' + str(self.n) + ' fidelities to workers'
+                     + ' with thread layout ' + str(self.pool.threads))
+        self._handle = self.pool.scatter(zip(self.weights, self.fidelities))
 
     def _f(self, controls_and_t):
         """Compute the average fidelity of the ensemble."""
-        for pipe in self.ins:
-            pipe.send(['f', controls_and_t])
-        return np.sum([pipe.recv() for pipe in self.outs]) / self.n
+        parts = self.pool.apply(self._handle, _sum_f, controls_and_t)
+        return np.sum(parts)
 
     def _df(self, controls_and_t):
         """Compute the average gradient of the fidelity of the ensemble."""
-        for pipe in self.ins:
-            pipe.send(['df', controls_and_t])
-        return np.sum([pipe.recv() for pipe in self.outs], axis=0) / self.n
+        parts = self.pool.apply(self._handle, _sum_df, controls_and_t)
+        return np.sum(parts, axis=0)
 
     def kill(self):
-        """Terminate the workers spawned."""
-        for pipe in self.ins:
-            pipe.send(None) # tell workers to stop run()
-        for worker in self.workers:
-            worker.terminate()  # shut them down
-
-class FidelityWorker(mp.Process):
-    """Wraps a list of FidelityComputers, performing their computations in a
-    separate process. Communication with the 'master' process is done via Pipes.
-    F and dF will be added up locally, since only averages are used in the
-    optimisation. This reduces the amount of data to be communicated between
-    processes.
-
-    Note: the start() methods needs to be run before computations are
-    performed."""
-    def __init__(self, fids, pipe_in, pipe_out):
-        super(FidelityWorker, self).__init__()
-        self.pipe_in = pipe_in
-        self.pipe_out = pipe_out
-        self.fids = fids
-        logging.info('Worker initialised with '
-                     + str(len(self.fids))
-                     + ' fidelities')
-
-    def run(self):
-        """When this is run, the Worker starts listening on its in_pipe, it
-        stops when None is sent through the pipe."""
-        msg = self.pipe_in.recv()
-        while msg is not None:
-            out_msg = np.sum([fid.f(msg[1]) for fid in self.fids])\
-                      if msg[0] == 'f' else\
-                      np.sum([fid.df(msg[1]) for fid in self.fids], axis=0)
-            self.pipe_out.send(out_msg)
-            msg = self.pipe_in.recv()
-
-def chunks(l, n):
-    """Split list l into n chunks as uniformly as possible."""
-    k, m = divmod(len(l), n)
-    return [l[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
+        """Release the fidelities from the workers, and shut the workers down if
+        the pool is private to this object."""
+        self.pool.release(self._handle)
+        if self._owns_pool:
+            self.pool.close()
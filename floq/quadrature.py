@@ -0,0 +1,98 @@
+"""
+Quadrature rules for building weighted ensembles.  Ensemble averages of a
+fidelity over a smooth distribution of parameters (such as inhomogeneously
+broadened detunings, or amplitude errors) converge far faster with a Gaussian
+quadrature rule than with random sampling, so a handful of weighted systems can
+replace hundreds of randomly drawn ones.
+
+Every rule returns a pair `(nodes, weights)`, where the weights are normalised
+to sum to one, so that `np.sum(weights * f(nodes))` approximates the
+expectation value of `f` over the distribution.  One-dimensional rules return a
+1D array of nodes, and the multi-dimensional rules return nodes with shape
+`(n_nodes, n_dimensions)`.  These can be passed directly as the parameters and
+weights of an ensemble (see `floq.system.EnsembleBase.weights`).
+"""
+
+import itertools
+import math
+import numpy as np
+
+def gauss_hermite(n_nodes, mean=0.0, sigma=1.0):
+    """
+    Gauss-Hermite rule for the normal distribution with the given mean and
+    standard deviation.  This is exact for polynomials of degree up to
+    `2*n_nodes - 1`.
+    """
+    nodes, weights = np.polynomial.hermite_e.hermegauss(n_nodes)
+    return mean + sigma*nodes, weights / np.sum(weights)
+
+def gauss_legendre(n_nodes, lower=-1.0, upper=1.0):
+    """
+    Gauss-Legendre rule for the uniform distribution on `[lower, upper]`.  This
+    is exact for polynomials of degree up to `2*n_nodes - 1`.
+    """
+    nodes, weights = np.polynomial.legendre.leggauss(n_nodes)
+    centre, half_width = 0.5*(upper + lower), 0.5*(upper - lower)
+    return centre + half_width*nodes, weights / np.sum(weights)
+
+def tensor_product(*rules):
+    """
+    Combine several one-dimensional `(nodes, weights)` pairs (one per
+    independently distributed parameter) into a single multi-dimensional rule,
+    containing every combination of the nodes.
+    """
+    nodes = np.array(list(itertools.product(*(rule[0] for rule in rules))))
+    weights = np.array([np.prod(combination) for combination
+                        in itertools.product(*(rule[1] for rule in rules))])
+    return nodes.reshape(len(weights), len(rules)), weights
+
+def sparse_grid(rules, level, decimals=12):
+    """
+    Smolyak sparse-grid rule over several independent parameters.  For many
+    parameters this needs far fewer nodes than the full tensor product for the
+    same polynomial exactness, though some of the weights may be negative.
+
+    Arguments --
+    rules: iterable of (n_nodes: int) -> (nodes, weights) --
+        One rule-generating function per parameter, such as
+            functools.partial(gauss_hermite, mean=0.0, sigma=0.1)
+        The one-dimensional rule at sub-level `i >= 1` uses `i` nodes.
+
+    level: int >= 0 --
+        The level of the sparse grid.  Level 0 is the single-node rule, and
+        the rule integrates polynomials of total degree `2*level + 1` exactly.
+
+    decimals: int --
+        Nodes which coincide to this many decimal places are merged, and their
+        weights summed.
+
+    Returns --
+    nodes: np.array of float, shape=(n_nodes, len(rules))
+    weights: np.array of float, shape=(n_nodes,)
+    """
+    rules = list(rules)
+    dimension = len(rules)
+    combined = {}
+    # Smolyak combination technique: sum of tensor rules with multi-indices
+    # `level + 1 <= |i| <= level + dimension`, with alternating coefficients.
+    for total in range(max(dimension, level + 1), level + dimension + 1):
+        coefficient = (-1)**(level + dimension - total)\
+                      * math.comb(dimension - 1, level + dimension - total)
+        for index in _compositions(total, dimension):
+            nodes, weights = tensor_product(*(rule(i) for rule, i
+                                              in zip(rules, index)))
+            for node, weight in zip(nodes, weights):
+                key = tuple(np.round(node, decimals) + 0.0)
+                combined[key] = combined.get(key, 0.0) + coefficient*weight
+    nodes = np.array(list(combined.keys()), dtype=np.float64)
+    weights = np.array(list(combined.values()), dtype=np.float64)
+    return nodes.reshape(len(weights), dimension), weights
+
+def _compositions(total, n_parts):
+    """All tuples of `n_parts` integers >= 1 which sum to `total`."""
+    if n_parts == 1:
+        yield (total,)
+        return
+    for first in range(1, total - n_parts + 2):
+        for rest in _compositions(total - first, n_parts - 1):
+            yield (first,) + rest
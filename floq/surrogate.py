@@ -0,0 +1,355 @@
+"""
+Interpolated surrogates for the Floquet eigensystem over a continuous ensemble
+parameter.  Robustness studies evaluate the time-evolution operator for many
+values of a smoothly varying parameter (a detuning, or an amplitude error), and
+every one of those would normally need its own diagonalisation of the Floquet
+matrix.  A `Surrogate` instead only diagonalises at a handful of Chebyshev nodes
+across the parameter's range, and interpolates the quasienergies and Floquet
+modes in between.
+
+The eigenvectors at the nodes have arbitrary phases, and a quasienergy which
+crosses the edge of the first Brillouin zone swaps to the opposite edge, so the
+raw eigensystems are not smooth in the parameter.  Before interpolating, each
+node is aligned with its neighbour: every state is matched to the state of the
+previous node which it overlaps most, allowing for a shift of one zone (a roll
+of the Fourier components, which changes the quasienergy by one frequency), and
+its phase is fixed so that overlap is real and positive.
+
+The interpolated eigensystem is combined with the exact derivative of the
+Floquet matrix at the requested parameter, which is cheap to assemble, so `U`,
+`dU/dt` and `dU/dcontrols` all use the usual formulae from `floq.evolution`.
+`SurrogateSystem` wraps this with the interface of `floq.System`, and
+`InterpolatedEnsemble` builds a whole ensemble of them, which can be passed to
+`floq.optimization.fidelity.EnsembleFidelity` like any other ensemble.
+"""
+
+import numpy as np
+import scipy.optimize
+from . import evolution, types
+from .system import EnsembleBase, _compare_args, _compare_kwargs
+
+def chebyshev_nodes(n_nodes, lower=-1.0, upper=1.0):
+    """
+    The `n_nodes` Chebyshev points of the first kind on `[lower, upper]`, in
+    ascending order.  Interpolation on these points converges exponentially
+    quickly for analytic functions.
+    """
+    x = -np.cos(np.pi * (2*np.arange(n_nodes) + 1) / (2*n_nodes))
+    return 0.5*(upper + lower) + 0.5*(upper - lower)*x
+
+def _barycentric_weights(n_nodes):
+    """Barycentric interpolation weights for the ascending first-kind nodes."""
+    angles = np.pi * (2*np.arange(n_nodes) + 1) / (2*n_nodes)
+    return (-1.0)**np.arange(n_nodes) * np.sin(angles)
+
+def _roll_zones(vectors, shift):
+    """
+    Shift the Fourier components of eigenvectors of the Floquet matrix (shape
+    `(..., n_zones, dimension)`) by `shift` zones.  The result is the eigenvector
+    whose quasienergy is `shift * frequency` higher.
+    """
+    return np.roll(vectors, shift, axis=-2)
+
+def match_states(reference, k_eigenvectors):
+    """
+    Match the states of an eigensystem to those of a reference set of
+    eigenvectors of a nearby Floquet matrix, by the largest overlap, allowing
+    each state to be shifted by one zone in either direction.
+
+    Returns --
+    columns: np.array(dtype=np.int64, shape=(dim,)) --
+        `columns[i]` is the state which continues from reference state `i`.
+    shifts: np.array(dtype=np.int64, shape=(dim,)) --
+        The number of zones to shift `k_eigenvectors[columns[i]]` by, which
+        raises its quasienergy by `shifts[i] * frequency`.
+    overlaps: np.array(dtype=np.complex128, shape=(dim,)) --
+        The overlap of each reference state with its shifted match.
+    """
+    dimension = reference.shape[0]
+    shifts = np.array([-1, 0, 1])
+    flat_reference = reference.reshape(dimension, -1)
+    overlaps = np.array([
+        np.conj(flat_reference)
+        @ _roll_zones(k_eigenvectors, shift).reshape(dimension, -1).T
+        for shift in shifts])
+    best = np.argmax(np.abs(overlaps), axis=0)
+    magnitude = np.max(np.abs(overlaps), axis=0)
+    rows, columns = scipy.optimize.linear_sum_assignment(-magnitude)
+    columns = columns[np.argsort(rows)]
+    rows = np.arange(dimension)
+    choice = best[rows, columns]
+    return columns, shifts[choice], overlaps[choice, rows, columns]
+
+def align(reference, quasienergies, k_eigenvectors, frequency):
+    """
+    Relabel, zone-shift and rephase an eigensystem to follow on smoothly from a
+    reference set of eigenvectors of a nearby Floquet matrix.
+
+    Arguments --
+    reference: np.array(dtype=np.complex128, shape=(dim, n_zones, dim)) --
+        The eigenvectors to align to.
+
+    quasienergies: np.array(dtype=np.float64, shape=(dim,)) --
+    k_eigenvectors: np.array(dtype=np.complex128, shape=(dim, n_zones, dim)) --
+        The eigensystem to be aligned.
+
+    frequency: float -- The principle frequency of the Floquet matrix.
+
+    Returns --
+    quasienergies: np.array(dtype=np.float64, shape=(dim,))
+    k_eigenvectors: np.array(dtype=np.complex128, shape=(dim, n_zones, dim)) --
+        The aligned eigensystem, where state `i` continues from state `i` of
+        the reference.  The quasienergies need not lie in the first zone.
+    """
+    columns, shifts, overlaps = match_states(reference, k_eigenvectors)
+    out_energies = quasienergies[columns] + shifts*frequency
+    out_vectors = np.empty_like(k_eigenvectors)
+    for row, (column, shift, overlap) in enumerate(zip(columns, shifts,
+                                                       overlaps)):
+        phase = np.conj(overlap) / abs(overlap) if overlap != 0 else 1.0
+        out_vectors[row] = phase * _roll_zones(k_eigenvectors[column], shift)
+    return out_energies, out_vectors
+
+
+class Surrogate:
+    """
+    A Chebyshev interpolant of the Floquet eigensystem of a family of systems
+    over one continuous parameter.  The exact problem is only solved at the
+    `n_nodes` nodes, and only again when the controls change.
+    """
+    def __init__(self, system, lower, upper, n_nodes=8):
+        """
+        Arguments --
+        system: (parameter: float) -> floq.System --
+            A function which builds the system at a given value of the
+            parameter.  All the systems should have the same dimension,
+            frequency and number of zones.
+
+        lower, upper: float -- The range of the parameter to cover.
+
+        n_nodes: int > 1 --
+            The number of Chebyshev nodes, and so the number of exact
+            diagonalisations for each set of controls.
+        """
+        if n_nodes < 2:
+            raise ValueError("A surrogate needs at least two nodes.")
+        self.lower, self.upper = lower, upper
+        self.nodes = chebyshev_nodes(n_nodes, lower, upper)
+        self.systems = [system(node) for node in self.nodes]
+        self._weights = _barycentric_weights(n_nodes)
+        self._args = None
+        self._kwargs = None
+        self._quasienergies = None
+        self._k_eigenvectors = None
+        self._errors = None
+
+    @property
+    def n_zones(self):
+        return self.systems[0].n_zones
+
+    @property
+    def frequency(self):
+        return self.systems[0].frequency
+
+    def _update_if_required(self, args, kwargs):
+        """
+        Diagonalise at every node and align the results, if the controls have
+        changed since the last time.
+        """
+        if self._args is not None\
+           and _compare_args(self._args, args)\
+           and _compare_kwargs(self._kwargs, kwargs):
+            return
+        energies, vectors = [], []
+        previous = None
+        for system in self.systems:
+            if previous is not None:
+                system.warm_start(previous)
+            previous = system.eigensystem(*args, **kwargs)
+            if vectors and previous.k_eigenvectors.shape != vectors[0].shape:
+                raise ValueError("The systems at the nodes must all have the"
+                                 " same dimension and number of zones.")
+            if vectors:
+                aligned = align(vectors[-1], previous.quasienergies,
+                                previous.k_eigenvectors, self.frequency)
+            else:
+                aligned = previous.quasienergies, previous.k_eigenvectors
+            energies.append(aligned[0])
+            vectors.append(aligned[1])
+        self._quasienergies = np.array(energies)
+        self._k_eigenvectors = np.array(vectors)
+        self._errors = (self._tail(self._quasienergies),
+                        self._tail(self._k_eigenvectors))
+        self._args = tuple(args)
+        self._kwargs = kwargs.copy()
+
+    def _tail(self, values):
+        """
+        The size of the last two Chebyshev coefficients of the interpolant
+        through `values` (the node values along the first axis), which
+        estimates the interpolation error.
+        """
+        n_nodes = self.nodes.shape[0]
+        x = (2*self.nodes - (self.upper + self.lower))\
+            / (self.upper - self.lower)
+        flat = values.reshape(n_nodes, -1)
+        coefficients = np.polynomial.chebyshev.chebfit(x, flat, n_nodes - 1)
+        return np.max(np.abs(coefficients[-1]) + np.abs(coefficients[-2]))
+
+    def _interpolate(self, parameter, values):
+        """Barycentric interpolation of `values` (node values along the first
+        axis) at `parameter`."""
+        differences = parameter - self.nodes
+        exact = np.flatnonzero(differences == 0)
+        if exact.size:
+            return values[exact[0]].copy()
+        coefficients = self._weights / differences
+        coefficients = coefficients / np.sum(coefficients)
+        return np.tensordot(coefficients, values, axes=1)
+
+    def eigenpairs(self, parameter, *args, **kwargs):
+        """
+        The interpolated quasienergies (shape `(dim,)`) and first-zone
+        eigenvectors of the Floquet matrix (shape `(dim, n_zones, dim)`) at a
+        value of the parameter, where the remaining arguments are passed to the
+        Hamiltonians of the node systems.
+        """
+        if not self.lower <= parameter <= self.upper:
+            raise ValueError(f"The parameter {parameter} is outside the range"
+                             f" [{self.lower}, {self.upper}] of the"
+                             " surrogate.")
+        self._update_if_required(args, kwargs)
+        return (self._interpolate(parameter, self._quasienergies),
+                self._interpolate(parameter, self._k_eigenvectors))
+
+    def error_estimate(self, t, *args, **kwargs):
+        """
+        A heuristic estimate of the largest error in an element of the
+        interpolated `U(t)`, from the size of the highest Chebyshev
+        coefficients of the quasienergies and of the eigenvectors.  If this is
+        too large, use more nodes or a narrower range.
+        """
+        self._update_if_required(args, kwargs)
+        energy_error, vector_error = self._errors
+        dimension = self._quasienergies.shape[1]
+        return dimension * (2*self.n_zones*vector_error + abs(t)*energy_error)
+
+
+class SurrogateSystem:
+    """
+    A stand-in for the `floq.System` at one value of the parameter of a
+    `Surrogate`, with the same interface for calculating `U` and its
+    derivatives.  The eigensystem comes from the surrogate, and only the
+    derivatives of the Hamiltonian are taken from `system`, the exact system
+    at this parameter.
+    """
+    def __init__(self, surrogate, parameter, system):
+        self.surrogate = surrogate
+        self.parameter = parameter
+        self.system = system
+        self._args = None
+        self._kwargs = None
+        self._eigensystem = None
+
+    @property
+    def frequency(self):
+        return self.surrogate.frequency
+
+    @property
+    def n_zones(self):
+        return self.surrogate.n_zones
+
+    def eigensystem(self, *args, **kwargs):
+        """
+        The interpolated `floq.types.Eigensystem` at the given arguments of the
+        Hamiltonian.
+        """
+        if self._eigensystem is not None\
+           and _compare_args(self._args, args)\
+           and _compare_kwargs(self._kwargs, kwargs):
+            return self._eigensystem
+        quasienergies, k_eigenvectors =\
+            self.surrogate.eigenpairs(self.parameter, *args, **kwargs)
+        n_zones = self.n_zones
+        dhamiltonian = self.system._dhamiltonian(*args, **kwargs)
+        k_derivatives = None if dhamiltonian is None\
+                        else evolution.assemble_dk(dhamiltonian, n_zones,
+                                                   self.system.hermitian)
+        initial_floquet_bras = np.conj(np.sum(k_eigenvectors, axis=1))
+        fourier_modes = np.arange((1-n_zones)//2, 1 + (n_zones//2))
+        abstract_ket_coefficients = 1j * self.frequency * fourier_modes
+        self._eigensystem =\
+            types.Eigensystem(self.frequency, quasienergies, k_eigenvectors,
+                              initial_floquet_bras, abstract_ket_coefficients,
+                              k_derivatives)
+        self._args = tuple(args)
+        self._kwargs = kwargs.copy()
+        return self._eigensystem
+
+    def warm_start(self, eigensystem):
+        """Interpolation needs no starting point, so this does nothing."""
+        pass
+
+    def u(self, t: float, *args, **kwargs):
+        return evolution.u(self.eigensystem(*args, **kwargs), t)
+
+    def du_dt(self, t: float, *args, **kwargs):
+        return evolution.du_dt(self.eigensystem(*args, **kwargs), t)
+
+    def du_dcontrols(self, t: float, *args, **kwargs):
+        return evolution.du_dcontrols(self.eigensystem(*args, **kwargs), t)
+
+    def error_estimate(self, t, *args, **kwargs):
+        """The surrogate's estimate of the error in `U(t)`."""
+        return self.surrogate.error_estimate(t, *args, **kwargs)
+
+
+class InterpolatedEnsemble(EnsembleBase):
+    """
+    An ensemble of systems over one continuous parameter, where every member is
+    a `SurrogateSystem` sharing a single `Surrogate`.  An ensemble average then
+    only costs `n_nodes` diagonalisations, however many members there are.
+    """
+    def __init__(self, system, parameters, n_nodes=8, weights=None,
+                 lower=None, upper=None):
+        """
+        Arguments --
+        system: (parameter: float) -> floq.System --
+            A function which builds the exact system at a given value of the
+            parameter.  This is called once per node and once per member, but
+            the members are never diagonalised.
+
+        parameters: 1D np.array of float -- The parameter of each member.
+
+        n_nodes: int > 1 -- The number of Chebyshev nodes of the surrogate.
+
+        weights: 1D np.array of float | None --
+            The weights of the members, for example from a rule in
+            `floq.quadrature`.  By default every member is equally weighted.
+
+        lower, upper: float | None --
+            The range of the surrogate.  This defaults to the range of the
+            parameters.
+        """
+        self._parameters = np.asarray(parameters, dtype=np.float64)
+        lower = np.min(self._parameters) if lower is None else lower
+        upper = np.max(self._parameters) if upper is None else upper
+        self.surrogate = Surrogate(system, lower, upper, n_nodes)
+        self._systems = [SurrogateSystem(self.surrogate, parameter,
+                                         system(parameter))
+                         for parameter in self._parameters]
+        self._weights = weights
+
+    @property
+    def systems(self):
+        return self._systems
+
+    @property
+    def weights(self):
+        if self._weights is None:
+            return super().weights
+        return self._weights
+
+    @property
+    def parameters(self):
+        return self._parameters
@@ -0,0 +1,279 @@
+"""
+Parameter sweeps of Floquet quasienergy spectra and propagators, such as band
+diagrams of the quasienergies against a drive amplitude or detuning.
+
+A `Sweep` visits every point of a parameter grid along a continuation path
+(see `floq.system.continuation_order`), so that each diagonalisation is
+warm-started from a neighbouring point, and splits the path into chunks which
+can be shared between the workers of a `floq.parallel.pool.WorkerPool`.  Inside
+a chunk, and then across the boundaries between chunks, the states are matched
+to those at the previous point by overlap (see `floq.surrogate.match_states`),
+so the quasienergy branches are tracked continuously through the edges of the
+first Brillouin zone rather than jumping between them.
+
+The results are written into preallocated arrays as each group of chunks
+completes.  If a `path` is given these are memory-mapped `.npy` files in that
+directory, so a large sweep needs little memory, and an interrupted sweep keeps
+all its completed points; calling `run()` again on a `Sweep` with the same
+path and grid carries on where it stopped.
+"""
+
+import logging
+import os
+import numpy as np
+from . import evolution
+from .surrogate import match_states
+from .system import continuation_order
+
+_log = logging.getLogger(__name__)
+
+def _sweep_chunk(source, task):
+    """
+    Solve one chunk of the sweep path.  `source` is `(system, times, args,
+    kwargs)` and `task` is a list of grid points.
+
+    The states at the first point of the chunk label the branches, with zone
+    offset zero.  At each later point, the states are matched to the branches
+    at the previous point.  The reference vectors are always the first-zone
+    eigenvectors, with the accumulated zone offsets kept separately, so that
+    repeated shifts never push a vector off the edge of the truncated Floquet
+    space.
+
+    Returns --
+    quasienergies: np.array(shape=(n_points, dim)) -- The first-zone values.
+    branches: np.array(shape=(n_points, dim)) -- The tracked values.
+    u: np.array(shape=(n_points, n_times, dim, dim)) | None
+    first, last: np.array(shape=(dim, n_zones, dim)) --
+        The first-zone eigenvectors of each branch at the first and last
+        points of the chunk.
+    offsets: np.array(dtype=np.int64, shape=(dim,)) --
+        The zone offset of each branch at the last point.
+    """
+    system, times, args, kwargs = source
+    frequency = system.frequency
+    quasienergies, branches, us = [], [], []
+    reference, first, offsets = None, None, None
+    for point in task:
+        eigensystem = system.eigensystem(point, *args, **kwargs)
+        energies, vectors = eigensystem.quasienergies,\
+                            eigensystem.k_eigenvectors
+        quasienergies.append(energies)
+        if reference is None:
+            first = vectors
+            offsets = np.zeros(energies.shape[0], dtype=np.int64)
+            columns = np.arange(energies.shape[0])
+        else:
+            columns, shifts, _ = match_states(reference, vectors)
+            offsets = offsets + shifts
+        branches.append(energies[columns] + offsets*frequency)
+        reference = vectors[columns]
+        if times is not None:
+            us.append([evolution.u(eigensystem, t) for t in times])
+    us = np.array(us) if times is not None else None
+    return (np.array(quasienergies), np.array(branches), us, first, reference,
+            offsets)
+
+
+class Sweep:
+    """
+    A sweep of a `floq.System` over a grid of parameter values.  The system's
+    Hamiltonian is called with each grid point as its first argument, followed
+    by any fixed `args` and `kwargs`.
+
+    After `run()`, the results are available as arrays indexed in the same
+    order as the grid:
+        quasienergies: shape (n_points, dim) --
+            The quasienergies in the first Brillouin zone, sorted.
+        branches: shape (n_points, dim) --
+            The same quasienergies, unfolded from the first zone and labelled
+            so that `branches[:, j]` follows one state continuously along the
+            sweep path.
+        u: shape (n_points, n_times, dim, dim) | None --
+            The time-evolution operators at each of `times`, if given.
+        done: shape (n_points,) -- Which points have been completed.
+    """
+    def __init__(self, system, grid, times=None, args=(), kwargs=None,
+                 path=None, chunk_size=64, pool=None):
+        """
+        Arguments --
+        system: floq.System --
+            The system to sweep.  If `pool` is given, it is sent to the workers,
+            so its Hamiltonians must be picklable.  Its number of zones should
+            be enough for every point of the grid.
+
+        grid: np.array, shape=(n_points,) or (n_points, n_parameters) --
+            The parameter values to sweep over.
+
+        times: 1D np.array of float | None --
+            The times to calculate the time-evolution operator at, or `None` to
+            only find the quasienergies.
+
+        args, kwargs --
+            Fixed arguments passed to the Hamiltonian after the grid point, such
+            as the controls.
+
+        path: str | None --
+            A directory in which to store the results as memory-mapped `.npy`
+            files.  If it already holds the results of a sweep over the same
+            grid, the completed points are kept.  If `None`, the results are
+            kept in memory.
+
+        chunk_size: int > 0 --
+            The number of consecutive points on the path to solve in one task.
+            The results are saved after every chunk (or every group of chunks,
+            one per worker, if there is a pool).
+
+        pool: floq.parallel.pool.WorkerPool | None --
+            A pool of workers to share the chunks between.
+        """
+        self.system = system
+        self.grid = np.asarray(grid)
+        self.times = None if times is None\
+                     else np.asarray(times, dtype=np.float64)
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.path = path
+        self.chunk_size = chunk_size
+        self.pool = pool
+        self.order = continuation_order(self.grid)
+        n_points = self.grid.shape[0]
+        dimension = system.eigensystem(self.grid[self.order[0]], *self.args,
+                                       **self.kwargs).quasienergies.shape[0]
+        shapes = {
+            'quasienergies': ((n_points, dimension), np.float64),
+            'branches': ((n_points, dimension), np.float64),
+            'done': ((n_points,), np.bool_),
+        }
+        if self.times is not None:
+            shapes['u'] = ((n_points, self.times.shape[0], dimension,
+                            dimension), np.complex128)
+        self._created = False
+        self._arrays = {name: self._allocate(name, shape, dtype)
+                        for name, (shape, dtype) in shapes.items()}
+        if self._created:
+            # Stored results are only usable if every array was kept.
+            self.done[:] = False
+        self._reference = None
+
+    def _allocate(self, name, shape, dtype):
+        """
+        Make an output array, reusing the memory-mapped file from a previous
+        run if there is a compatible one.
+        """
+        if self.path is None:
+            return np.zeros(shape, dtype=dtype)
+        os.makedirs(self.path, exist_ok=True)
+        grid_file = os.path.join(self.path, 'grid.npy')
+        if not os.path.exists(grid_file):
+            np.save(grid_file, self.grid)
+        elif not np.array_equal(np.load(grid_file), self.grid):
+            raise ValueError(f"The sweep stored in {self.path} is over a"
+                             " different grid.")
+        filename = os.path.join(self.path, name + '.npy')
+        if os.path.exists(filename):
+            array = np.load(filename, mmap_mode='r+')
+            if array.shape == shape and array.dtype == dtype:
+                return array
+            _log.warning(f"Discarding {filename}, which has the wrong shape.")
+        self._created = True
+        return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                         shape=shape)
+
+    @property
+    def quasienergies(self):
+        return self._arrays['quasienergies']
+
+    @property
+    def branches(self):
+        return self._arrays['branches']
+
+    @property
+    def u(self):
+        return self._arrays.get('u')
+
+    @property
+    def done(self):
+        return self._arrays['done']
+
+    @property
+    def complete(self):
+        return bool(np.all(self.done))
+
+    def _resume_reference(self, index):
+        """
+        Rebuild the branch labelling at a completed point, by re-solving it and
+        matching its first-zone states to the stored branches by quasienergy
+        modulo the frequency.
+        """
+        frequency = self.system.frequency
+        eigensystem = self.system.eigensystem(self.grid[index], *self.args,
+                                              **self.kwargs)
+        branches = self.branches[index][:, np.newaxis]
+        energies = eigensystem.quasienergies[np.newaxis, :]
+        offsets = np.round((branches - energies) / frequency)
+        residuals = np.abs(branches - energies - offsets*frequency)
+        columns = np.argmin(residuals, axis=1)
+        rows = np.arange(columns.shape[0])
+        return (eigensystem.k_eigenvectors[columns],
+                offsets[rows, columns].astype(np.int64))
+
+    def _store(self, indices, result):
+        """Stitch a solved chunk onto the previous one, and save it."""
+        quasienergies, branches, us, first, last, last_offsets = result
+        if self._reference is not None:
+            reference, offsets = self._reference
+            columns, shifts, _ = match_states(reference, first)
+            offsets = offsets + shifts
+            branches = branches[:, columns] + offsets*self.system.frequency
+            last, last_offsets = last[columns], last_offsets[columns] + offsets
+        self._reference = last, last_offsets
+        self.quasienergies[indices] = quasienergies
+        self.branches[indices] = branches
+        if us is not None:
+            self.u[indices] = us
+
+    def _flush(self, indices):
+        for name, array in self._arrays.items():
+            if name != 'done' and hasattr(array, 'flush'):
+                array.flush()
+        # Only mark the points as done once their data is safely stored.
+        self.done[indices] = True
+        if hasattr(self.done, 'flush'):
+            self.done.flush()
+
+    def run(self):
+        """
+        Solve every point of the grid which is not yet done, saving the results
+        as they are completed.  Returns `self`.
+        """
+        chunks = [self.order[i : i+self.chunk_size]
+                  for i in range(0, self.order.shape[0], self.chunk_size)]
+        finished = [bool(np.all(self.done[chunk])) for chunk in chunks]
+        if all(finished):
+            return self
+        # The chunks are completed in path order, so everything after the
+        # first unfinished chunk still needs solving.
+        start = finished.index(False)
+        remaining = chunks[start:]
+        if start > 0 and self._reference is None:
+            self._reference = self._resume_reference(chunks[start - 1][-1])
+        source = (self.system, self.times, self.args, self.kwargs)
+        handle = None if self.pool is None else self.pool.broadcast(source)
+        group_size = 1 if self.pool is None else self.pool.n_workers
+        try:
+            for i in range(0, len(remaining), group_size):
+                group = remaining[i : i+group_size]
+                tasks = [list(self.grid[chunk]) for chunk in group]
+                if self.pool is None:
+                    results = [_sweep_chunk(source, task) for task in tasks]
+                else:
+                    results = self.pool.map(_sweep_chunk, tasks, handle)
+                for chunk, result in zip(group, results):
+                    self._store(chunk, result)
+                self._flush(np.concatenate(group))
+                _log.info(f"Sweep: {np.count_nonzero(self.done)} of"
+                          f" {self.done.shape[0]} points done.")
+        finally:
+            if handle is not None:
+                self.pool.release(handle)
+        return self
@@ -5,13 +5,28 @@ global `floq` namespace, so this module need not be accessed by end-users.
 
 import numpy as np
 import abc
+import concurrent.futures
+import collections.abc
 import logging
 import functools
-from . import evolution, types
+import scipy.sparse
+from . import evolution, highfrequency, monodromy, types
+
+class _Constant:
+    """
+    A callable which ignores its arguments and returns a fixed value.  Unlike a
+    lambda, this can be pickled, so systems built with constant Hamiltonians can
+    be sent to worker processes.
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, *args, **kwargs):
+        return self.value
 
 def _make_callable(maybe_callable):
     return maybe_callable if hasattr(maybe_callable, '__call__')\
-           else lambda *args, **kwargs: maybe_callable
+           else _Constant(maybe_callable)
 
 def _compare_args(one, two):
     if len(one) != len(two):
@@ -48,11 +63,13 @@ def _canonicalise_operator(operator):
             name = m.__class__.__name__
             raise TypeError(f"Invalid mode type {name}.  Should be an integer.")
     for matrix in hamiltonian:
-        failure = not isinstance(matrix, np.ndarray)\
+        failure = not (isinstance(matrix, np.ndarray)
+                       or scipy.sparse.issparse(matrix))\
                   or len(matrix.shape) is not 2\
                   or matrix.shape[0] != matrix.shape[1]
         if failure:
-            msg = f"Matrix should be a 2D square numpy array, but is:\n{matrix}"
+            msg = ("Matrix should be a 2D square numpy array or scipy.sparse"
+                   f" matrix, but is:\n{matrix}")
             raise ValueError(msg)
     return types.TransformedMatrix(mode, hamiltonian)
 
@@ -75,6 +92,33 @@ def _canonicalise_dict(dict_):
     # Pass through to the base case as a correct iterable.
     return _canonicalise_operator(dict_.items())
 
+def _canonicalise_hermitian(operator):
+    """
+    Canonicalise an operator of a Hermitian Hamiltonian given only by its
+    Fourier modes `>= 0`.  In this form, the 3D-array input runs over the modes
+        0, 1, ..., n_modes - 1.
+    """
+    if isinstance(operator, np.ndarray) and len(operator.shape) == 3:
+        operator = dict(enumerate(operator))
+    operator = _canonicalise_operator(operator)
+    if any(m < 0 for m in operator.mode):
+        raise ValueError("Only the Fourier modes >= 0 should be given for a"
+                         " Hermitian system.")
+    return operator
+
+
+def _combine_operators(a, one, b, two):
+    """
+    The canonicalised operator `a * one + b * two`, over the union of the
+    Fourier modes of `one` and `two`.
+    """
+    out = {}
+    for c, operator in ((a, one), (b, two)):
+        for mode, matrix in zip(operator.mode, operator.matrix):
+            out[mode] = c*matrix if mode not in out else out[mode] + c*matrix
+    modes = tuple(sorted(out))
+    return types.TransformedMatrix(modes, tuple(out[m] for m in modes))
+
 
 class System:
     """
@@ -102,6 +146,11 @@ class System:
             values.  This is the preferred input form (using any iterable
             container type).
 
+            `matrix` can also be any `scipy.sparse` matrix.  Sparse blocks are
+            only ever touched at their stored elements when building the
+            Floquet matrix (with `sparse=True`) and its derivatives, so large
+            Hilbert spaces need never be stored densely.
+
         dict of (mode: int, matrix: 2D np.array of complex) --
             Everything is the same as the iterable form.
 
@@ -120,9 +169,17 @@ class System:
             matrix, which is used throughout the numerical evolution code.  This
             type is typically not intended to be instantiated or interacted with
             by the end-user.
+
+    With `hermitian=True`, every operator is instead given by only its modes
+    `>= 0`, since for a Hermitian Hamiltonian `H_{-m} = H_m^dagger`.  The 3D
+    array form then runs over the modes `0, 1, ..., n_modes - 1`.  The blocks of
+    the negative modes are generated while assembling the Floquet matrix and
+    its derivatives, and are never stored.
     """
     def __init__(self, hamiltonian, dhamiltonian=None, n_zones=1, frequency=1.0,
-                       sparse=True, decimals=8, cache=True):
+                       sparse=True, decimals=8, cache=True, hermitian=False,
+                       real=None, matrix_free=False, solver=None,
+                       slices=None, reorder=False):
         """
         Arguments --
         hamiltonian:
@@ -180,16 +237,65 @@ class System:
             timing purposes.  Only the last used controls, time and additional
             arguments are cached, so there is no real memory impact even when
             `True`.
+
+        hermitian: bool --
+            Whether the Hamiltonian and its derivatives are given by only their
+            Fourier modes `>= 0` (see the help of `floq.System`).
+
+        real: bool | None --
+            Whether the Floquet matrix is real symmetric, which is the case
+            when every Fourier block is real and symmetric and
+            `H_m = H_{-m}`.  It is then assembled and diagonalised in real
+            arithmetic, which is faster and needs half the memory.  `None`
+            detects this from the Hamiltonian each time it is diagonalised.
+
+        matrix_free: bool --
+            Whether to diagonalise without ever assembling the Floquet matrix,
+            applying it directly from the Fourier blocks instead (see
+            `floq.operator.FloquetOperator`).  The memory needed is then
+            independent of the number of zones, at the cost of slower
+            (iterative) shift-invert solves.
+
+        solver: None | 'general' | 'tridiagonal' | 'davidson' | 'slicing' --
+            The eigensolver (see `floq.evolution.eigensystem()`).  By default,
+            sparse Hamiltonians with only the modes -1, 0 and 1 (in dense
+            blocks) use 'tridiagonal', which solves the block-tridiagonal
+            Floquet matrix by a matrix continued fraction, in time linear in
+            the number of zones, and 'general' turns this off.  'davidson'
+            finds the first-zone states with a preconditioned block Davidson
+            method, matrix-free and without factorising the Floquet matrix, so
+            it scales to many zones and large Hilbert spaces.  'slicing'
+            splits the first zone into `slices` intervals solved concurrently,
+            each with its own shift, which converges the states near the zone
+            edges reliably for large Hilbert spaces.
+
+        slices: int > 0 | None --
+            The number of spectrum slices for `solver='slicing'`, by default
+            the number of available cores.
+
+        reorder: bool --
+            Whether to permute the sparse Floquet matrix into a fill-reducing
+            order before its shift-invert factorisation (see
+            `floq.ordering`).  The ordering is chosen once per sparsity
+            pattern, so this pays off when the same system is diagonalised
+            many times, and most of all for sparse Hamiltonian blocks.
         """
         self._args = None
         self._kwargs = None
         self._eigensystem = None
+        self._guess = None
         self._n_components = None
         self._n_zones= n_zones
         self.cache = cache
         self.sparse = sparse
         self.decimals = decimals
         self.frequency = frequency
+        self.hermitian = hermitian
+        self.real = real
+        self.matrix_free = matrix_free
+        self.solver = solver
+        self.slices = slices
+        self.reorder = reorder
         self._hamiltonian_inner = _make_callable(hamiltonian)
         self._dhamiltonian_inner = _make_callable(dhamiltonian)
 
@@ -200,8 +306,12 @@ class System:
     def hamiltonian(self, value):
         self._hamiltonian_inner = _make_callable(hamiltonian)
 
+    def _canonicalise(self, operator):
+        return _canonicalise_hermitian(operator) if self.hermitian\
+               else _canonicalise_operator(operator)
+
     def _hamiltonian(self, *args, **kwargs):
-        return _canonicalise_operator(self.hamiltonian(*args, **kwargs))
+        return self._canonicalise(self.hamiltonian(*args, **kwargs))
 
     @property
     def dhamiltonian(self):
@@ -214,7 +324,7 @@ class System:
         dhamiltonian = self.dhamiltonian(*args, **kwargs)
         if dhamiltonian is None:
             return None
-        return tuple(_canonicalise_operator(op) for op in dhamiltonian)
+        return tuple(self._canonicalise(op) for op in dhamiltonian)
 
     @property
     def n_zones(self):
@@ -235,26 +345,92 @@ class System:
            and _compare_args(self._args, args)\
            and _compare_kwargs(self._kwargs, kwargs):
             return
+        # An explicit warm start takes precedence, but is only used once.
+        # Otherwise the last eigensystem (at the previous controls) is the best
+        # available starting point.
+        guess = self._eigensystem if self._guess is None else self._guess
+        self._guess = None
+        self._eigensystem = self._solve(args, kwargs, guess)
+        self._args = tuple(args)
+        self._kwargs = kwargs.copy()
+
+    def _solve(self, args, kwargs, guess=None, n_zones=None):
+        """
+        Calculate the eigensystem at the given arguments of the Hamiltonian,
+        without touching the cache.  With a fixed `n_zones`, nothing shared is
+        changed either (see `_zones_for()`), so this is safe to call from
+        several threads at once.
+        """
         hamiltonian = self._hamiltonian(*args, **kwargs)
         dhamiltonian = self._dhamiltonian(*args, **kwargs)
+        n_zones = self._zones_for(hamiltonian, n_zones)
+        return evolution.eigensystem(hamiltonian, dhamiltonian, n_zones,
+                                     self.frequency, self.decimals,
+                                     self.sparse, guess, self.hermitian,
+                                     self.real, self.matrix_free, self.solver,
+                                     self.slices, self.reorder)
+
+    def _fit_zones(self, hamiltonian):
+        """
+        Increase the number of zones if necessary to fit every Fourier mode of
+        the canonicalised `hamiltonian`.
+        """
         min_n_zones = 2 * max((abs(x) for x in hamiltonian.mode)) + 1
         if self._n_zones is None or min_n_zones > self._n_zones:
             logging.debug(f"Increasing number of zones to {min_n_zones} to"
                           + " match the number of Fourier components in the"
                           + " Hamiltonian.")
             self.n_zones = min_n_zones
-        self._eigensystem =\
-            evolution.eigensystem(hamiltonian, dhamiltonian, self.n_zones,
-                                  self.frequency, self.decimals, self.sparse)
-        self._args = tuple(args)
-        self._kwargs = kwargs.copy()
+
+    def _zones_for(self, hamiltonian, n_zones=None):
+        """
+        The number of zones to solve the canonicalised `hamiltonian` with.
+        Without a fixed `n_zones`, `self.n_zones` is first fitted to it.  With
+        one, `self` is left alone, and only the returned count is increased if
+        the Hamiltonian has more Fourier modes than `n_zones` can hold.
+        """
+        if n_zones is None:
+            self._fit_zones(hamiltonian)
+            return self.n_zones
+        return max(n_zones, 2 * max((abs(x) for x in hamiltonian.mode)) + 1)
+
+    # The module whose `u()`, `du_dt()` and `du_dcontrols()` evaluate what
+    # `_solve()` returns.  Engines which do not diagonalise the Floquet matrix
+    # replace this, along with `_as_eigensystem()`.
+    _engine = evolution
+
+    def _engine_for(self, solved):
+        """The engine which evaluates a result of `_solve()`."""
+        return self._engine
+
+    def _as_eigensystem(self, solved):
+        """The `floq.types.Eigensystem` of a result of `_solve()`."""
+        return solved
+
+    def warm_start(self, eigensystem):
+        """
+        Use `eigensystem` (a `floq.types.Eigensystem`, typically from a
+        neighbouring member of an ensemble at the same controls) as the starting
+        point of the next diagonalisation.  This only affects iterative
+        (sparse) solves, and only the next one.
+        """
+        self._guess = eigensystem
+
+    def eigensystem(self, *args, **kwargs):
+        """
+        Return the `floq.types.Eigensystem` of the Floquet matrix at the given
+        arguments of the Hamiltonian, calculating it if it is not cached.  This
+        contains the quasienergies and Floquet modes.
+        """
+        self._update_if_required(None, args, kwargs)
+        return self._as_eigensystem(self._eigensystem)
 
     def u(self, t: float, *args, **kwargs):
         """
         Calculate the time evolution operator of the stored Hamiltonian.
         """
         self._update_if_required(t, args, kwargs)
-        return evolution.u(self._eigensystem, t)
+        return self._engine_for(self._eigensystem).u(self._eigensystem, t)
 
     def du_dt(self, t: float, *args, **kwargs):
         """
@@ -262,7 +438,7 @@ class System:
         time.
         """
         self._update_if_required(t, args, kwargs)
-        return evolution.du_dt(self._eigensystem, t)
+        return self._engine_for(self._eigensystem).du_dt(self._eigensystem, t)
 
     def du_dcontrols(self, t: float, *args, **kwargs):
         """
@@ -270,7 +446,141 @@ class System:
         each of the control parameters in turn.
         """
         self._update_if_required(t, args, kwargs)
-        return evolution.du_dcontrols(self._eigensystem, t)
+        return self._engine_for(self._eigensystem)\
+                   .du_dcontrols(self._eigensystem, t)
+
+    def eigensystem_batch(self, batch, *args, threads=None, **kwargs):
+        """
+        Calculate the eigensystems for many sets of controls at once.  Each row
+        of the 2D array `batch` is passed to the Hamiltonian as its first
+        argument, followed by `args` and `kwargs`.  Returns a list of
+        `floq.types.Eigensystem`, one per row.
+
+        The rows are split into `threads` contiguous blocks (by default one per
+        available core) which are solved concurrently, and each solve in a
+        block is warm-started from the previous row.  LAPACK/ARPACK and the
+        `numba` assembly kernels release the GIL, so the threads can run
+        concurrently, apart from the calls to the Hamiltonian and the Python
+        glue between the kernels; for the best results limit the BLAS threads
+        (see `floq.parallel.threads`).  The cached eigensystem of the single-control
+        methods is not affected.
+
+        The Hamiltonian and its derivatives are called concurrently from the
+        threads, so they must be thread-safe.  The number of zones is fitted
+        to the first row on the calling thread, and the threads never change
+        it: a later row whose Hamiltonian has more Fourier modes is solved
+        with more zones without changing `n_zones`.
+        """
+        return [self._as_eigensystem(solved)
+                for solved in self._solve_batch(batch, args, kwargs, threads)]
+
+    def _solve_batch(self, batch, args, kwargs, threads=None, t=None):
+        """
+        The results of `_solve()` for every row of `batch`, to be evaluated at
+        time `t` (if known), which only engines with a time-dependent accuracy
+        use.
+        """
+        from .parallel.threads import available_cores
+        batch = np.asarray(batch)
+        if batch.ndim != 2:
+            raise ValueError("The batch of controls must be a 2D array, with"
+                             " one set of controls per row.")
+        if batch.shape[0] == 0:
+            return []
+        threads = min(threads or available_cores(), batch.shape[0])
+        # Solve the first row here, so any change to the number of zones
+        # happens before the threads start, which then all use that number.
+        first = self._solve((batch[0],) + args, kwargs)
+        if batch.shape[0] == 1:
+            return [first]
+        n_zones = self.n_zones
+        def solve_block(block):
+            out, guess = [], first
+            for row in block:
+                guess = self._solve((row,) + args, kwargs, guess, n_zones)
+                out.append(guess)
+            return out
+        blocks = np.array_split(batch[1:], threads)
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            solved = list(executor.map(solve_block, blocks))
+        return [first] + [eigensystem for block in solved
+                          for eigensystem in block]
+
+    def u_batch(self, t: float, batch, *args, threads=None, **kwargs):
+        """
+        Calculate the time-evolution operators for every row of the 2D array of
+        controls `batch` (see `eigensystem_batch()`), stacked along the first
+        axis.
+        """
+        solved = self._solve_batch(batch, args, kwargs, threads, t)
+        return np.array([self._engine_for(x).u(x, t) for x in solved])
+
+    def du_dt_batch(self, t: float, batch, *args, threads=None, **kwargs):
+        """
+        Calculate the time derivatives of the time-evolution operators for
+        every row of the 2D array of controls `batch`.
+        """
+        solved = self._solve_batch(batch, args, kwargs, threads, t)
+        return np.array([self._engine_for(x).du_dt(x, t) for x in solved])
+
+    def du_dcontrols_batch(self, t: float, batch, *args, threads=None,
+                           **kwargs):
+        """
+        Calculate the control derivatives of the time-evolution operators for
+        every row of the 2D array of controls `batch`, with shape
+        `(n_rows, n_controls, dim, dim)`.
+        """
+        solved = self._solve_batch(batch, args, kwargs, threads, t)
+        return np.array([self._engine_for(x).du_dcontrols(x, t)
+                         for x in solved])
+
+    def d2u_dcontrols(self, t: float, controls, *args, **kwargs):
+        """
+        Calculate the second derivatives of the time-evolution operator with
+        respect to each pair of control parameters, with shape
+        `(n_controls, n_controls, dim, dim)`, from the same eigensystem as
+        `du_dcontrols()` (see `floq.evolution.d2u_dcontrols()`), so without
+        any further diagonalisation.  The first argument of the Hamiltonian
+        must be the array of controls.
+
+        The second derivatives of the Hamiltonian itself are central
+        differences of `dhamiltonian`, which need no diagonalisation either,
+        and are left out if `dhamiltonian` does not depend on the arguments.
+        """
+        eigensystem = self.eigensystem(controls, *args, **kwargs)
+        n_zones = eigensystem.k_eigenvectors.shape[1]
+        return evolution.d2u_dcontrols(
+            eigensystem, t,
+            self._k_second_derivatives(n_zones, controls, args, kwargs))
+
+    # The displacement of the controls used to difference `dhamiltonian`.  Its
+    # values are exact up to rounding, so this balances the rounding error
+    # against the truncation error of the differences.
+    _dhamiltonian_step = np.finfo(np.float64).eps ** (1/3)
+
+    def _k_second_derivatives(self, n_zones, controls, args, kwargs):
+        """
+        The lifts of the second derivatives of the Hamiltonian with respect to
+        each pair of controls `a <= b`, in row-major order, or `None` if they
+        are zero, as `floq.evolution.d2u_dcontrols()` takes them.
+        """
+        if isinstance(self.dhamiltonian, _Constant):
+            return None
+        controls = np.asarray(controls, dtype=np.float64)
+        step = self._dhamiltonian_step * max(1.0, np.max(np.abs(controls)))
+        columns = []
+        for displacement in step * np.eye(controls.shape[0]):
+            forward = self._dhamiltonian(controls + displacement, *args,
+                                         **kwargs)
+            backward = self._dhamiltonian(controls - displacement, *args,
+                                          **kwargs)
+            columns.append([_combine_operators(1 / (2*step), a, -1 / (2*step), b)
+                            for a, b in zip(forward, backward)])
+        # Symmetrise, since the two orders of differentiation agree exactly.
+        pairs = [_combine_operators(0.5, columns[a][b], 0.5, columns[b][a])
+                 for a in range(len(columns))
+                 for b in range(a, len(columns))]
+        return evolution.assemble_dk(pairs, n_zones, self.hermitian)
 
     def h_effective(self, t: float, *args, **kwargs):
         u = self.u(t, *args, **kwargs)
@@ -278,15 +588,425 @@ class System:
         return 1j * (du_dt @ np.conj(u.T))
 
 
+class _LinearHamiltonian:
+    """
+    The Fourier-transformed Hamiltonian `H0 + sum_p controls[p] * H_p` as a
+    (picklable) callable of the controls, for the parts of `System` which need
+    the Hamiltonian itself rather than the Floquet matrix.
+    """
+    def __init__(self, constant, operators):
+        self.constant = constant
+        self.operators = operators
+
+    def __call__(self, controls):
+        out = {}
+        coefficients = (1.0,) + tuple(controls)
+        for c, operator in zip(coefficients, (self.constant,)+self.operators):
+            for mode, matrix in zip(operator.mode, operator.matrix):
+                out[mode] = c*matrix if mode not in out\
+                            else out[mode] + c*matrix
+        modes = tuple(sorted(out))
+        return types.TransformedMatrix(
+            modes, tuple(out[m].astype(np.complex128) for m in modes))
+
+
+class LinearSystem(System):
+    """
+    A `System` whose Hamiltonian depends linearly on the controls,
+        H(controls) = H0 + sum_p controls[p] * H_p.
+    The methods are called in the same way as `System`, for example
+    `u(t, controls)`.
+
+    The Floquet matrices of `H0` and of each `H_p` are built once (and again
+    only if `n_zones` changes), all on one shared sparsity pattern.  At each set
+    of controls the Floquet matrix is then a single dot product of the controls
+    with the stored values, and its derivatives with respect to the controls are
+    the stored lifts of the `H_p`, so no `dhamiltonian` is needed.
+    """
+    def __init__(self, h0, hs, n_zones=1, frequency=1.0, sparse=True,
+                 decimals=8, cache=True, hermitian=False, real=None,
+                 reorder=False):
+        """
+        Arguments --
+        h0: Fourier_matrix_like -- The part of the Hamiltonian without controls.
+
+        hs: iterable of Fourier_matrix_like --
+            The operator multiplying each control in turn.
+
+        The other arguments are the same as for `System`.  The number of zones is
+        increased if necessary to fit all the Fourier modes of the operators.
+        With `real=None`, real arithmetic is used if `h0` and every one of `hs`
+        are real symmetric in the sense of `floq.System`, and then the controls
+        must be real.
+        """
+        canonicalise = _canonicalise_hermitian if hermitian\
+                       else _canonicalise_operator
+        self.h0 = canonicalise(h0)
+        self.hs = tuple(canonicalise(h) for h in hs)
+        max_mode = max(abs(m) for op in (self.h0,) + self.hs for m in op.mode)
+        if real is None:
+            real = all(evolution.is_real_symmetric(op, hermitian)
+                       for op in (self.h0,) + self.hs)
+        super().__init__(_LinearHamiltonian(self.h0, self.hs), self.hs,
+                         n_zones=max(n_zones, 2*max_mode + 1),
+                         frequency=frequency, sparse=sparse, decimals=decimals,
+                         cache=cache, hermitian=hermitian, real=real,
+                         reorder=reorder)
+        self._lifts = None
+
+    def _lift(self):
+        """
+        Return the stored Floquet matrices and their derivatives, rebuilding
+        them if the number of zones has changed.
+        """
+        if self._lifts is not None and self._lifts[0] == self.n_zones:
+            return self._lifts
+        # The constant part carries the `n * frequency` diagonal, so each H_p is
+        # lifted with zero frequency.
+        if self.sparse:
+            matrices = [evolution.assemble_k_sparse(self.h0, self.n_zones,
+                                                    self.frequency,
+                                                    self.hermitian)]\
+                       + [evolution.assemble_k_sparse(h, self.n_zones, 0.0,
+                                                      self.hermitian)
+                          for h in self.hs]
+            indices, indptr, data = evolution.common_sparsity(matrices)
+            if self.real:
+                data = np.ascontiguousarray(data.real)
+            components = indices, indptr, data
+        else:
+            components = np.array(
+                [evolution.assemble_k(self.h0, self.n_zones, self.frequency,
+                                      self.hermitian, self.real)]
+                + [evolution.assemble_k(h, self.n_zones, 0.0, self.hermitian,
+                                        self.real)
+                   for h in self.hs])
+        k_derivatives = evolution.assemble_dk(self.hs, self.n_zones,
+                                              self.hermitian)\
+                        if self.hs else None
+        self._lifts = (self.n_zones, components, k_derivatives)
+        return self._lifts
+
+    def k(self, controls):
+        """Return the Floquet matrix at the given controls."""
+        controls = np.asarray(controls, dtype=np.float64 if self.real
+                                                else None).reshape(-1)
+        if controls.shape[0] != len(self.hs):
+            raise ValueError(f"Expected {len(self.hs)} controls, but got"
+                             f" {controls.shape[0]}.")
+        _, components, _ = self._lift()
+        coefficients = np.concatenate(([1.0], controls))
+        if not self.sparse:
+            return np.tensordot(coefficients, components, axes=1)
+        indices, indptr, data = components
+        size = indptr.shape[0] - 1
+        return scipy.sparse.csc_matrix((coefficients @ data, indices, indptr),
+                                       shape=(size, size))
+
+    def _solve(self, args, kwargs, guess=None, n_zones=None):
+        # The number of zones is fixed when the operators are lifted.
+        if kwargs:
+            raise TypeError("A LinearSystem takes no keyword arguments, but got"
+                            f" {', '.join(sorted(kwargs))}.")
+        if len(args) != 1:
+            raise TypeError("A LinearSystem takes exactly one argument, the"
+                            f" array of controls, but got {len(args)}.")
+        (controls,) = args
+        k = self.k(controls)
+        return evolution.eigensystem_from_k(k, self._lift()[2],
+                                            self.h0.matrix[0].shape[0],
+                                            self.frequency, self.decimals,
+                                            guess, reorder=self.reorder)
+
+
+class MonodromySystem(System):
+    """
+    A `System` which integrates the Schroedinger equation over one period in
+    the time domain, and never builds the Floquet matrix (see
+    `floq.monodromy`).  The cost of a solve is `n_steps` operations on
+    `dim x dim` matrices, independent of the number of zones, which makes this
+    much cheaper for weakly driven systems that still need many zones.
+
+    `u()`, `du_dt()` and `du_dcontrols()` come straight from the propagators,
+    so they do not depend on `n_zones` at all.  `eigensystem()` still returns a
+    `floq.types.Eigensystem` with `n_zones` zones, whose Floquet modes are the
+    Fourier components of the propagated states, so this can be used anywhere
+    a `System` can.
+    """
+    _engine = monodromy
+
+    def __init__(self, hamiltonian, dhamiltonian=None, n_zones=1,
+                       frequency=1.0, n_steps=256, decimals=8, cache=True,
+                       hermitian=False):
+        """
+        Arguments --
+        n_steps: int > 0 --
+            The number of fourth-order Magnus steps per period.  The error in
+            the propagators falls as `n_steps^-4`.  This must be at least
+            `n_zones` for `eigensystem()`.
+
+        The other arguments are the same as for `System`.
+        """
+        super().__init__(hamiltonian, dhamiltonian, n_zones=n_zones,
+                         frequency=frequency, decimals=decimals, cache=cache,
+                         hermitian=hermitian)
+        self.n_steps = n_steps
+
+    def _solve(self, args, kwargs, guess=None, n_zones=None):
+        hamiltonian = self._hamiltonian(*args, **kwargs)
+        dhamiltonian = self._dhamiltonian(*args, **kwargs)
+        self._zones_for(hamiltonian, n_zones)
+        return monodromy.Monodromy(hamiltonian, dhamiltonian, self.frequency,
+                                   self.n_steps, self.hermitian)
+
+    def _as_eigensystem(self, solved):
+        return monodromy.eigensystem(solved, self.n_zones, self.decimals)
+
+
+class HighFrequencySystem(System):
+    """
+    A `System` which uses the high-frequency (van Vleck) expansion of the
+    Hamiltonian instead of diagonalising the Floquet matrix (see
+    `floq.highfrequency`), when the frequency is large compared with the
+    drive.  `u()`, `du_dt()` and `du_dcontrols()` then cost a few operations
+    on `dim x dim` matrices, independent of the number of zones.
+
+    Every expansion comes with an estimate of the error of its propagator over
+    one period, from the sampled residual of the Schroedinger equation, which
+    grows linearly with the number of periods (see
+    `floq.highfrequency.error_estimate_at()`).  Whenever the estimate at the
+    requested time exceeds `tol`, the Floquet matrix with `n_zones` zones is
+    diagonalised instead, exactly as `System` does, and the exact eigensystem
+    is cached for later times at the same controls.  The estimate is not a
+    guaranteed bound, so `u()` is within `tol` only as far as the residual is
+    resolved by the samples.  It does not cover `du_dcontrols()`, whose error
+    is typically a few times larger than that of `u()`; choose `tol` with that
+    in mind when the gradients matter.
+    `eigensystem()` returns a `floq.types.Eigensystem` in either case.
+    """
+    _engine = highfrequency
+
+    def __init__(self, hamiltonian, dhamiltonian=None, n_zones=1,
+                       frequency=1.0, order=2, tol=1e-4, sparse=True,
+                       decimals=8, cache=True, hermitian=False):
+        """
+        Arguments --
+        order: int >= 0 --
+            The highest power of `1 / frequency` kept in the effective
+            Hamiltonian (see `floq.highfrequency.Expansion`).
+
+        tol: float > 0 --
+            The largest acceptable error estimate of the propagator at the
+            requested time before falling back to the full Floquet solve.
+
+        The other arguments are the same as for `System`, and `n_zones` and
+        `sparse` are only used by the fallback and `eigensystem()`.
+        """
+        super().__init__(hamiltonian, dhamiltonian, n_zones=n_zones,
+                         frequency=frequency, sparse=sparse, decimals=decimals,
+                         cache=cache, hermitian=hermitian)
+        self.order = order
+        self.tol = tol
+
+    def _solve(self, args, kwargs, guess=None, n_zones=None):
+        hamiltonian = self._hamiltonian(*args, **kwargs)
+        dhamiltonian = self._dhamiltonian(*args, **kwargs)
+        n_zones = self._zones_for(hamiltonian, n_zones)
+        expansion = highfrequency.Expansion(hamiltonian, dhamiltonian,
+                                            self.frequency, self.order,
+                                            self.hermitian)
+        return self._checked(expansion, None, args, kwargs, guess, n_zones)
+
+    def _checked(self, solved, t, args, kwargs, guess=None, n_zones=None):
+        """
+        Return `solved`, unless it is an expansion whose error estimate at time
+        `t` (or over one period if `t` is `None`) exceeds the tolerance, in
+        which case return the eigensystem of the full Floquet matrix (with
+        `n_zones` zones, by default `self.n_zones`) instead.
+        """
+        if isinstance(solved, types.Eigensystem):
+            return solved
+        estimate = solved.error if t is None\
+                   else highfrequency.error_estimate_at(solved, t)
+        if estimate <= self.tol:
+            return solved
+        logging.info(f"The order-{self.order} high-frequency expansion has an"
+                     f" estimated error of {estimate:.3g}"
+                     + (" per period" if t is None else f" at t = {t:.3g}")
+                     + f", above the tolerance of {self.tol:.3g};"
+                     " diagonalising the Floquet matrix instead.")
+        if not isinstance(guess, types.Eigensystem):
+            guess = None
+        return evolution.eigensystem(self._hamiltonian(*args, **kwargs),
+                                     self._dhamiltonian(*args, **kwargs),
+                                     n_zones or self.n_zones, self.frequency,
+                                     self.decimals, self.sparse, guess,
+                                     self.hermitian)
+
+    def _update_if_required(self, t: float, args, kwargs):
+        super()._update_if_required(t, args, kwargs)
+        if t is not None:
+            self._eigensystem = self._checked(self._eigensystem, t, args,
+                                              kwargs)
+
+    def _solve_batch(self, batch, args, kwargs, threads=None, t=None):
+        solved = super()._solve_batch(batch, args, kwargs, threads)
+        if t is None:
+            return solved
+        return [self._checked(x, t, (row,) + args, kwargs)
+                for x, row in zip(solved, np.asarray(batch))]
+
+    def _engine_for(self, solved):
+        return evolution if isinstance(solved, types.Eigensystem)\
+               else highfrequency
+
+    def _as_eigensystem(self, solved):
+        if isinstance(solved, types.Eigensystem):
+            return solved
+        return highfrequency.eigensystem(solved, self.n_zones, self.decimals)
+
+
 class EnsembleBase(abc.ABC):
     """
     Specifies an ensemble of `floq.System`s.  This class is intended to
     serve as a container for a list of `System`s, and a convenient way
     of initialising them.  This is base class defining the API and cannot be
     used, it needs to be sub-classed, and a sub-class needs to provide a
-    property called 'systems'.
+    property called 'systems'.  This can be any sequence of systems - see
+    `LazyEnsemble` for one which builds them on demand.
+
+    Ensemble averages are weighted by the property 'weights', which by default
+    gives every system the same weight.  Sub-classes which represent a
+    distribution by a quadrature rule (see `floq.quadrature`) should override
+    it with the rule's weights.
     """
     @property
     @abc.abstractmethod
     def systems(self):
         raise NotImplementedError
+
+    @property
+    def weights(self):
+        n_systems = len(self.systems)
+        return np.full(n_systems, 1.0 / n_systems)
+
+    @property
+    def parameters(self):
+        """
+        The values of the distribution parameters (such as detuning or
+        amplitude) of each system, as an array of shape `(n_systems,
+        n_parameters)`, or `None` if the ensemble does not describe them.  These
+        are used to order the systems so that neighbours are similar.
+        """
+        return None
+
+    def continuation_order(self):
+        """
+        An ordering of the systems in which consecutive members have similar
+        parameters, so that each one's eigensystem is a good starting point for
+        the next.  If the parameters are unknown, the systems are kept in
+        order.
+        """
+        if self.parameters is None:
+            return np.arange(len(self.systems))
+        return continuation_order(self.parameters)
+
+
+# Above this many points `continuation_order()` sorts instead of searching.
+_GREEDY_PATH_LIMIT = 4096
+
+def continuation_order(parameters):
+    """
+    Return a permutation of the rows of `parameters` (shape `(n_points,
+    n_parameters)`, or 1D for a single parameter) forming a short path through
+    them.  One-dimensional parameters are simply sorted.  Otherwise, each
+    parameter is scaled by its spread, and the path is built greedily, starting
+    from the smallest first parameter and always stepping to the nearest
+    unvisited point.  Tables of more than a few thousand points are sorted
+    lexicographically instead.
+    """
+    parameters = np.asarray(parameters, dtype=np.float64)
+    if parameters.ndim == 1 or parameters.shape[1] == 1:
+        return np.argsort(parameters.reshape(-1), kind='stable')
+    spread = np.ptp(parameters, axis=0)
+    scaled = parameters / np.where(spread > 0, spread, 1.0)
+    if scaled.shape[0] > _GREEDY_PATH_LIMIT:
+        # The greedy path is quadratic in the number of points, so very large
+        # tables are just sorted lexicographically on the first parameter.
+        return np.lexsort(scaled.T[::-1])
+    remaining = np.ones(scaled.shape[0], dtype=bool)
+    order = np.empty(scaled.shape[0], dtype=np.int64)
+    current = np.argmin(scaled[:, 0])
+    for i in range(scaled.shape[0]):
+        order[i] = current
+        remaining[current] = False
+        if i + 1 == scaled.shape[0]:
+            break
+        distances = np.sum((scaled - scaled[current])**2, axis=1)
+        distances[~remaining] = np.inf
+        current = np.argmin(distances)
+    return order
+
+
+class LazySystems(collections.abc.Sequence):
+    """
+    A read-only sequence of systems, where each one is built by `factory` from
+    its row of the parameter table when it is accessed.  Nothing is cached, so
+    a system (and its eigensystem) is freed as soon as the caller lets go of
+    it.
+    """
+    def __init__(self, factory, parameters):
+        self.factory = factory
+        self.parameters = parameters
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LazySystems(self.factory, self.parameters[index])
+        return self.factory(self.parameters[index])
+
+
+class LazyEnsemble(EnsembleBase):
+    """
+    An ensemble whose members are only described by a table of parameters, and
+    are built one at a time by a factory function when they are needed.  The
+    memory needed is only that of the parameter table and the weights, so
+    ensembles of millions of members can be averaged over with
+    `floq.optimization.fidelity.StreamingEnsembleFidelity`.  Fidelities which
+    hold on to every member (such as `EnsembleFidelity`) would build them all.
+
+    For use with a `floq.parallel.pool.WorkerPool`, the factory must be
+    picklable, so should be a module-level function or a `functools.partial`
+    of one.
+    """
+    def __init__(self, factory, parameters, weights=None):
+        """
+        Arguments --
+        factory: (parameters: np.array) -> floq.System --
+            Builds the system described by one row of the parameter table.
+
+        parameters: np.array, shape=(n_systems,) or (n_systems, n_parameters) --
+            The parameters of each member.
+
+        weights: 1D np.array of float | None --
+            The weights of the members, or `None` to weight them equally.
+        """
+        self.factory = factory
+        self._parameters = np.asarray(parameters)
+        self._weights = weights
+
+    @property
+    def systems(self):
+        return LazySystems(self.factory, self._parameters)
+
+    @property
+    def weights(self):
+        if self._weights is None:
+            return super().weights
+        return self._weights
+
+    @property
+    def parameters(self):
+        return self._parameters
@@ -2,6 +2,7 @@ from unittest import TestCase
 from tests.assertions import CustomAssertions
 import floq.optimization.fidelity as fid
 import numpy as np
+import floq
 from mock import MagicMock
 import importlib.machinery
 import importlib.util
@@ -13,6 +14,10 @@ spec = importlib.util.spec_from_loader(loader.name, loader)
 spins = importlib.util.module_from_spec(spec)
 loader.exec_module(spins)
 
+def spin_system(parameters):
+    return spins.spin(2, parameters[1], parameters[0], frequency=1.5,
+                      n_zones=31)
+
 
 class TestFidelityBaseIterations(TestCase):
     def setUp(self):
@@ -42,3 +47,375 @@ class TestEnsembleFidelity(CustomAssertions):
         f = fid.EnsembleFidelity(self.ensemble, fid.OperatorDistance, t=1.0, target=target)
         print(f.f(np.array([1.5, 1.5, 1.5, 1.5])))
         self.assertTrue(np.isclose(0.0, f.f(np.array([1.5, 1.5, 1.5, 1.5])), atol=1e-5))
+
+    def test_continuation_matches_independent(self):
+        ensemble = spins.SpinEnsemble(4, 2, 1.5,
+                                      np.array([1.3, 1.0, 1.2, 1.1]),
+                                      np.array([1.0, 0.9, 1.1, 1.0]))
+        target = np.array([[0.105818 - 0.324164j, -0.601164 - 0.722718j],
+                           [0.601164 - 0.722718j, 0.105818 + 0.324164j]])
+        controls = np.array([1.5, 1.4, 1.3, 1.2])
+        plain = fid.EnsembleFidelity(ensemble, fid.OperatorDistance, t=1.0,
+                                     target=target)
+        continued = fid.EnsembleFidelity(ensemble, fid.OperatorDistance,
+                                         continuation=True, t=1.0,
+                                         target=target)
+        self.assertArrayEqual(np.sort(continued.order), np.arange(4))
+        self.assertAlmostEqualWithDecimals(continued.f(controls),
+                                           plain.f(controls))
+        self.assertArrayEqual(continued.df(controls), plain.df(controls))
+
+class TestStochasticEnsembleFidelity(CustomAssertions):
+    def setUp(self):
+        self.ensemble = spins.SpinEnsemble(4, 2, 1.5,
+                                           np.array([1.0, 1.1, 1.2, 1.3]),
+                                           np.array([1.0, 0.9, 1.1, 1.0]))
+        self.target = np.array([[0.105818 - 0.324164j, -0.601164 - 0.722718j],
+                                [0.601164 - 0.722718j, 0.105818 + 0.324164j]])
+        self.controls = np.array([1.5, 1.4, 1.3, 1.2])
+        self.full = fid.EnsembleFidelity(self.ensemble, fid.OperatorDistance,
+                                         t=1.0, target=self.target)
+
+    def stochastic(self, **kwargs):
+        return fid.StochasticEnsembleFidelity(self.ensemble,
+                                              fid.OperatorDistance,
+                                              t=1.0, target=self.target,
+                                              **kwargs)
+
+    def test_full_batch_is_exact(self):
+        f = self.stochastic(batch_size=4, seed=1)
+        self.assertAlmostEqualWithDecimals(f.f(self.controls),
+                                           self.full.f(self.controls))
+        self.assertArrayEqual(f.df(self.controls), self.full.df(self.controls))
+
+    def test_batch_size(self):
+        f = self.stochastic(batch_size=2, seed=1)
+        self.assertEqual(len(f.batch), 2)
+        self.assertEqual(len(set(f.batch)), 2)
+
+    def test_seed_is_reproducible(self):
+        a = self.stochastic(batch_size=2, seed=4)
+        b = self.stochastic(batch_size=2, seed=4)
+        for _ in range(3):
+            self.assertArrayEqual(a.batch, b.batch)
+            a.iterate(self.controls)
+            b.iterate(self.controls)
+
+    def test_batch_fixed_until_iterate(self):
+        f = self.stochastic(batch_size=2, seed=2)
+        batch = f.batch.copy()
+        f.f(self.controls)
+        f.df(self.controls)
+        self.assertArrayEqual(f.batch, batch)
+
+    def test_control_variate_exact_at_anchor(self):
+        f = self.stochastic(batch_size=1, seed=3, control_variate=True)
+        f.set_anchor(self.controls)
+        self.assertAlmostEqualWithDecimals(f.f(self.controls),
+                                           self.full.f(self.controls))
+        self.assertArrayEqual(f.df(self.controls), self.full.df(self.controls))
+
+    def test_negative_weights_are_unbiased(self):
+        ensemble = spins.SpinEnsemble(4, 2, 1.5,
+                                      np.array([1.0, 1.1, 1.2, 1.3]),
+                                      np.array([1.0, 0.9, 1.1, 1.0]),
+                                      np.array([1.5, -0.5, 1.0, 1.0]))
+        full = fid.EnsembleFidelity(ensemble, fid.OperatorDistance, t=1.0,
+                                    target=self.target)
+        f = fid.StochasticEnsembleFidelity(ensemble, fid.OperatorDistance,
+                                           batch_size=2, seed=5, t=1.0,
+                                           target=self.target)
+        # The seeded mean of many batches is within five standard errors.
+        estimates = []
+        for _ in range(2000):
+            f.resample()
+            estimates.append(f.f(self.controls))
+        self.assertLess(abs(np.mean(estimates) - full.f(self.controls)), 1.5e-3)
+        f.set_anchor(self.controls)
+        f.control_variate = True
+        self.assertAlmostEqualWithDecimals(f.f(self.controls),
+                                           full.f(self.controls))
+        self.assertArrayEqual(f.df(self.controls), full.df(self.controls))
+
+class TestWeightedEnsembleFidelity(CustomAssertions):
+    def setUp(self):
+        self.target = np.array([[0.105818 - 0.324164j, -0.601164 - 0.722718j],
+                                [0.601164 - 0.722718j, 0.105818 + 0.324164j]])
+        self.controls = np.array([1.5, 1.4, 1.3, 1.2])
+
+    def test_weights_match_repeated_members(self):
+        # Weight 2:1 should be the same as including the first spin twice.
+        weighted = spins.SpinEnsemble(2, 2, 1.5, np.array([1.0, 1.3]),
+                                      np.array([1.0, 0.9]),
+                                      weights=np.array([2.0, 1.0]))
+        repeated = spins.SpinEnsemble(3, 2, 1.5, np.array([1.0, 1.0, 1.3]),
+                                      np.array([1.0, 1.0, 0.9]))
+        a = fid.EnsembleFidelity(weighted, fid.OperatorDistance, t=1.0,
+                                 target=self.target)
+        b = fid.EnsembleFidelity(repeated, fid.OperatorDistance, t=1.0,
+                                 target=self.target)
+        self.assertAlmostEqualWithDecimals(a.f(self.controls),
+                                           b.f(self.controls))
+        self.assertArrayEqual(a.df(self.controls), b.df(self.controls))
+
+    def test_quadrature_ensemble(self):
+        ensemble = spins.QuadratureSpinEnsemble(3, 2, 2, 1.5, 0.2, 0.1)
+        self.assertEqual(len(ensemble.systems), 6)
+        self.assertAlmostEqual(np.sum(ensemble.weights), 1.0)
+        self.assertAlmostEqual(np.sum(ensemble.weights
+                                      * ensemble.frequencies), 0.0)
+
+class TestStreamingEnsembleFidelity(CustomAssertions):
+    def setUp(self):
+        self.parameters = np.array([[1.0, 1.0], [1.3, 0.9], [1.1, 1.1],
+                                    [1.2, 1.0], [1.05, 0.95]])
+        self.weights = np.array([1.0, 2.0, 1.0, 0.5, 1.5])
+        self.target = np.array([[0.105818 - 0.324164j, -0.601164 - 0.722718j],
+                                [0.601164 - 0.722718j, 0.105818 + 0.324164j]])
+        self.controls = np.array([1.5, 1.4, 1.3, 1.2])
+        eager = spins.SpinEnsemble(5, 2, 1.5, self.parameters[:, 0],
+                                   self.parameters[:, 1], self.weights)
+        self.full = fid.EnsembleFidelity(eager, fid.OperatorDistance, t=1.0,
+                                         target=self.target)
+        self.lazy = floq.system.LazyEnsemble(spin_system, self.parameters,
+                                             self.weights)
+
+    def streaming(self, **kwargs):
+        return fid.StreamingEnsembleFidelity(self.lazy, fid.OperatorDistance,
+                                             t=1.0, target=self.target,
+                                             **kwargs)
+
+    def test_lazy_systems_are_built_on_demand(self):
+        systems = self.lazy.systems
+        self.assertEqual(len(systems), 5)
+        self.assertIsNot(systems[0], systems[0])
+        self.assertEqual(len(systems[1:3]), 2)
+
+    def test_matches_ensemble_fidelity(self):
+        f = self.streaming(chunk_size=2)
+        self.assertAlmostEqualWithDecimals(f.f(self.controls),
+                                           self.full.f(self.controls))
+        self.assertArrayEqual(f.df(self.controls), self.full.df(self.controls))
+
+    def test_continuation(self):
+        f = self.streaming(chunk_size=3, continuation=True)
+        self.assertArrayEqual(f.df(self.controls), self.full.df(self.controls))
+        self.assertAlmostEqualWithDecimals(f.f(self.controls),
+                                           self.full.f(self.controls))
+
+    def test_f_reused_after_df(self):
+        f = self.streaming()
+        f.df(self.controls)
+        self.lazy.factory = None
+        self.assertAlmostEqualWithDecimals(f.f(self.controls),
+                                           self.full.f(self.controls))
+
+class TestBatchFidelity(CustomAssertions):
+    def setUp(self):
+        self.ensemble = spins.SpinEnsemble(3, 2, 1.5,
+                                           np.array([1.0, 1.1, 1.2]),
+                                           np.array([1.0, 0.9, 1.1]),
+                                           np.array([1.0, 2.0, 1.0]))
+        self.target = np.array([[0.105818 - 0.324164j, -0.601164 - 0.722718j],
+                                [0.601164 - 0.722718j, 0.105818 + 0.324164j]])
+        self.batch = np.random.RandomState(5).uniform(0.5, 1.5, size=(5, 4))
+
+    def check(self, f):
+        values = f.f_batch(self.batch, threads=2)
+        gradients = f.df_batch(self.batch, threads=2)
+        self.assertEqual(values.shape, (5,))
+        self.assertEqual(gradients.shape, (5, 4))
+        for row, value, gradient in zip(self.batch, values, gradients):
+            self.assertAlmostEqualWithDecimals(value, f.f(row))
+            self.assertArrayEqual(gradient, f.df(row))
+
+    def test_operator_distance(self):
+        self.check(fid.OperatorDistance(self.ensemble.systems[0], t=1.0,
+                                        target=self.target))
+
+    def test_transfer_distance(self):
+        initial = np.array([1.0, 0.0], dtype=np.complex128)
+        self.check(fid.TransferDistance(self.ensemble.systems[0], t=1.0,
+                                        initial=initial,
+                                        final=self.target @ initial))
+
+    def test_ensemble(self):
+        self.check(fid.EnsembleFidelity(self.ensemble, fid.OperatorDistance,
+                                        t=1.0, target=self.target))
+
+    def test_penalty_is_added(self):
+        f = fid.OperatorDistance(self.ensemble.systems[0], t=1.0,
+                                 target=self.target)
+        f.penalty = lambda controls: np.sum(controls**2)
+        f.d_penalty = lambda controls: 2*controls
+        self.check(f)
+
+    def test_default_row_by_row(self):
+        self.check(fid.StochasticEnsembleFidelity(self.ensemble,
+                                                  fid.OperatorDistance,
+                                                  batch_size=2, seed=1,
+                                                  t=1.0, target=self.target))
+
+class TestSecondOrder(CustomAssertions):
+    def setUp(self):
+        self.system = spin_system([1.1, 1.0])
+        self.controls = np.array([1.5, 1.4, 1.3, 1.2])
+        self.target = self.system.u(1.0, np.array([1.2, 1.0, 0.8, 1.4]))
+        self.fidelity = fid.OperatorDistance(self.system, t=1.0,
+                                             target=self.target)
+
+    def numerical_hessian(self, f, x, step=1e-2):
+        n = x.shape[0]
+        out = np.empty((n, n))
+        for i in range(n):
+            for j in range(n):
+                di, dj = step*np.eye(n)[i], step*np.eye(n)[j]
+                out[i, j] = (f(x + di + dj) - f(x + di - dj)
+                             - f(x - di + dj) + f(x - di - dj)) / (4*step**2)
+        return out
+
+    def test_hessian_matches_differences_of_f(self):
+        expected = self.numerical_hessian(self.fidelity.f, self.controls)
+        self.assertArrayEqual(self.fidelity.hessian(self.controls), expected,
+                              decimals=3)
+
+    def test_hessp(self):
+        vector = np.array([0.3, -1.0, 0.5, 2.0])
+        self.assertArrayEqual(self.fidelity.hessp(self.controls, vector),
+                              self.fidelity.hessian(self.controls) @ vector,
+                              decimals=6)
+
+    def test_d2u_dcontrols(self):
+        d2u = self.system.d2u_dcontrols(1.0, self.controls)
+        self.assertEqual(d2u.shape, (4, 4, 2, 2))
+        expected = -np.trace(np.einsum('ij,abjk->abik',
+                                       np.conj(self.target.T), d2u),
+                             axis1=2, axis2=3).real / 2
+        self.assertArrayEqual(self.fidelity.hessian(self.controls), expected,
+                              decimals=6)
+
+    def test_hessian_matches_differences_of_df(self):
+        # Far less rounding of the quasienergies makes Richardson-extrapolated
+        # differences of the gradient a precise reference.
+        precise = spins.spin(2, 1.0, 1.1, frequency=1.5, n_zones=31,
+                             decimals=13)
+        fidelity = fid.OperatorDistance(precise, t=1.0, target=self.target)
+        def differences(step):
+            return np.array([(fidelity.df(self.controls + d)
+                              - fidelity.df(self.controls - d)) / (2*step)
+                             for d in step*np.eye(4)])
+        expected = (4*differences(5e-4) - differences(1e-3)) / 3
+        self.assertArrayEqual(fidelity.hessian(self.controls), expected,
+                              decimals=9)
+
+    def test_nonlinear_controls(self):
+        # The second derivatives of the Hamiltonian contribute as well.
+        def hamiltonian(controls):
+            return spins.hamiltonian(2, 1.1, np.sin(controls))
+        def dhamiltonian(controls):
+            return np.cos(controls)[:, None, None, None]\
+                   * spins.dhamiltonian(2)
+        system = floq.System(hamiltonian, dhamiltonian, frequency=1.5,
+                             n_zones=31, decimals=13)
+        fidelity = fid.OperatorDistance(system, t=1.0, target=self.target)
+        expected = self.numerical_hessian(fidelity.f, self.controls, 1e-3)
+        self.assertArrayEqual(fidelity.hessian(self.controls), expected,
+                              decimals=5)
+
+    def test_transfer_hessian(self):
+        initial = np.array([1.0, 0.0], dtype=np.complex128)
+        transfer = fid.TransferDistance(self.system, t=1.0, initial=initial,
+                                        final=self.target @ initial)
+        expected = self.numerical_hessian(transfer.f, self.controls)
+        self.assertArrayEqual(transfer.hessian(self.controls), expected,
+                              decimals=3)
+
+    def test_gauss_newton_exact_at_optimum(self):
+        optimum = np.array([1.2, 1.0, 0.8, 1.4])
+        gauss_newton = self.fidelity.gauss_newton(optimum)
+        self.assertArrayEqual(gauss_newton, self.fidelity.hessian(optimum),
+                              decimals=4)
+        self.assertTrue(np.all(np.linalg.eigvalsh(
+            self.fidelity.gauss_newton(self.controls)) > -1e-12))
+
+    def test_transfer_gauss_newton_exact_at_optimum(self):
+        optimum = np.array([1.2, 1.0, 0.8, 1.4])
+        initial = np.array([1.0, 0.0], dtype=np.complex128)
+        final = self.target @ initial
+        transfer = fid.TransferDistance(self.system, t=1.0, initial=initial,
+                                        final=final)
+        self.assertArrayEqual(transfer.gauss_newton(optimum),
+                              transfer.hessian(optimum), decimals=4)
+
+    def test_ensemble_gauss_newton(self):
+        ensemble = spins.SpinEnsemble(2, 2, 1.5, np.array([1.0, 1.2]),
+                                      np.array([1.0, 0.9]),
+                                      np.array([1.0, 3.0]))
+        f = fid.EnsembleFidelity(ensemble, fid.OperatorDistance, t=1.0,
+                                 target=self.target)
+        expected = 0.25*f.fidelities[0].gauss_newton(self.controls)\
+                   + 0.75*f.fidelities[1].gauss_newton(self.controls)
+        self.assertArrayEqual(f.gauss_newton(self.controls), expected)
+
+    def test_ensemble_hessian(self):
+        ensemble = spins.SpinEnsemble(2, 2, 1.5, np.array([1.0, 1.2]),
+                                      np.array([1.0, 0.9]),
+                                      np.array([1.0, 3.0]))
+        f = fid.EnsembleFidelity(ensemble, fid.OperatorDistance, t=1.0,
+                                 target=self.target)
+        expected = 0.25*f.fidelities[0].hessian(self.controls)\
+                   + 0.75*f.fidelities[1].hessian(self.controls)
+        self.assertArrayEqual(f.hessian(self.controls), expected)
+
+class TestMultiOperatorDistance(CustomAssertions):
+    def setUp(self):
+        self.system = spin_system([1.1, 1.0])
+        self.controls = np.array([1.5, 1.4, 1.3, 1.2])
+        optimum = np.array([1.2, 1.0, 0.8, 1.4])
+        self.objectives = [(1.0, self.system.u(1.0, optimum)),
+                           (1.5, self.system.u(1.5, optimum)),
+                           (1.0, np.eye(2))]
+        self.fidelity = fid.MultiOperatorDistance(self.system, self.objectives,
+                                                  weights=[1.0, 2.0, 1.0])
+
+    def single(self, t, target):
+        return fid.OperatorDistance(spin_system([1.1, 1.0]), t=t,
+                                    target=target)
+
+    def test_values_match_single_objectives(self):
+        expected = np.array([self.single(t, target).f(self.controls)
+                             for t, target in self.objectives])
+        self.assertArrayEqual(self.fidelity.values(self.controls), expected)
+
+    def test_gradients_match_single_objectives(self):
+        expected = np.array([self.single(t, target).df(self.controls)
+                             for t, target in self.objectives])
+        self.assertArrayEqual(self.fidelity.gradients(self.controls), expected)
+
+    def test_weighted_combination(self):
+        weights = np.array([0.25, 0.5, 0.25])
+        self.assertAlmostEqualWithDecimals(
+            self.fidelity.f(self.controls),
+            weights @ self.fidelity.values(self.controls))
+        self.assertArrayEqual(self.fidelity.df(self.controls),
+                              weights @ self.fidelity.gradients(self.controls))
+
+    def test_batch(self):
+        batch = np.array([self.controls, self.controls + 0.1])
+        self.assertArrayEqual(self.fidelity.f_batch(batch),
+                              np.array([self.fidelity.f(row) for row in batch]))
+        self.assertArrayEqual(self.fidelity.df_batch(batch),
+                              np.array([self.fidelity.df(row)
+                                        for row in batch]))
+
+    def test_hessian(self):
+        weights = np.array([0.25, 0.5, 0.25])
+        expected = sum(weight * self.single(t, target).hessian(self.controls)
+                       for weight, (t, target) in zip(weights,
+                                                      self.objectives))
+        self.assertArrayEqual(self.fidelity.hessian(self.controls), expected)
+
+    def test_error_on_mismatched_weights(self):
+        with self.assertRaises(ValueError):
+            fid.MultiOperatorDistance(self.system, self.objectives,
+                                      weights=[1.0, 2.0])
@@ -0,0 +1,103 @@
+from unittest import TestCase
+import unittest.mock
+from tests.assertions import CustomAssertions
+import numpy as np
+import floq.optimization.fidelity as fid
+import floq.optimization.optimizer as optimizer
+
+
+class NoisyQuadratic(fid.FidelityBase):
+    """f(x) = |x - 1|^2, with a reproducible random error on the gradient."""
+    def __init__(self, noise, seed=0):
+        super().__init__(None)
+        self.noise = noise
+        self.random = np.random.RandomState(seed)
+
+    def _f(self, x):
+        return np.sum((x - 1.0)**2)
+
+    def _df(self, x):
+        return 2*(x - 1.0) + self.noise*self.random.normal(size=x.shape)
+
+
+class TestAdamOptimizer(CustomAssertions):
+    def test_converges_exact_gradient(self):
+        result = optimizer.AdamOptimizer(NoisyQuadratic(0.0), np.zeros(3),
+                                         learning_rate=0.05,
+                                         n_iterations=2000).optimize()
+        self.assertArrayEqual(result.x, np.ones(3), decimals=3)
+
+    def test_converges_noisy_gradient(self):
+        result = optimizer.AdamOptimizer(NoisyQuadratic(0.5), np.zeros(3),
+                                         learning_rate=0.05, decay=0.01,
+                                         n_iterations=3000).optimize()
+        self.assertArrayEqual(result.x, np.ones(3), decimals=1)
+
+    def test_counts_iterations(self):
+        fidelity = NoisyQuadratic(0.0)
+        optimizer.AdamOptimizer(fidelity, np.zeros(2),
+                                n_iterations=25).optimize()
+        self.assertEqual(fidelity.iterations, 25)
+
+    def test_one_gradient_per_iteration(self):
+        fidelity = NoisyQuadratic(0.0)
+        with unittest.mock.patch.object(NoisyQuadratic, '_f', autospec=True,
+                                        side_effect=NoisyQuadratic._f) as f,\
+             unittest.mock.patch.object(NoisyQuadratic, '_df', autospec=True,
+                                        side_effect=NoisyQuadratic._df) as df:
+            optimizer.AdamOptimizer(fidelity, np.zeros(2),
+                                    n_iterations=25).optimize()
+        self.assertEqual(df.call_count, 25)
+        self.assertEqual(f.call_count, 0)
+
+    def test_no_iterations(self):
+        result = optimizer.AdamOptimizer(NoisyQuadratic(0.0), np.zeros(2),
+                                         n_iterations=0).optimize()
+        self.assertArrayEqual(result.x, np.zeros(2))
+        self.assertEqual(result.nit, 0)
+        self.assertEqual(result.jac.shape, (2,))
+
+    def test_tolerance_stops_early(self):
+        result = optimizer.AdamOptimizer(NoisyQuadratic(0.0), np.zeros(2),
+                                         learning_rate=0.05, decay=1.0,
+                                         n_iterations=100000,
+                                         tol=1e-4).optimize()
+        self.assertTrue(result.success)
+        self.assertLess(result.nit, 100000)
+
+
+class TestSecondOrderSciPyOptimizer(CustomAssertions):
+    def setUp(self):
+        import importlib.machinery, importlib.util
+        loader = importlib.machinery.SourceFileLoader('spins',
+                                                      'examples/spins.py')
+        spec = importlib.util.spec_from_loader(loader.name, loader)
+        spins = importlib.util.module_from_spec(spec)
+        loader.exec_module(spins)
+        system = spins.spin(2, 1.0, 1.1, frequency=1.5, n_zones=31)
+        target = system.u(1.0, np.array([1.2, 1.0, 0.8, 1.4]))
+        self.fidelity = fid.OperatorDistance(system, t=1.0, target=target)
+        self.init = np.array([1.0, 1.1, 1.0, 1.2])
+
+    def test_gauss_newton_trust_region(self):
+        result = optimizer.SciPyOptimizer(self.fidelity, self.init,
+                                          method='trust-exact', tol=1e-10,
+                                          hessian='gauss-newton').optimize()
+        self.assertLess(result.fun, 1e-8)
+
+    def test_hessp_newton_cg(self):
+        result = optimizer.SciPyOptimizer(self.fidelity, self.init,
+                                          method='Newton-CG', tol=1e-10,
+                                          hessian='hessp').optimize()
+        self.assertLess(result.fun, 1e-8)
+
+    def test_exact_hessian_trust_region(self):
+        result = optimizer.SciPyOptimizer(self.fidelity, self.init,
+                                          method='trust-exact', tol=1e-10,
+                                          hessian='exact').optimize()
+        self.assertLess(result.fun, 1e-8)
+
+    def test_unknown_hessian(self):
+        with self.assertRaises(ValueError):
+            optimizer.SciPyOptimizer(self.fidelity, self.init,
+                                     hessian='magic')
@@ -0,0 +1,104 @@
+from tests.assertions import CustomAssertions
+import numpy as np
+import floq.optimization.fidelity as fid
+from floq.parallel.linesearch import SpeculativeBFGSOptimizer
+from floq.parallel.pool import WorkerPool
+from tests.parallel.test_pool import RabiEnsemble
+from tests import rabi
+
+class Rosenbrock(fid.FidelityBase):
+    def __init__(self):
+        super().__init__(None)
+
+    def _f(self, x):
+        return np.sum(100*(x[1:] - x[:-1]**2)**2 + (1 - x[:-1])**2)
+
+    def _df(self, x):
+        out = np.zeros_like(x)
+        out[:-1] = -400*x[:-1]*(x[1:] - x[:-1]**2) - 2*(1 - x[:-1])
+        out[1:] += 200*(x[1:] - x[:-1]**2)
+        return out
+
+class Uphill(Rosenbrock):
+    """Rosenbrock with the gradient reversed, so no step ever decreases f."""
+    def _df(self, x):
+        return -super()._df(x)
+
+pool = None
+
+def setUpModule():
+    global pool
+    pool = WorkerPool(2, initialiser=None)
+
+def tearDownModule():
+    pool.close()
+
+
+class TestSpeculativeBFGS(CustomAssertions):
+    def test_serial_rosenbrock(self):
+        result = SpeculativeBFGSOptimizer(Rosenbrock(), np.array([-1.2, 1.0]),
+                                          max_iterations=500).optimize()
+        self.assertTrue(result.success)
+        self.assertArrayEqual(result.x, np.ones(2), decimals=4)
+
+    def test_counts_iterations(self):
+        fidelity = Rosenbrock()
+        result = SpeculativeBFGSOptimizer(fidelity, np.array([-1.2, 1.0]),
+                                          max_iterations=10).optimize()
+        self.assertEqual(fidelity.iterations, result.nit)
+        self.assertFalse(result.success)
+
+    def test_no_iterations(self):
+        fidelity = Rosenbrock()
+        result = SpeculativeBFGSOptimizer(fidelity, np.array([-1.2, 1.0]),
+                                          max_iterations=0).optimize()
+        self.assertEqual(result.nit, 0)
+        self.assertEqual(fidelity.iterations, 0)
+        self.assertArrayEqual(result.x, np.array([-1.2, 1.0]))
+
+    def test_failed_line_search_not_counted(self):
+        fidelity = Uphill()
+        result = SpeculativeBFGSOptimizer(fidelity,
+                                          np.array([-1.2, 1.0])).optimize()
+        self.assertFalse(result.success)
+        self.assertEqual(result.nit, 0)
+        self.assertEqual(fidelity.iterations, 0)
+
+    def test_workers_iterate_with_parent(self):
+        # The workers' copies must draw the same new batch as the parent on
+        # every accepted step, or the parallel run drifts from the serial one.
+        def stochastic():
+            ensemble = RabiEnsemble([1.0, 1.1, 1.2, 1.3, 1.4])
+            target = rabi.u(0.5, 1.2, 2.8, 5.0, 1.5)
+            return fid.StochasticEnsembleFidelity(
+                ensemble, fid.OperatorDistance, batch_size=2, seed=4, t=1.5,
+                target=target)
+        serial = SpeculativeBFGSOptimizer(stochastic(), np.array([0.3]),
+                                          n_candidates=2,
+                                          max_iterations=5).optimize()
+        parallel = SpeculativeBFGSOptimizer(stochastic(), np.array([0.3]),
+                                            pool=pool,
+                                            max_iterations=5).optimize()
+        self.assertEqual(parallel.nit, serial.nit)
+        self.assertArrayEqual(parallel.x, serial.x)
+
+    def test_parallel_matches_serial(self):
+        serial = SpeculativeBFGSOptimizer(Rosenbrock(), np.array([-1.2, 1.0]),
+                                          n_candidates=2,
+                                          max_iterations=500).optimize()
+        parallel = SpeculativeBFGSOptimizer(Rosenbrock(),
+                                            np.array([-1.2, 1.0]),
+                                            pool=pool,
+                                            max_iterations=500).optimize()
+        self.assertArrayEqual(parallel.x, serial.x, decimals=4)
+        self.assertEqual(parallel.nit, serial.nit)
+
+    def test_floquet_fidelity(self):
+        ensemble = RabiEnsemble([1.2])
+        target = rabi.u(0.5, 1.2, 2.8, 5.0, 1.5)
+        fidelity = fid.OperatorDistance(ensemble.systems[0], t=1.5,
+                                        target=target)
+        result = SpeculativeBFGSOptimizer(fidelity, np.array([0.3]),
+                                          pool=pool).optimize()
+        self.assertTrue(result.success)
+        self.assertArrayEqual(result.x, np.array([0.5]), decimals=4)
@@ -0,0 +1,129 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+from tests.assertions import CustomAssertions
+import numpy as np
+import floq.optimization.fidelity as fid
+from floq.parallel.multistart import MultiStartOptimizer, uniform_starts
+from floq.parallel.multistart import _run_start
+from floq.parallel.pool import WorkerPool
+from tests.parallel.test_pool import RabiEnsemble
+from tests import rabi
+
+class DoubleWell(fid.FidelityBase):
+    """f(x) = (x^2 - 1)^2 + 0.3 (x + 1) per component, with its global minimum
+    near x = -1 and a worse local one near x = +1."""
+    def __init__(self):
+        super().__init__(None)
+
+    def _f(self, x):
+        return np.sum((x**2 - 1)**2 + 0.3*(x + 1))
+
+    def _df(self, x):
+        return 4*x*(x**2 - 1) + 0.3
+
+pool = None
+
+def setUpModule():
+    global pool
+    pool = WorkerPool(2, initialiser=None)
+
+def tearDownModule():
+    pool.close()
+
+
+class TestUniformStarts(CustomAssertions):
+    def test_shape_and_bounds(self):
+        starts = uniform_starts(10, [-1.0, 0.0], [1.0, 2.0], seed=3)
+        self.assertEqual(starts.shape, (10, 2))
+        self.assertTrue(np.all(starts >= [-1.0, 0.0]))
+        self.assertTrue(np.all(starts <= [1.0, 2.0]))
+        self.assertArrayEqual(starts, uniform_starts(10, [-1.0, 0.0],
+                                                     [1.0, 2.0], seed=3))
+
+
+class TestMultiStartOptimizer(CustomAssertions):
+    def setUp(self):
+        self.inits = np.array([[1.2], [0.8], [-0.5], [1.5], [-1.4], [0.9]])
+
+    def test_serial_finds_global_minimum(self):
+        result = MultiStartOptimizer(DoubleWell(), self.inits).optimize()
+        self.assertEqual(len(result.results), 6)
+        self.assertArrayEqual(result.x, np.array([-1.0356]), decimals=3)
+        self.assertIn(result.best, (2, 4))
+        self.assertEqual(result.n_cancelled, 0)
+        self.assertTrue(result.success)
+
+    def test_parallel_matches_serial(self):
+        serial = MultiStartOptimizer(DoubleWell(), self.inits).optimize()
+        parallel = MultiStartOptimizer(DoubleWell(), self.inits,
+                                       pool=pool).optimize()
+        self.assertAlmostEqualWithDecimals(parallel.fun, serial.fun)
+        self.assertEqual([r.start for r in parallel.results], list(range(6)))
+
+    def test_worse_starts_cancelled(self):
+        # Serially the global minimum is found first, so every start in the
+        # other well is clearly worse once it has settled.
+        inits = np.array([[-1.4], [1.2], [0.8], [1.5]])
+        result = MultiStartOptimizer(DoubleWell(), inits, margin=0.1,
+                                     grace=2).optimize()
+        self.assertEqual(result.best, 0)
+        self.assertEqual(result.n_cancelled, 3)
+        self.assertTrue(all(r.cancelled for r in result.results[1:]))
+
+    def test_target_stops_remaining_starts(self):
+        inits = np.array([[-1.4], [1.2], [0.8]])
+        result = MultiStartOptimizer(DoubleWell(), inits,
+                                     target=0.1).optimize()
+        self.assertFalse(result.results[0].cancelled)
+        self.assertTrue(result.results[2].cancelled)
+        self.assertTrue(result.success)
+
+    def test_floquet_fidelity_on_pool(self):
+        ensemble = RabiEnsemble([1.2])
+        target = rabi.u(0.5, 1.2, 2.8, 5.0, 1.5)
+        fidelity = fid.OperatorDistance(ensemble.systems[0], t=1.5,
+                                        target=target)
+        inits = uniform_starts(4, [0.1], [0.9], seed=1)
+        result = MultiStartOptimizer(fidelity, inits, pool=pool).optimize()
+        self.assertAlmostEqualWithDecimals(result.fun, 0.0, 4)
+
+    def test_best_updated_under_lock(self):
+        class Lock:
+            def __init__(self):
+                self.held, self.updates = False, 0
+            def __enter__(self):
+                self.held = True
+            def __exit__(self, *exc_info):
+                self.held = False
+        lock = Lock()
+        class State(np.ndarray):
+            def __setitem__(self, index, value):
+                if index == 0:
+                    lock.updates += 1
+                    assert lock.held
+                super().__setitem__(index, value)
+        state = np.array([np.inf, 0.0]).view(State)
+        task = MultiStartOptimizer(DoubleWell(), self.inits)\
+                   ._tasks(state, lock)[2]
+        result = _run_start(DoubleWell(), task)
+        self.assertGreater(lock.updates, 0)
+        self.assertAlmostEqualWithDecimals(state[0], result.fun)
+
+    def test_shared_block_released_cleanly(self):
+        # The resource tracker reports a block unlinked by the parent, but
+        # unregistered by a worker, only on the stderr of its own process.
+        script = ("from floq.parallel.multistart import MultiStartOptimizer\n"
+                  "from floq.parallel.pool import WorkerPool\n"
+                  "from tests.parallel.test_multistart import DoubleWell\n"
+                  "with WorkerPool(2, initialiser=None) as pool:\n"
+                  "    MultiStartOptimizer(DoubleWell(), [[1.2], [-0.5]],\n"
+                  "                        pool=pool).optimize()\n")
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        process = subprocess.run([sys.executable, '-c', script], cwd=root,
+                                 capture_output=True, text=True, timeout=300)
+        self.assertEqual(process.returncode, 0, msg=process.stderr)
+        self.assertNotIn('Traceback', process.stderr)
+        self.assertNotIn('leaked', process.stderr)
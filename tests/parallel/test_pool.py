@@ -0,0 +1,207 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+from tests.assertions import CustomAssertions
+import numpy as np
+import floq
+import floq.optimization.fidelity as fid
+from floq.parallel.pool import WorkerPool
+from floq.parallel.simple_ensemble import ParallelEnsembleFidelity
+from floq.parallel.worker import FidelityMaster
+from tests import rabi
+
+# Everything sent to the workers has to be picklable, so the Hamiltonians are
+# defined at module level rather than as closures.
+
+def rabi_hamiltonian(controls, e1):
+    return rabi.hf(controls[0], e1, 2.8)
+
+def rabi_dhamiltonian(controls, e1):
+    return np.array([rabi.hf(1.0, 0.0, 0.0)])
+
+def rabi_system(e1):
+    return floq.System(_Partial(rabi_hamiltonian, e1),
+                       _Partial(rabi_dhamiltonian, e1),
+                       n_zones=11, frequency=5.0)
+
+class _Partial:
+    def __init__(self, function, e1):
+        self.function, self.e1 = function, e1
+    def __call__(self, controls):
+        return self.function(controls, self.e1)
+
+class RabiEnsemble(floq.system.EnsembleBase):
+    def __init__(self, energies, weights=None):
+        self._systems = [rabi_system(e1) for e1 in energies]
+        self._weights = weights
+
+    @property
+    def systems(self):
+        return self._systems
+
+    @property
+    def weights(self):
+        return super().weights if self._weights is None else self._weights
+
+def square(x):
+    return x * x
+
+def add(stored, x):
+    return stored + x
+
+def total(chunk, offset):
+    return sum(chunk) + offset
+
+def fail(x):
+    raise KeyError(x)
+
+pool = None
+
+def setUpModule():
+    global pool
+    pool = WorkerPool(2, initialiser=None)
+
+def tearDownModule():
+    pool.close()
+
+
+class TestWorkerPool(TestCase):
+    def test_map(self):
+        self.assertEqual(pool.map(square, range(7)), [x*x for x in range(7)])
+
+    def test_map_with_broadcast(self):
+        handle = pool.broadcast(10)
+        self.assertEqual(pool.map(add, range(5), handle), list(range(10, 15)))
+        pool.release(handle)
+
+    def test_scatter_apply(self):
+        handle = pool.scatter(range(9))
+        self.assertEqual(sum(pool.apply(handle, total, 1)), 36 + 2)
+        pool.release(handle)
+
+    def test_scatter_fewer_objects_than_workers(self):
+        handle = pool.scatter([3])
+        self.assertEqual(pool.apply(handle, total, 0), [3])
+        pool.release(handle)
+
+    def test_error_propagates(self):
+        with self.assertRaises(KeyError):
+            pool.map(fail, [1, 2, 3])
+        # The pool must still be usable after a failure.
+        self.assertEqual(pool.map(square, [3]), [9])
+
+    def test_context_manager_closes(self):
+        with WorkerPool(1, initialiser=None) as local:
+            self.assertEqual(local.map(square, [2]), [4])
+        self.assertTrue(local.closed)
+        with self.assertRaises(ValueError):
+            local.map(square, [2])
+
+
+class TestParallelFidelitiesSharePool(CustomAssertions):
+    def setUp(self):
+        self.ensemble = RabiEnsemble([1.0, 1.2, 1.4])
+        self.target = rabi.u(0.5, 1.2, 2.8, 5.0, 1.5)
+        self.controls = np.array([0.4])
+        self.serial = fid.EnsembleFidelity(self.ensemble, fid.OperatorDistance,
+                                           t=1.5, target=self.target)
+
+    def test_fidelity_master(self):
+        master = FidelityMaster(2, self.ensemble, fid.OperatorDistance,
+                                pool=pool, t=1.5, target=self.target)
+        self.assertAlmostEqualWithDecimals(master.f(self.controls),
+                                           self.serial.f(self.controls))
+        self.assertArrayEqual(master.df(self.controls),
+                              self.serial.df(self.controls))
+        master.kill()
+        self.assertFalse(pool.closed)
+
+    def test_parallel_ensemble_fidelity(self):
+        parallel = ParallelEnsembleFidelity(self.ensemble, fid.OperatorDistance,
+                                            pool=pool, t=1.5,
+                                            target=self.target)
+        self.assertAlmostEqualWithDecimals(parallel.f(self.controls),
+                                           self.serial.f(self.controls))
+        self.assertArrayEqual(parallel.df(self.controls),
+                              self.serial.df(self.controls))
+        parallel.close()
+        self.assertFalse(pool.closed)
+
+    def test_weighted_ensemble(self):
+        ensemble = RabiEnsemble([1.0, 1.2, 1.4], weights=[0.5, 0.3, 0.2])
+        serial = fid.EnsembleFidelity(ensemble, fid.OperatorDistance, t=1.5,
+                                      target=self.target)
+        master = FidelityMaster(2, ensemble, fid.OperatorDistance, pool=pool,
+                                t=1.5, target=self.target)
+        self.assertAlmostEqualWithDecimals(master.f(self.controls),
+                                           serial.f(self.controls))
+        self.assertArrayEqual(master.df(self.controls),
+                              serial.df(self.controls))
+        master.kill()
+
+    def test_streaming_lazy_ensemble(self):
+        ensemble = floq.system.LazyEnsemble(rabi_system,
+                                            np.linspace(1.0, 1.4, 7))
+        serial = fid.EnsembleFidelity(ensemble, fid.OperatorDistance, t=1.5,
+                                      target=self.target)
+        streaming = fid.StreamingEnsembleFidelity(ensemble,
+                                                  fid.OperatorDistance,
+                                                  chunk_size=2, pool=pool,
+                                                  t=1.5, target=self.target)
+        self.assertAlmostEqualWithDecimals(streaming.f(self.controls),
+                                           serial.f(self.controls))
+        self.assertArrayEqual(streaming.df(self.controls),
+                              serial.df(self.controls))
+        streaming.close()
+
+
+class TestExampleEnsemble(CustomAssertions):
+    def test_spin_ensemble_through_private_pools(self):
+        # The workers import the example as a module, as a script run from the
+        # examples directory would.
+        script = (
+            "import numpy as np\n"
+            "import floq.optimization.fidelity as fid\n"
+            "from floq.parallel.simple_ensemble import"
+            " ParallelEnsembleFidelity\n"
+            "from floq.parallel.worker import FidelityMaster\n"
+            "import spins\n"
+            "ensemble = spins.SpinEnsemble(3, 2, 1.5,"
+            " np.array([1.0, 1.1, 1.2]), np.array([1.0, 0.9, 1.1]))\n"
+            "target = np.array([[0, 1], [1, 0]], dtype=complex)\n"
+            "controls = np.array([1.5, 1.4, 1.3, 1.2])\n"
+            "master = FidelityMaster(2, ensemble, fid.OperatorDistance,"
+            " t=1.0, target=target)\n"
+            "print(master.f(controls))\n"
+            "master.kill()\n"
+            "parallel = ParallelEnsembleFidelity(ensemble,"
+            " fid.OperatorDistance, t=1.0, target=target)\n"
+            "print(parallel.f(controls))\n"
+            "parallel.close()\n"
+            "print(fid.EnsembleFidelity(ensemble, fid.OperatorDistance,"
+            " t=1.0, target=target).f(controls))\n")
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        environment = dict(os.environ, PYTHONPATH=root)
+        process = subprocess.run([sys.executable, '-c', script],
+                                 cwd=os.path.join(root, 'examples'),
+                                 env=environment, capture_output=True,
+                                 text=True, timeout=600)
+        self.assertEqual(process.returncode, 0, msg=process.stderr)
+        master, parallel, serial = map(float, process.stdout.split())
+        self.assertAlmostEqualWithDecimals(master, serial)
+        self.assertAlmostEqualWithDecimals(parallel, serial)
+
+
+class TestParallelSweep(CustomAssertions):
+    def test_matches_serial(self):
+        from tests.test_sweep import DetunedRabi
+        system = floq.System(DetunedRabi(), None, n_zones=15, frequency=2.0)
+        grid = np.linspace(-3.0, 3.0, 31)
+        serial = floq.sweep.Sweep(system, grid, times=[0.7],
+                                  chunk_size=4).run()
+        parallel = floq.sweep.Sweep(system, grid, times=[0.7], chunk_size=4,
+                                    pool=pool).run()
+        self.assertArrayEqual(parallel.branches, serial.branches)
+        self.assertArrayEqual(parallel.u, serial.u)
@@ -0,0 +1,71 @@
+from unittest import TestCase
+import os
+import numba
+from floq.parallel.pool import WorkerPool
+from floq.parallel.simple_ensemble import ParallelEnsembleFidelity
+from floq.parallel.threads import ThreadBudget, current_layout
+
+
+class TestThreadBudgetSplit(TestCase):
+    def test_even_split(self):
+        budget = ThreadBudget.split(4, n_cores=8)
+        self.assertEqual(budget.n_processes, 4)
+        self.assertEqual(budget.blas_threads, 2)
+        self.assertEqual(budget.numba_threads, 2)
+
+    def test_uneven_split_leaves_cores_idle(self):
+        budget = ThreadBudget.split(3, n_cores=8)
+        self.assertEqual(budget.blas_threads, 2)
+
+    def test_at_least_one_thread(self):
+        budget = ThreadBudget.split(16, n_cores=4)
+        self.assertEqual(budget.blas_threads, 1)
+        self.assertEqual(budget.numba_threads, 1)
+
+    def test_default_is_one_process_per_core(self):
+        budget = ThreadBudget.split(n_cores=6)
+        self.assertEqual(budget.n_processes, 6)
+        self.assertEqual(budget.blas_threads, 1)
+
+    def test_report(self):
+        budget = ThreadBudget.split(2, n_cores=8)
+        self.assertEqual(str(budget),
+                         "2 processes x (4 BLAS, 4 numba threads) on 8 cores")
+
+
+class TestWorkersApplyBudget(TestCase):
+    def assertBlasLimit(self, worker, limit):
+        if worker['blas'] is None:
+            self.skipTest("the BLAS thread limits cannot be queried")
+        self.assertTrue(worker['blas'])
+        for _, threads in worker['blas']:
+            self.assertLessEqual(threads, limit)
+
+    def test_layout(self):
+        budget = ThreadBudget(2, 1, 1)
+        with WorkerPool(2, initialiser=None, threads=budget) as pool:
+            layout = pool.layout()
+        self.assertEqual(len(layout), 2)
+        self.assertNotEqual(layout[0]['pid'], layout[1]['pid'])
+        for worker in layout:
+            self.assertEqual(worker['numba'], 1)
+            self.assertBlasLimit(worker, 1)
+
+    def test_successive_pools(self):
+        for blas_threads in (2, 1):
+            budget = ThreadBudget(1, blas_threads, 1)
+            with WorkerPool(1, initialiser=None, threads=budget) as pool:
+                (worker,) = pool.layout()
+            self.assertBlasLimit(worker, blas_threads)
+
+    def test_error_threads_with_shared_pool(self):
+        with WorkerPool(1, initialiser=None) as pool:
+            with self.assertRaises(ValueError):
+                ParallelEnsembleFidelity(None, None, pool=pool,
+                                         threads=ThreadBudget(1, 1, 1))
+
+    def test_parent_environment_restored(self):
+        before = os.environ.get('OMP_NUM_THREADS')
+        with WorkerPool(1, initialiser=None, threads=ThreadBudget(1, 1, 1)):
+            pass
+        self.assertEqual(os.environ.get('OMP_NUM_THREADS'), before)
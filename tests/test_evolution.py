@@ -65,6 +65,57 @@ class TestAssembleK(CustomAssertions):
         self.assertTrue(scipy.sparse.issparse(builtk))
         self.assertArrayEqual(builtk.toarray(), self.goalk)
 
+    def test_scipy_sparse_blocks(self):
+        hf = floq.types.TransformedMatrix(
+            self.hf.mode,
+            tuple(scipy.sparse.csr_matrix(m) for m in self.hf.matrix))
+        builtk = floq.evolution.assemble_k_sparse(hf, self.n_zones,
+                                                  self.frequency)
+        self.assertArrayEqual(builtk.toarray(), self.goalk)
+        builtk = floq.evolution.assemble_k(hf, self.n_zones, self.frequency)
+        self.assertArrayEqual(builtk, self.goalk)
+
+class TestAssembleKHermitian(CustomAssertions):
+    def setUp(self):
+        random = np.random.RandomState(3)
+        def block():
+            return random.normal(size=(3, 3)) + 1j*random.normal(size=(3, 3))
+        h0 = block()
+        h0 = h0 + np.conj(h0.T)
+        h1, h2 = block(), block()
+        self.full = floq.system._canonicalise_operator(
+            {-2: np.conj(h2.T).copy(), -1: np.conj(h1.T).copy(), 0: h0,
+             1: h1, 2: h2})
+        self.half = floq.system._canonicalise_hermitian(np.array([h0, h1, h2]))
+
+    def test_dense(self):
+        self.assertArrayEqual(floq.evolution.assemble_k(self.half, 5, 1.5,
+                                                        hermitian=True),
+                              floq.evolution.assemble_k(self.full, 5, 1.5))
+
+    def test_sparse(self):
+        expected = floq.evolution.assemble_k(self.full, 5, 1.5)
+        built = floq.evolution.assemble_k_sparse(self.half, 5, 1.5,
+                                                 hermitian=True)
+        self.assertArrayEqual(built.toarray(), expected)
+        half = floq.types.TransformedMatrix(
+            self.half.mode,
+            tuple(scipy.sparse.csr_matrix(m) for m in self.half.matrix))
+        built = floq.evolution.assemble_k_sparse(half, 5, 1.5, hermitian=True)
+        self.assertArrayEqual(built.toarray(), expected)
+
+    def test_dk(self):
+        built = floq.evolution.assemble_dk([self.half], 5, hermitian=True)[0]
+        expected = floq.evolution.assemble_dk([self.full], 5)[0]
+        self.assertArrayEqual(_column_sparse_to_dense(built),
+                              _column_sparse_to_dense(expected))
+
+def _column_sparse_to_dense(matrix):
+    out = np.zeros((matrix.in_column.shape[0],)*2, dtype=np.complex128)
+    columns = np.repeat(np.arange(matrix.in_column.shape[0]), matrix.in_column)
+    np.add.at(out, (matrix.row, columns), matrix.value)
+    return out
+
 class TestDenseToSparse(CustomAssertions):
     def test_conversion(self):
         goal = floq.types.ColumnSparseMatrix(np.array([1, 2]),
@@ -73,6 +124,14 @@ class TestDenseToSparse(CustomAssertions):
         built = floq.evolution._dense_to_sparse(np.arange(4).reshape(2, 2))
         self.assertColumnSparseMatrixEqual(built, goal)
 
+    def test_scipy_sparse_conversion(self):
+        goal = floq.types.ColumnSparseMatrix(np.array([1, 2]),
+                                             np.array([1, 0, 1]),
+                                             np.array([2, 1, 3]))
+        matrix = scipy.sparse.coo_matrix(np.arange(4).reshape(2, 2))
+        built = floq.evolution._sparse_to_column_sparse(matrix)
+        self.assertColumnSparseMatrixEqual(built, goal)
+
 class TestAssembledK(CustomAssertions):
     def setUp(self):
         self.n_zones = 5
@@ -108,6 +167,14 @@ class TestAssembledK(CustomAssertions):
         for i, bdk in enumerate(builtdk):
             self.assertColumnSparseMatrixEqual(bdk, self.goaldk[i])
 
+    def test_build_scipy_sparse_blocks(self):
+        dhf = [floq.types.TransformedMatrix(
+                   op.mode, tuple(scipy.sparse.csc_matrix(m) for m in op.matrix))
+               for op in self.dhf]
+        builtdk = floq.evolution.assemble_dk(dhf, self.n_zones)
+        for i, bdk in enumerate(builtdk):
+            self.assertColumnSparseMatrixEqual(bdk, self.goaldk[i])
+
 class TestFindEigensystem(CustomAssertions):
     def setUp(self):
         self.target_vals = np.array([-0.235, 0.753])
@@ -151,6 +218,48 @@ class TestFindEigensystem(CustomAssertions):
     def test_casts_as_complex128(self):
         self.assertEqual(self.vecs.dtype, 'complex128')
 
+class TestSpectrumSlicing(CustomAssertions):
+    def setUp(self):
+        random = np.random.RandomState(4)
+        dim = 8
+        def block():
+            return random.normal(size=(dim, dim))\
+                   + 1j*random.normal(size=(dim, dim))
+        h0, h1 = block(), 0.3*block()
+        self.hamiltonian = floq.system._canonicalise_operator(
+            {-1: np.conj(h1.T).copy(), 0: 0.5*(h0 + np.conj(h0.T)), 1: h1})
+        self.k = floq.evolution.assemble_k_sparse(self.hamiltonian, 15, 7.0)
+        self.vals, self.vecs =\
+            floq.evolution.diagonalise(self.k.toarray(), dim, 7.0, 8)
+
+    def test_matches_dense(self):
+        for slices in (1, 3, 4):
+            vals, vecs = floq.evolution.diagonalise(self.k, 8, 7.0, 8,
+                                                    solver='slicing',
+                                                    slices=slices)
+            self.assertArrayEqual(vals, self.vals, decimals=8)
+            overlaps = np.abs(np.einsum('ijk,ijk->i', np.conj(vecs),
+                                        self.vecs))
+            self.assertArrayEqual(overlaps, np.ones(8), decimals=6)
+
+    def test_count_below(self):
+        eigenvalues = np.linalg.eigvalsh(self.k.toarray())
+        for shift in (-3.5, 0.1, 2.0):
+            self.assertEqual(floq.evolution._count_below(self.k, shift),
+                             np.count_nonzero(eigenvalues < shift))
+
+    def test_boundary_on_eigenvalue_is_moved(self):
+        k = scipy.sparse.diags([-1.0, 0.0, 2.0], format='csc')
+        self.assertIsNone(floq.evolution._count_below(k, 0.0))
+        shift, count = floq.evolution._slice_boundary(k, 0.0, 1e-6)
+        self.assertGreater(shift, 0.0)
+        self.assertEqual(count, 2)
+
+    def test_error_on_dense_matrix(self):
+        with self.assertRaises(ValueError):
+            floq.evolution.diagonalise(self.k.toarray(), 8, 7.0, 8,
+                                       solver='slicing')
+
 class TestFindDuplicates(CustomAssertions):
     def test_duplicates(self):
         a = np.round(np.array([1, 2.001, 2.003, 1.999, 3]), decimals=2)
@@ -0,0 +1,155 @@
+import logging
+import unittest
+import numpy as np
+import floq
+from floq.highfrequency import Expansion
+
+
+def _hamiltonian(controls):
+    drive = np.array([[0.1, controls[0]], [0.3*controls[0], -0.2]])
+    return {-1: np.conj(drive.T).copy(),
+            0: np.array([[1.1, 0.2*controls[1]], [0.2*controls[1], -0.7]]),
+            1: drive, 2: 0.05*np.eye(2), -2: 0.05*np.eye(2)}
+
+def _dhamiltonian(controls):
+    drive = np.array([[0, 1], [0.3, 0]])
+    return [{-1: np.conj(drive.T).copy(), 1: drive},
+            {0: np.array([[0, 0.2], [0.2, 0]])}]
+
+def _expansion(controls, frequency, order, dhamiltonian=True):
+    canonicalise = floq.system._canonicalise_operator
+    return Expansion(canonicalise(_hamiltonian(controls)),
+                     [canonicalise(dh) for dh in _dhamiltonian(controls)]
+                     if dhamiltonian else None,
+                     frequency, order)
+
+
+class TestExpansion(unittest.TestCase):
+    def setUp(self):
+        self.controls = np.array([0.6, -0.3])
+
+    def test_first_order_effective_hamiltonian(self):
+        frequency = 30.0
+        expansion = _expansion(self.controls, frequency, 1)
+        h = _hamiltonian(self.controls)
+        expected = h[0] + sum((h[m] @ h[-m] - h[-m] @ h[m]) / (m * frequency)
+                              for m in (1, 2))
+        self.assertTrue(np.allclose(expansion.effective_hamiltonian, expected,
+                                    atol=1e-14))
+
+    def test_converges_with_order(self):
+        frequency = 25.0
+        floquet = floq.System(_hamiltonian, n_zones=31, frequency=frequency,
+                              sparse=False)
+        period = 2*np.pi / frequency
+        exact = floquet.u(period, self.controls)
+        errors = []
+        for order in range(4):
+            expansion = _expansion(self.controls, frequency, order, False)
+            error = np.linalg.norm(floq.highfrequency.u(expansion, period)
+                                   - exact, 2)
+            self.assertLessEqual(error, expansion.error)
+            errors.append(error)
+        self.assertTrue(all(a > 5*b for a, b in zip(errors, errors[1:])))
+
+    def test_error_estimate_over_many_periods(self):
+        frequency = 10.0
+        floquet = floq.System(_hamiltonian, n_zones=41, frequency=frequency,
+                              sparse=False)
+        expansion = _expansion(self.controls, frequency, 2, False)
+        for t in (0.3, 5.0, -5.0, 50.0):
+            error = np.linalg.norm(floq.highfrequency.u(expansion, t)
+                                   - floquet.u(t, self.controls), 2)
+            self.assertLessEqual(
+                error, floq.highfrequency.error_estimate_at(expansion, t))
+
+    def test_du_dcontrols_matches_finite_differences(self):
+        expansion = _expansion(self.controls, 10.0, 2)
+        derivatives = floq.highfrequency.du_dcontrols(expansion, 1.3)
+        step = 1e-6
+        for p, direction in enumerate(np.eye(2)):
+            forward = _expansion(self.controls + step*direction, 10.0, 2)
+            backward = _expansion(self.controls - step*direction, 10.0, 2)
+            expected = (floq.highfrequency.u(forward, 1.3)
+                        - floq.highfrequency.u(backward, 1.3)) / (2*step)
+            self.assertTrue(np.allclose(derivatives[p], expected, atol=1e-8))
+
+    def test_floquet_hamiltonian(self):
+        expansion = _expansion(self.controls, 10.0, 2)
+        values = np.linalg.eigvalsh(expansion.floquet_hamiltonian(0.4))
+        self.assertTrue(np.allclose(
+            values, np.linalg.eigvalsh(expansion.effective_hamiltonian)))
+
+    def test_eigensystem(self):
+        expansion = _expansion(self.controls, 10.0, 2)
+        eigensystem = floq.highfrequency.eigensystem(expansion, 31)
+        self.assertEqual(eigensystem.k_eigenvectors.shape, (2, 31, 2))
+        self.assertTrue(np.allclose(floq.evolution.u(eigensystem, 2.1),
+                                    floq.highfrequency.u(expansion, 2.1),
+                                    atol=1e-8))
+
+    def test_error_negative_order(self):
+        with self.assertRaises(ValueError):
+            _expansion(self.controls, 10.0, -1)
+
+
+class TestHighFrequencySystem(unittest.TestCase):
+    def setUp(self):
+        self.controls = np.array([0.6, -0.3])
+        self.floquet = floq.System(_hamiltonian, _dhamiltonian, n_zones=31,
+                                   frequency=40.0, sparse=False)
+
+    def test_matches_floquet(self):
+        system = floq.HighFrequencySystem(_hamiltonian, _dhamiltonian,
+                                          n_zones=31, frequency=40.0, order=3,
+                                          tol=1e-5)
+        for t in (0.4, 1.9, -2.2):
+            for method in ('u', 'du_dt', 'du_dcontrols'):
+                expected = getattr(self.floquet, method)(t, self.controls)
+                out = getattr(system, method)(t, self.controls)
+                self.assertTrue(np.allclose(out, expected, atol=1e-4),
+                                msg=f"{method} at t={t}")
+        self.assertIsInstance(system._eigensystem, Expansion)
+
+    def test_falls_back(self):
+        system = floq.HighFrequencySystem(_hamiltonian, _dhamiltonian,
+                                          n_zones=31, frequency=40.0, order=0,
+                                          tol=1e-12)
+        with self.assertLogs(level=logging.INFO):
+            u = system.u(1.9, self.controls)
+        self.assertIsInstance(system._eigensystem, floq.types.Eigensystem)
+        self.assertTrue(np.allclose(u, self.floquet.u(1.9, self.controls)))
+        self.assertTrue(np.allclose(system.du_dcontrols(1.9, self.controls),
+                                    self.floquet.du_dcontrols(1.9,
+                                                              self.controls)))
+
+    def test_falls_back_at_long_times(self):
+        system = floq.HighFrequencySystem(_hamiltonian, _dhamiltonian,
+                                          n_zones=31, frequency=40.0, order=2,
+                                          tol=1e-4)
+        system.u(0.3, self.controls)
+        self.assertIsInstance(system._eigensystem, Expansion)
+        with self.assertLogs(level=logging.INFO):
+            u = system.u(50.0, self.controls)
+        self.assertIsInstance(system._eigensystem, floq.types.Eigensystem)
+        self.assertLessEqual(
+            np.linalg.norm(u - self.floquet.u(50.0, self.controls), 2), 1e-4)
+        batch = np.array([self.controls, [0.2, 0.5]])
+        self.assertTrue(np.allclose(system.du_dcontrols_batch(50.0, batch),
+                                    self.floquet.du_dcontrols_batch(50.0,
+                                                                    batch)))
+
+    def test_batch(self):
+        system = floq.HighFrequencySystem(_hamiltonian, _dhamiltonian,
+                                          n_zones=31, frequency=40.0, order=3)
+        batch = np.array([self.controls, [0.2, 0.5]])
+        expected = self.floquet.du_dcontrols_batch(1.7, batch)
+        self.assertTrue(np.allclose(system.du_dcontrols_batch(1.7, batch),
+                                    expected, atol=1e-4))
+        eigensystems = system.eigensystem_batch(batch)
+        self.assertIsInstance(eigensystems[0], floq.types.Eigensystem)
+
+    def test_error_without_derivatives(self):
+        system = floq.HighFrequencySystem(_hamiltonian, frequency=40.0)
+        with self.assertRaises(ValueError):
+            system.du_dcontrols(1.0, self.controls)
@@ -1,6 +1,7 @@
 from unittest import TestCase
 from tests.assertions import CustomAssertions
 import numpy as np
+import scipy.linalg
 import floq
 
 
@@ -112,11 +113,100 @@ class TestOperatorFidelityDeriv(CustomAssertions):
 
 
 
+class TestTransferFidelityDeriv(CustomAssertions):
+
+    def test_matches_direct_sum(self):
+        dus = np.array([u3, u4])
+        iuf = floq.linalg.inner(v2, np.conj(u1.T), v1)
+        target = np.array([2 * np.real(floq.linalg.inner(v1, du, v2) * iuf)
+                           for du in dus])
+        actual = floq.linalg.d_transfer_fidelity(u1, dus, v2, v1)
+        self.assertArrayEqual(actual, target, 8)
+
+
+def _parametrised_unitary(controls):
+    """A 4x4 unitary exp(-i sum_p x_p H_p) and its exact derivatives."""
+    random = np.random.RandomState(4)
+    hamiltonians = random.normal(size=(3, 4, 4))\
+                   + 1j*random.normal(size=(3, 4, 4))
+    hamiltonians = hamiltonians + np.conj(np.transpose(hamiltonians, (0, 2, 1)))
+    def u(x):
+        return scipy.linalg.expm(-1j * np.einsum('p,pij->ij', x, hamiltonians))
+    step = 1e-6
+    dus = np.array([(u(controls + step*e) - u(controls - step*e)) / (2*step)
+                    for e in np.eye(3)])
+    return u(controls), dus, u
+
+class TestSubspaceFidelities(CustomAssertions):
+    def setUp(self):
+        self.controls = np.array([0.1, -0.2, 0.05])
+        self.u, self.dus, self.u_of = _parametrised_unitary(self.controls)
+        self.subspace = np.array([0, 2])
+        self.target = np.array([[0.0, 1.0], [1.0, 0.0]])
+
+    def assertGradient(self, function, d_function, *args):
+        step = 1e-6
+        expected = np.array([(function(self.u_of(self.controls + step*e), *args)
+                              - function(self.u_of(self.controls - step*e),
+                                         *args)) / (2*step)
+                             for e in np.eye(3)])
+        actual = d_function(self.u, self.dus, *args)
+        self.assertArrayEqual(actual, expected, 5)
+
+    def test_gate_fidelity_of_target_is_one(self):
+        fid = floq.linalg.subspace_gate_fidelity(1j * self.target, self.target)
+        self.assertAlmostEqualWithDecimals(fid, 1.0, 10)
+
+    def test_gate_fidelity_full_space_of_itself_is_one(self):
+        fid = floq.linalg.subspace_gate_fidelity(self.u, self.u)
+        self.assertAlmostEqualWithDecimals(fid, 1.0, 10)
+
+    def test_d_subspace_gate_fidelity(self):
+        self.assertGradient(floq.linalg.subspace_gate_fidelity,
+                            floq.linalg.d_subspace_gate_fidelity,
+                            self.target, self.subspace)
+
+    def test_leakage_zero_for_full_space(self):
+        leak = floq.linalg.leakage(self.u, np.arange(4))
+        self.assertAlmostEqualWithDecimals(leak, 0.0, 10)
+
+    def test_leakage_bounded(self):
+        leak = floq.linalg.leakage(self.u, self.subspace)
+        self.assertGreater(leak, 0.0)
+        self.assertLess(leak, 1.0)
+
+    def test_d_leakage(self):
+        self.assertGradient(floq.linalg.leakage, floq.linalg.d_leakage,
+                            self.subspace)
+
+    def test_average_gate_fidelity_of_target_is_one(self):
+        fid = floq.linalg.average_gate_fidelity(self.target, self.target)
+        self.assertAlmostEqualWithDecimals(fid, 1.0, 10)
+
+    def test_average_gate_fidelity_relation(self):
+        # Without leakage, F_avg = (d F_gate + 1) / (d + 1).
+        gate = floq.linalg.subspace_gate_fidelity(self.u, self.u @ self.u)
+        average = floq.linalg.average_gate_fidelity(self.u, self.u @ self.u)
+        self.assertAlmostEqualWithDecimals(average, (4*gate + 1) / 5, 10)
+
+    def test_d_average_gate_fidelity(self):
+        self.assertGradient(floq.linalg.average_gate_fidelity,
+                            floq.linalg.d_average_gate_fidelity,
+                            self.target, self.subspace)
+
+
+
 class TestInnerProduct(CustomAssertions):
     def test_inner_product(self):
         result = floq.linalg.inner(v1, u1, v2)
         self.assertAlmostEqualWithDecimals(result, -0.362492 - 0.013523j, 4)
 
+    def test_column_kets(self):
+        result = floq.linalg.inner(v1[:, None], u1, v2[:, None])
+        self.assertEqual(result.shape, (1, 1))
+        self.assertAlmostEqualWithDecimals(result[0, 0],
+                                           -0.362492 - 0.013523j, 4)
+
 
 
 class TestHSProduct(CustomAssertions):
@@ -0,0 +1,89 @@
+import unittest
+import numpy as np
+import floq
+
+
+def _hamiltonian(controls):
+    drive = np.array([[0.1, controls[0]], [0.3*controls[0], -0.2]])
+    return {-1: np.conj(drive.T).copy(),
+            0: np.array([[1.1, 0.2*controls[1]], [0.2*controls[1], -0.7]]),
+            1: drive, 2: 0.05*np.eye(2), -2: 0.05*np.eye(2)}
+
+def _dhamiltonian(controls):
+    drive = np.array([[0, 1], [0.3, 0]])
+    return [{-1: np.conj(drive.T).copy(), 1: drive},
+            {0: np.array([[0, 0.2], [0.2, 0]])}]
+
+
+class TestMonodromySystem(unittest.TestCase):
+    def setUp(self):
+        self.controls = np.array([0.6, -0.3])
+        self.floquet = floq.System(_hamiltonian, _dhamiltonian, n_zones=41,
+                                   frequency=2.5, sparse=False)
+        self.monodromy = floq.MonodromySystem(_hamiltonian, _dhamiltonian,
+                                              n_zones=41, frequency=2.5)
+
+    def test_matches_floquet(self):
+        for t in (0.4, 1.9, 7.3, -2.2):
+            for method in ('u', 'du_dt', 'du_dcontrols'):
+                expected = getattr(self.floquet, method)(t, self.controls)
+                out = getattr(self.monodromy, method)(t, self.controls)
+                self.assertTrue(np.allclose(out, expected, atol=1e-7),
+                                msg=f"{method} at t={t}")
+
+    def test_unitary(self):
+        u = self.monodromy.u(11.0, self.controls)
+        self.assertTrue(np.allclose(u @ np.conj(u.T), np.eye(2), atol=1e-12))
+
+    def test_eigensystem(self):
+        expected = self.floquet.eigensystem(self.controls)
+        eigensystem = self.monodromy.eigensystem(self.controls)
+        self.assertTrue(np.allclose(eigensystem.quasienergies,
+                                    expected.quasienergies, atol=1e-7))
+        self.assertEqual(eigensystem.k_eigenvectors.shape,
+                         expected.k_eigenvectors.shape)
+        self.assertTrue(np.allclose(floq.evolution.u(eigensystem, 1.3),
+                                    self.floquet.u(1.3, self.controls),
+                                    atol=1e-7))
+
+    def test_hermitian(self):
+        def half(controls):
+            return {m: b for m, b in _hamiltonian(controls).items() if m >= 0}
+        def dhalf(controls):
+            return [{m: b for m, b in dh.items() if m >= 0}
+                    for dh in _dhamiltonian(controls)]
+        system = floq.MonodromySystem(half, dhalf, n_zones=41, frequency=2.5,
+                                      hermitian=True)
+        self.assertTrue(np.allclose(system.du_dcontrols(3.1, self.controls),
+                                    self.floquet.du_dcontrols(3.1,
+                                                              self.controls),
+                                    atol=1e-7))
+
+    def test_fourth_order(self):
+        errors = []
+        for n_steps in (16, 32):
+            system = floq.MonodromySystem(_hamiltonian, n_zones=15,
+                                          frequency=2.5, n_steps=n_steps)
+            errors.append(np.max(np.abs(system.u(2.0, self.controls)
+                                        - self.floquet.u(2.0, self.controls))))
+        self.assertGreater(errors[0] / errors[1], 12)
+
+    def test_batch(self):
+        batch = np.array([self.controls, [0.2, 0.5]])
+        expected = self.floquet.du_dcontrols_batch(1.7, batch)
+        self.assertTrue(np.allclose(self.monodromy.du_dcontrols_batch(1.7,
+                                                                      batch),
+                                    expected, atol=1e-7))
+        eigensystems = self.monodromy.eigensystem_batch(batch)
+        self.assertIsInstance(eigensystems[0], floq.types.Eigensystem)
+
+    def test_error_too_few_steps(self):
+        system = floq.MonodromySystem(_hamiltonian, n_zones=41, frequency=2.5,
+                                      n_steps=32)
+        with self.assertRaises(ValueError):
+            system.eigensystem(self.controls)
+
+    def test_error_without_derivatives(self):
+        system = floq.MonodromySystem(_hamiltonian, frequency=2.5)
+        with self.assertRaises(ValueError):
+            system.du_dcontrols(1.0, self.controls)
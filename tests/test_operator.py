@@ -0,0 +1,319 @@
+import unittest
+import unittest.mock
+from tests.assertions import CustomAssertions
+import numpy as np
+import scipy.sparse
+import floq
+from floq.operator import FloquetOperator, davidson
+from floq.operator import _orthonormal_ritz_vectors
+
+
+def _random_hamiltonian(dimension, seed):
+    random = np.random.RandomState(seed)
+    def block():
+        return random.normal(size=(dimension, dimension))\
+               + 1j*random.normal(size=(dimension, dimension))
+    h0 = block()
+    h1, h2 = 0.3*block(), 0.1*block()
+    return {-2: np.conj(h2.T).copy(), -1: np.conj(h1.T).copy(),
+            0: h0 + np.conj(h0.T), 1: h1, 2: h2}
+
+
+class TestFloquetOperator(CustomAssertions):
+    def setUp(self):
+        self.hamiltonian = floq.system._canonicalise_operator(
+            _random_hamiltonian(4, 1))
+        self.k = floq.evolution.assemble_k(self.hamiltonian, 9, 6.0)
+        self.vectors = np.random.RandomState(2).normal(size=(36, 3))
+
+    def test_matmat(self):
+        operator = FloquetOperator(self.hamiltonian, 9, 6.0)
+        self.assertArrayEqual(operator @ self.vectors, self.k @ self.vectors,
+                              decimals=10)
+
+    def test_matvec(self):
+        operator = FloquetOperator(self.hamiltonian, 9, 6.0)
+        self.assertArrayEqual(operator @ self.vectors[:, 0],
+                              self.k @ self.vectors[:, 0], decimals=10)
+
+    def test_sparse_blocks(self):
+        hamiltonian = floq.types.TransformedMatrix(
+            self.hamiltonian.mode,
+            tuple(scipy.sparse.csr_matrix(m) for m in self.hamiltonian.matrix))
+        operator = FloquetOperator(hamiltonian, 9, 6.0)
+        self.assertArrayEqual(operator @ self.vectors, self.k @ self.vectors,
+                              decimals=10)
+
+    def test_hermitian(self):
+        half = floq.types.TransformedMatrix(self.hamiltonian.mode[2:],
+                                            self.hamiltonian.matrix[2:])
+        operator = FloquetOperator(half, 9, 6.0, hermitian=True)
+        self.assertArrayEqual(operator @ self.vectors, self.k @ self.vectors,
+                              decimals=10)
+
+    def test_adjoint(self):
+        random = np.random.RandomState(3)
+        blocks = {m: random.normal(size=(4, 4)) + 1j*random.normal(size=(4, 4))
+                  for m in (-1, 0, 2)}
+        hamiltonian = floq.system._canonicalise_operator(blocks)
+        k = floq.evolution.assemble_k(hamiltonian, 9, 6.0)
+        for sparse in (False, True):
+            if sparse:
+                hamiltonian = floq.types.TransformedMatrix(
+                    hamiltonian.mode,
+                    tuple(scipy.sparse.csr_matrix(m)
+                          for m in hamiltonian.matrix))
+            operator = FloquetOperator(hamiltonian, 9, 6.0)
+            self.assertArrayEqual(operator.H @ self.vectors,
+                                  np.conj(k.T) @ self.vectors, decimals=10)
+            self.assertArrayEqual(operator.rmatvec(self.vectors[:, 0]),
+                                  np.conj(k.T) @ self.vectors[:, 0],
+                                  decimals=10)
+
+    def test_preconditioner_exact_for_block_diagonal(self):
+        diagonal = floq.types.TransformedMatrix((0,),
+                                                (self.hamiltonian.matrix[2],))
+        operator = FloquetOperator(diagonal, 9, 6.0)
+        k = floq.evolution.assemble_k(diagonal, 9, 6.0)
+        inverse = operator.preconditioner(0.5, floor=0.0)
+        expected = np.linalg.solve(k - 0.5*np.eye(36), self.vectors)
+        self.assertArrayEqual(inverse @ self.vectors, expected, decimals=10)
+
+    def test_preconditioner_non_hermitian(self):
+        random = np.random.RandomState(4)
+        block = random.normal(size=(4, 4)) + 1j*random.normal(size=(4, 4))
+        diagonal = floq.types.TransformedMatrix((0,), (block,))
+        operator = FloquetOperator(diagonal, 9, 6.0)
+        k = floq.evolution.assemble_k(diagonal, 9, 6.0)
+        inverse = operator.preconditioner(0.5, floor=0.0)
+        expected = np.linalg.solve(k - 0.5*np.eye(36), self.vectors)
+        self.assertArrayEqual(inverse @ self.vectors, expected, decimals=10)
+
+    def test_shift_invert(self):
+        operator = FloquetOperator(self.hamiltonian, 9, 6.0)
+        expected = np.linalg.solve(self.k - 0.3*np.eye(36), self.vectors[:, 0])
+        self.assertArrayEqual(operator.shift_invert(0.3) @ self.vectors[:, 0],
+                              expected, decimals=8)
+
+    def test_block_diagonal_solve_per_column_shifts(self):
+        operator = FloquetOperator(self.hamiltonian, 9, 6.0)
+        shifts = np.array([0.5, -1.0, 2.0])
+        out = operator.block_diagonal_solve(self.vectors, shifts, floor=0.0)
+        for column, shift in enumerate(shifts):
+            expected = operator.preconditioner(shift, floor=0.0)\
+                       @ self.vectors[:, column]
+            self.assertArrayEqual(out[:, column], expected, decimals=10)
+
+
+class TestTridiagonal(CustomAssertions):
+    def setUp(self):
+        blocks = _random_hamiltonian(5, 6)
+        self.blocks = {mode: blocks[mode] for mode in (-1, 0, 1)}
+        self.hamiltonian = floq.system._canonicalise_operator(self.blocks)
+        self.k = floq.evolution.assemble_k(self.hamiltonian, 9, 6.0)
+        self.vectors = np.random.RandomState(7).normal(size=(45, 3))
+
+    def test_tridiagonal(self):
+        self.assertTrue(FloquetOperator(self.hamiltonian, 9, 6.0).tridiagonal)
+        wide = floq.system._canonicalise_operator(_random_hamiltonian(5, 6))
+        self.assertFalse(FloquetOperator(wide, 9, 6.0).tridiagonal)
+        with self.assertRaises(ValueError):
+            FloquetOperator(wide, 9, 6.0).tridiagonal_inverse()
+
+    def test_inverse_exact(self):
+        operator = FloquetOperator(self.hamiltonian, 9, 6.0)
+        expected = np.linalg.solve(self.k - 0.4*np.eye(45), self.vectors)
+        self.assertArrayEqual(operator.tridiagonal_inverse(0.4) @ self.vectors,
+                              expected, decimals=10)
+        self.assertArrayEqual(operator.shift_invert(0.4) @ self.vectors[:, 0],
+                              expected[:, 0], decimals=10)
+
+    def test_hermitian_and_sparse_blocks(self):
+        half = floq.types.TransformedMatrix(
+            (0, 1), tuple(scipy.sparse.csr_matrix(self.blocks[m])
+                          for m in (0, 1)))
+        operator = FloquetOperator(half, 9, 6.0, hermitian=True)
+        expected = np.linalg.solve(self.k, self.vectors)
+        self.assertArrayEqual(operator.tridiagonal_inverse() @ self.vectors,
+                              expected, decimals=10)
+
+    def test_eigensystem_matches_general(self):
+        tridiagonal = floq.evolution.eigensystem(self.hamiltonian, None, 9,
+                                                 6.0, solver='tridiagonal')
+        for general in (floq.evolution.eigensystem(self.hamiltonian, None, 9,
+                                                   6.0, solver='general'),
+                        floq.evolution.eigensystem(self.hamiltonian, None, 9,
+                                                   6.0, sparse=False)):
+            self.assertArrayEqual(tridiagonal.quasienergies,
+                                  general.quasienergies, decimals=8)
+            self.assertArrayEqual(floq.evolution.u(tridiagonal, 0.8),
+                                  floq.evolution.u(general, 0.8), decimals=8)
+
+    def test_chosen_by_default(self):
+        with unittest.mock.patch.object(
+                FloquetOperator, 'tridiagonal_inverse', autospec=True,
+                side_effect=FloquetOperator.tridiagonal_inverse) as inverse:
+            default = floq.evolution.eigensystem(self.hamiltonian, None, 9,
+                                                 6.0)
+            inverse.assert_called()
+            inverse.reset_mock()
+            floq.evolution.eigensystem(self.hamiltonian, None, 9, 6.0,
+                                       solver='general')
+            inverse.assert_not_called()
+        general = floq.evolution.eigensystem(self.hamiltonian, None, 9, 6.0,
+                                             sparse=False)
+        self.assertArrayEqual(default.quasienergies, general.quasienergies,
+                              decimals=8)
+
+    def test_singular_leading_zones(self):
+        # Shift `H_0` so the leading five zones of `K` have an eigenvalue
+        # within 1e-9 of zero, while `K` itself is far from singular there.
+        # Elimination without pivoting breaks down on this.
+        leading = np.linalg.eigvalsh(self.k[:25, :25])
+        closest = leading[np.argmin(np.abs(leading))]
+        blocks = dict(self.blocks)
+        blocks[0] = self.blocks[0] + (1e-9 - closest)*np.eye(5)
+        hamiltonian = floq.system._canonicalise_operator(blocks)
+        operator = FloquetOperator(hamiltonian, 9, 6.0)
+        with unittest.mock.patch.object(
+                FloquetOperator, '_band_inverse', autospec=True,
+                side_effect=FloquetOperator._band_inverse) as fallback:
+            inverse = operator.tridiagonal_inverse()
+        fallback.assert_called_once()
+        self.assertArrayEqual(inverse @ self.vectors,
+                              np.linalg.solve(floq.evolution.assemble_k(
+                                  hamiltonian, 9, 6.0), self.vectors),
+                              decimals=6)
+        tridiagonal = floq.evolution.eigensystem(hamiltonian, None, 9, 6.0,
+                                                 solver='tridiagonal')
+        general = floq.evolution.eigensystem(hamiltonian, None, 9, 6.0,
+                                             sparse=False)
+        self.assertArrayEqual(tridiagonal.quasienergies,
+                              general.quasienergies, decimals=8)
+        self.assertArrayEqual(floq.evolution.u(tridiagonal, 0.8),
+                              floq.evolution.u(general, 0.8), decimals=8)
+
+    def test_error_on_wide_hamiltonian(self):
+        wide = floq.system._canonicalise_operator(_random_hamiltonian(5, 6))
+        with self.assertRaises(ValueError):
+            floq.evolution.eigensystem(wide, None, 9, 6.0,
+                                       solver='tridiagonal')
+
+
+class TestDavidson(CustomAssertions):
+    def setUp(self):
+        self.hamiltonian = floq.system._canonicalise_operator(
+            _random_hamiltonian(6, 3))
+        self.operator = FloquetOperator(self.hamiltonian, 15, 12.0)
+        self.k = floq.evolution.assemble_k(self.hamiltonian, 15, 12.0)
+
+    def _nearest_zero(self, n):
+        values = np.linalg.eigvalsh(self.k)
+        return np.sort(values[np.argsort(np.abs(values))[:n]])
+
+    def test_eigenvalues_nearest_zero(self):
+        values, _ = davidson(self.operator, 12)
+        self.assertArrayEqual(np.sort(values), self._nearest_zero(12),
+                              decimals=8)
+
+    def test_eigenvectors(self):
+        values, vectors = davidson(self.operator, 12)
+        self.assertArrayEqual(self.k @ vectors, vectors * values, decimals=8)
+        self.assertArrayEqual(np.conj(vectors.T) @ vectors, np.eye(12),
+                              decimals=8)
+
+    def test_degenerate_eigenvectors_match_values(self):
+        # Two uncoupled copies of the same system make every eigenvalue
+        # doubly degenerate.
+        blocks = _random_hamiltonian(3, 5)
+        doubled = floq.system._canonicalise_operator(
+            {m: np.kron(np.eye(2), b) for m, b in blocks.items()})
+        operator = FloquetOperator(doubled, 15, 12.0)
+        k = floq.evolution.assemble_k(doubled, 15, 12.0)
+        values, vectors = davidson(operator, 12)
+        self.assertEqual(vectors.shape, (k.shape[0], 12))
+        self.assertArrayEqual(k @ vectors, vectors * values, decimals=8)
+        self.assertArrayEqual(np.conj(vectors.T) @ vectors, np.eye(12),
+                              decimals=8)
+
+    def test_ritz_vectors_keep_their_columns(self):
+        vectors = np.linalg.qr(np.random.RandomState(8).normal(size=(10, 3))
+                               + 0j)[0] * np.array([1j, -1.0, 2.0])
+        vectors[:, 2] += 1e-9 * vectors[:, 0]
+        out = _orthonormal_ritz_vectors(vectors)
+        self.assertArrayEqual(out, vectors / np.array([1.0, 1.0, 2.0]),
+                              decimals=8)
+        with self.assertRaises(RuntimeError):
+            _orthonormal_ritz_vectors(vectors[:, [0, 1, 0]])
+
+    def test_guess(self):
+        _, vectors = davidson(self.operator, 12)
+        values, _ = davidson(self.operator, 12, guess=vectors)
+        self.assertArrayEqual(np.sort(values), self._nearest_zero(12),
+                              decimals=8)
+
+    def test_real(self):
+        real = {m: np.real(b).astype(np.complex128)
+                for m, b in _random_hamiltonian(6, 3).items()}
+        real[1] = real[-1] = 0.5*(real[1] + real[-1])
+        real[2] = real[-2] = 0.5*(real[2] + real[-2])
+        hamiltonian = floq.system._canonicalise_operator(real)
+        operator = FloquetOperator(hamiltonian, 15, 12.0, real=True)
+        k = floq.evolution.assemble_k(hamiltonian, 15, 12.0)
+        values, vectors = davidson(operator, 12)
+        self.assertFalse(np.iscomplexobj(vectors))
+        self.assertArrayEqual(k @ vectors, vectors * values, decimals=8)
+
+
+class TestMatrixFreeSystem(unittest.TestCase):
+    def setUp(self):
+        def hamiltonian(controls):
+            return {-1: np.array([[0, 0], [controls[0], 0]]),
+                    0: np.array([[1.2, 0.5*controls[1]],
+                                 [0.5*controls[1], 2.8]]),
+                    1: np.array([[0, controls[0]], [0, 0]])}
+        def dhamiltonian(controls):
+            return [{-1: np.array([[0, 0], [1, 0]]),
+                     1: np.array([[0, 1], [0, 0]])},
+                    {0: np.array([[0, 0.5], [0.5, 0]])}]
+        self.assembled = floq.System(hamiltonian, dhamiltonian, n_zones=11,
+                                     frequency=5.0, real=False)
+        self.matrix_free = floq.System(hamiltonian, dhamiltonian, n_zones=11,
+                                       frequency=5.0, real=False,
+                                       matrix_free=True)
+        self.controls = np.array([0.7, -0.4])
+
+    def test_u(self):
+        self.assertTrue(np.allclose(self.matrix_free.u(1.5, self.controls),
+                                    self.assembled.u(1.5, self.controls),
+                                    atol=1e-7))
+
+    def test_du_dcontrols(self):
+        self.assertTrue(np.allclose(
+            self.matrix_free.du_dcontrols(1.5, self.controls),
+            self.assembled.du_dcontrols(1.5, self.controls), atol=1e-7))
+
+    def test_real(self):
+        system = floq.System(self.assembled.hamiltonian,
+                             self.assembled.dhamiltonian, n_zones=11,
+                             frequency=5.0, real=True, matrix_free=True)
+        self.assertTrue(np.allclose(system.u(1.5, self.controls),
+                                    self.assembled.u(1.5, self.controls),
+                                    atol=1e-7))
+
+    def test_davidson(self):
+        system = floq.System(self.assembled.hamiltonian,
+                             self.assembled.dhamiltonian, n_zones=11,
+                             frequency=5.0, solver='davidson')
+        self.assertTrue(np.allclose(system.u(1.5, self.controls),
+                                    self.assembled.u(1.5, self.controls),
+                                    atol=1e-7))
+        self.assertTrue(np.allclose(
+            system.du_dcontrols(1.5, self.controls),
+            self.assembled.du_dcontrols(1.5, self.controls), atol=1e-7))
+
+    def test_error_unknown_solver(self):
+        system = floq.System(self.assembled.hamiltonian, n_zones=11,
+                             frequency=5.0, solver='lanczos')
+        with self.assertRaises(ValueError):
+            system.u(1.5, self.controls)
@@ -0,0 +1,97 @@
+import collections
+import concurrent.futures
+import unittest
+import unittest.mock
+import numpy as np
+import scipy.sparse
+import floq
+from floq.ordering import candidate_permutations, fill_reducing_ordering,\
+                          permute
+
+
+def _chain_hamiltonian(dimension, seed):
+    random = np.random.RandomState(seed)
+    h0 = scipy.sparse.diags([random.normal(size=dimension),
+                             np.ones(dimension - 1), np.ones(dimension - 1)],
+                            [0, 1, -1], format='csr').astype(np.complex128)
+    h1 = scipy.sparse.diags([0.3*random.normal(size=dimension)], [0],
+                            format='csr').astype(np.complex128)
+    return {-1: h1, 0: h0, 1: h1}
+
+
+class TestFillReducingOrdering(unittest.TestCase):
+    def setUp(self):
+        floq.ordering.clear_cache()
+        self.hamiltonian = floq.system._canonicalise_operator(
+            _chain_hamiltonian(12, 1))
+        self.k = floq.evolution.assemble_k_sparse(self.hamiltonian, 9, 5.0)
+
+    def test_candidates_are_permutations(self):
+        for permutation in candidate_permutations(self.k, 12).values():
+            self.assertTrue(np.array_equal(np.sort(permutation),
+                                           np.arange(self.k.shape[0])))
+
+    def test_permute(self):
+        permutation = candidate_permutations(self.k, 12)['interleaved']
+        dense = self.k.toarray()
+        self.assertTrue(np.array_equal(
+            permute(self.k, permutation).toarray(),
+            dense[permutation][:, permutation]))
+
+    def test_chooses_least_fill(self):
+        ordering = fill_reducing_ordering(self.k, 12)
+        self.assertEqual(ordering.fill,
+                         min(fill for fill, _ in ordering.trials.values()))
+        self.assertLessEqual(ordering.fill,
+                             ordering.trials['zone-major', 'COLAMD'][0])
+
+    def test_cached_per_pattern(self):
+        ordering = fill_reducing_ordering(self.k, 12)
+        scaled = floq.evolution.assemble_k_sparse(self.hamiltonian, 9, 7.0)
+        self.assertIs(fill_reducing_ordering(scaled, 12), ordering)
+        wider = floq.evolution.assemble_k_sparse(self.hamiltonian, 11, 5.0)
+        self.assertIsNot(fill_reducing_ordering(wider, 12), ordering)
+
+    def test_cache_locked(self):
+        class Guarded(collections.OrderedDict):
+            def __getitem__(self, key):
+                assert floq.ordering._cache_lock.locked()
+                return super().__getitem__(key)
+            def __setitem__(self, key, value):
+                assert floq.ordering._cache_lock.locked()
+                super().__setitem__(key, value)
+            def move_to_end(self, key, last=True):
+                assert floq.ordering._cache_lock.locked()
+                super().move_to_end(key, last)
+        ks = [floq.evolution.assemble_k_sparse(self.hamiltonian, n, 5.0)
+              for n in (3, 5, 7)]*4
+        with unittest.mock.patch.object(floq.ordering, '_cache', Guarded()),\
+             unittest.mock.patch.object(floq.ordering, '_CACHE_SIZE', 2),\
+             concurrent.futures.ThreadPoolExecutor(4) as pool:
+            orderings = list(pool.map(
+                lambda k: fill_reducing_ordering(k, 12), ks))
+            self.assertLessEqual(len(floq.ordering._cache), 2)
+        for k, ordering in zip(ks, orderings):
+            self.assertEqual(len(ordering.permutation), k.shape[0])
+
+    def test_eigensystem_matches_unordered(self):
+        expected = floq.evolution.eigensystem(self.hamiltonian, None, 9, 5.0)
+        reordered = floq.evolution.eigensystem(self.hamiltonian, None, 9, 5.0,
+                                               reorder=True)
+        self.assertTrue(np.allclose(reordered.quasienergies,
+                                    expected.quasienergies))
+        self.assertTrue(np.allclose(floq.evolution.u(reordered, 0.7),
+                                    floq.evolution.u(expected, 0.7),
+                                    atol=1e-7))
+
+    def test_system(self):
+        def hamiltonian(controls):
+            h = _chain_hamiltonian(12, 1)
+            h[0] = h[0] + controls[0]*scipy.sparse.identity(12)
+            return h
+        controls = np.array([0.3])
+        reordered = floq.System(hamiltonian, n_zones=9, frequency=5.0,
+                                reorder=True)
+        expected = floq.System(hamiltonian, n_zones=9, frequency=5.0)
+        self.assertTrue(np.allclose(reordered.u(1.2, controls),
+                                    expected.u(1.2, controls), atol=1e-7))
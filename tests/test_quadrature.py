@@ -0,0 +1,62 @@
+from unittest import TestCase
+from tests.assertions import CustomAssertions
+import functools
+import numpy as np
+import floq
+
+
+class TestGaussHermite(CustomAssertions):
+    def test_normalised(self):
+        _, weights = floq.quadrature.gauss_hermite(5, 1.0, 0.3)
+        self.assertAlmostEqual(np.sum(weights), 1.0)
+
+    def test_moments(self):
+        nodes, weights = floq.quadrature.gauss_hermite(4, 1.0, 0.5)
+        self.assertAlmostEqual(np.sum(weights * nodes), 1.0)
+        self.assertAlmostEqual(np.sum(weights * (nodes - 1.0)**2), 0.25)
+        self.assertAlmostEqual(np.sum(weights * (nodes - 1.0)**4),
+                               3 * 0.5**4)
+
+class TestGaussLegendre(CustomAssertions):
+    def test_moments(self):
+        nodes, weights = floq.quadrature.gauss_legendre(3, 0.0, 2.0)
+        self.assertAlmostEqual(np.sum(weights), 1.0)
+        self.assertAlmostEqual(np.sum(weights * nodes), 1.0)
+        # Mean of x^5 over the uniform distribution on [0, 2].
+        self.assertAlmostEqual(np.sum(weights * nodes**5), 2.0**5 / 6)
+
+class TestTensorProduct(CustomAssertions):
+    def test_shape_and_weights(self):
+        nodes, weights = floq.quadrature.tensor_product(
+            floq.quadrature.gauss_hermite(3),
+            floq.quadrature.gauss_legendre(4))
+        self.assertEqual(nodes.shape, (12, 2))
+        self.assertAlmostEqual(np.sum(weights), 1.0)
+        self.assertAlmostEqual(np.sum(weights * nodes[:, 0]**2
+                                      * nodes[:, 1]**2), 1.0 / 3)
+
+class TestSparseGrid(CustomAssertions):
+    def setUp(self):
+        self.rules = [functools.partial(floq.quadrature.gauss_hermite),
+                      functools.partial(floq.quadrature.gauss_legendre),
+                      functools.partial(floq.quadrature.gauss_hermite,
+                                        sigma=2.0)]
+
+    def test_level_zero_is_single_node(self):
+        nodes, weights = floq.quadrature.sparse_grid(self.rules, 0)
+        self.assertEqual(nodes.shape, (1, 3))
+        self.assertAlmostEqual(weights[0], 1.0)
+
+    def test_exact_for_total_degree(self):
+        nodes, weights = floq.quadrature.sparse_grid(self.rules, 2)
+        x, y, z = nodes.T
+        self.assertAlmostEqual(np.sum(weights), 1.0)
+        self.assertAlmostEqual(np.sum(weights * x**2 * y**2), 1.0 / 3)
+        self.assertAlmostEqual(np.sum(weights * z**4), 3 * 2.0**4)
+        self.assertAlmostEqual(np.sum(weights * x**2 * z**2), 4.0)
+
+    def test_fewer_nodes_than_tensor_in_high_dimension(self):
+        nodes, weights = floq.quadrature.sparse_grid(2 * self.rules, 2)
+        self.assertLess(nodes.shape[0], 3**6)
+        self.assertAlmostEqual(np.sum(weights * nodes[:, 0]**2
+                                      * nodes[:, 4]**2), 1.0 / 3)
@@ -0,0 +1,133 @@
+import functools
+from tests.assertions import CustomAssertions
+import numpy as np
+import floq
+import floq.optimization.fidelity as fid
+from floq.surrogate import (InterpolatedEnsemble, Surrogate, align,
+                            chebyshev_nodes)
+from . import rabi
+
+def _hamiltonian(detuning, controls):
+    return rabi.hf(controls[0], detuning, 2.8)
+
+def _dhamiltonian(detuning, controls):
+    return [rabi.hf(1.0, 0.0, 0.0)]
+
+def _system(detuning, frequency=2.0):
+    return floq.System(functools.partial(_hamiltonian, detuning),
+                       functools.partial(_dhamiltonian, detuning),
+                       n_zones=15, frequency=frequency)
+
+def _hermitian_system(detuning, frequency=2.0):
+    # The same Hamiltonian, given by only its modes >= 0.
+    return floq.System(lambda controls: _hamiltonian(detuning, controls)[1:],
+                       lambda controls: [dh[1:] for dh
+                                         in _dhamiltonian(detuning, controls)],
+                       n_zones=15, frequency=frequency, hermitian=True)
+
+
+class TestChebyshevNodes(CustomAssertions):
+    def test_range_and_order(self):
+        nodes = chebyshev_nodes(7, 1.0, 3.0)
+        self.assertTrue(np.all(np.diff(nodes) > 0))
+        self.assertTrue(np.all((nodes > 1.0) & (nodes < 3.0)))
+        self.assertAlmostEqual(np.mean(nodes), 2.0)
+
+
+class TestAlign(CustomAssertions):
+    def setUp(self):
+        self.eigensystem = _system(0.3).eigensystem(np.array([0.5]))
+
+    def test_undoes_permutation_phase_and_zone_shift(self):
+        energies = self.eigensystem.quasienergies
+        vectors = self.eigensystem.k_eigenvectors
+        scrambled_energies = energies[::-1] - np.array([2.0, 0.0])
+        scrambled_vectors = np.array([np.exp(0.4j) * np.roll(vectors[1], -1,
+                                                             axis=0),
+                                      np.exp(-1.1j) * vectors[0]])
+        out_energies, out_vectors = align(vectors, scrambled_energies,
+                                          scrambled_vectors, 2.0)
+        self.assertArrayEqual(out_energies, energies)
+        # Only the truncated zone at the edge of the roll may differ.
+        self.assertArrayEqual(out_vectors[:, 1:-1], vectors[:, 1:-1])
+
+
+class TestSurrogate(CustomAssertions):
+    def setUp(self):
+        self.controls = np.array([0.5])
+        self.t = 3.0
+
+    def test_exact_at_nodes(self):
+        surrogate = Surrogate(_system, -1.0, 1.0, 6)
+        node = surrogate.nodes[2]
+        system = floq.surrogate.SurrogateSystem(surrogate, node, _system(node))
+        self.assertArrayEqual(system.u(self.t, self.controls),
+                              _system(node).u(self.t, self.controls))
+
+    def test_interpolates_across_zone_edges(self):
+        # Over this range the quasienergies cross the edge of the first zone.
+        ensemble = InterpolatedEnsemble(_system, np.linspace(-2.0, 2.0, 9),
+                                        n_nodes=24)
+        for parameter, system in zip(ensemble.parameters, ensemble.systems):
+            exact = _system(parameter)
+            self.assertArrayEqual(system.u(self.t, self.controls),
+                                  exact.u(self.t, self.controls), 4)
+            self.assertArrayEqual(system.du_dcontrols(self.t, self.controls),
+                                  exact.du_dcontrols(self.t, self.controls), 4)
+
+    def test_hermitian_systems(self):
+        ensemble = InterpolatedEnsemble(_hermitian_system,
+                                        np.linspace(-1.0, 1.0, 3), n_nodes=12)
+        full = InterpolatedEnsemble(_system, np.linspace(-1.0, 1.0, 3),
+                                    n_nodes=12)
+        for hermitian, system in zip(ensemble.systems, full.systems):
+            self.assertArrayEqual(
+                hermitian.du_dcontrols(self.t, self.controls),
+                system.du_dcontrols(self.t, self.controls), 8)
+
+    def test_error_estimate_bounds_error(self):
+        ensemble = InterpolatedEnsemble(_system, np.linspace(-2.0, 2.0, 9),
+                                        n_nodes=12)
+        estimate = ensemble.systems[0].error_estimate(self.t, self.controls)
+        error = max(np.max(np.abs(system.u(self.t, self.controls)
+                                  - _system(p).u(self.t, self.controls)))
+                    for p, system in zip(ensemble.parameters,
+                                         ensemble.systems))
+        self.assertLess(error, estimate)
+
+    def test_nodes_only_solved_once_per_control(self):
+        ensemble = InterpolatedEnsemble(_system, np.linspace(0.8, 1.6, 5),
+                                        n_nodes=6)
+        for system in ensemble.systems:
+            system.u(self.t, self.controls)
+        first = ensemble.surrogate._k_eigenvectors
+        for system in ensemble.systems:
+            system.du_dcontrols(self.t, self.controls)
+        self.assertIs(ensemble.surrogate._k_eigenvectors, first)
+
+    def test_outside_range(self):
+        surrogate = Surrogate(_system, -1.0, 1.0, 4)
+        with self.assertRaises(ValueError):
+            surrogate.eigenpairs(1.5, self.controls)
+
+    def test_ensemble_fidelity(self):
+        parameters = np.linspace(0.8, 1.6, 7)
+        target = _system(1.2).u(self.t, np.array([0.7]))
+        interpolated = InterpolatedEnsemble(_system, parameters, n_nodes=8)
+        exact = ExactEnsemble(parameters)
+        a = fid.EnsembleFidelity(interpolated, fid.OperatorDistance,
+                                 t=self.t, target=target)
+        b = fid.EnsembleFidelity(exact, fid.OperatorDistance, t=self.t,
+                                 target=target)
+        self.assertAlmostEqualWithDecimals(a.f(self.controls),
+                                           b.f(self.controls), 6)
+        self.assertArrayEqual(a.df(self.controls), b.df(self.controls), 6)
+
+
+class ExactEnsemble(floq.system.EnsembleBase):
+    def __init__(self, parameters):
+        self._systems = [_system(p) for p in parameters]
+
+    @property
+    def systems(self):
+        return self._systems
@@ -0,0 +1,81 @@
+import tempfile
+from tests.assertions import CustomAssertions
+import numpy as np
+import floq
+from floq.sweep import Sweep
+from . import rabi
+
+class DetunedRabi:
+    """Picklable Hamiltonian whose argument is the first-level energy."""
+    def __call__(self, e1, g=0.5):
+        return rabi.hf(g, e1, 2.8)
+
+def _system():
+    return floq.System(DetunedRabi(), None, n_zones=15, frequency=2.0)
+
+
+class TestSweep(CustomAssertions):
+    def setUp(self):
+        # The quasienergies fold through the edges of the first zone several
+        # times over this range.
+        self.grid = np.linspace(-3.0, 3.0, 41)
+
+    def test_quasienergies_match_system(self):
+        sweep = Sweep(_system(), self.grid, times=[1.3], chunk_size=6).run()
+        self.assertTrue(sweep.complete)
+        for i in (0, 17, 40):
+            eigensystem = _system().eigensystem(self.grid[i])
+            self.assertArrayEqual(sweep.quasienergies[i],
+                                  eigensystem.quasienergies)
+            self.assertArrayEqual(sweep.u[i, 0],
+                                  floq.evolution.u(eigensystem, 1.3))
+
+    def test_branches_are_continuous_and_fold_to_quasienergies(self):
+        sweep = Sweep(_system(), self.grid, chunk_size=6).run()
+        steps = np.abs(np.diff(sweep.branches, axis=0))
+        self.assertLess(np.max(steps), 0.2)
+        folded = np.sort(np.mod(sweep.branches + 1.0, 2.0) - 1.0, axis=1)
+        self.assertArrayEqual(folded, sweep.quasienergies)
+        self.assertGreater(np.ptp(sweep.branches), 2.0)
+
+    def test_chunks_are_stitched(self):
+        one = Sweep(_system(), self.grid, chunk_size=100).run()
+        many = Sweep(_system(), self.grid, chunk_size=3).run()
+        self.assertArrayEqual(one.branches, many.branches)
+
+    def test_unordered_grid(self):
+        ordered = Sweep(_system(), self.grid, chunk_size=5).run()
+        shuffle = np.random.RandomState(3).permutation(self.grid.shape[0])
+        unordered = Sweep(_system(), self.grid[shuffle], chunk_size=5).run()
+        self.assertArrayEqual(unordered.quasienergies,
+                              ordered.quasienergies[shuffle])
+        self.assertArrayEqual(unordered.branches, ordered.branches[shuffle])
+
+    def test_kwargs_passed_to_hamiltonian(self):
+        sweep = Sweep(_system(), self.grid[:4], kwargs={'g': 0.1}).run()
+        expected = floq.System(DetunedRabi(), None, n_zones=15,
+                               frequency=2.0).eigensystem(self.grid[2], g=0.1)
+        self.assertArrayEqual(sweep.quasienergies[2], expected.quasienergies)
+
+    def test_memory_mapped_resume(self):
+        full = Sweep(_system(), self.grid, chunk_size=5).run()
+        with tempfile.TemporaryDirectory() as path:
+            first = Sweep(_system(), self.grid, path=path, chunk_size=5).run()
+            # Simulate an interruption after the first three chunks.
+            unfinished = first.order[15:]
+            first.done[unfinished] = False
+            first.branches[unfinished] = np.nan
+            first.done.flush()
+            first.branches.flush()
+            del first
+            resumed = Sweep(_system(), self.grid, path=path, chunk_size=5)
+            self.assertEqual(np.count_nonzero(resumed.done), 15)
+            resumed.run()
+            self.assertTrue(resumed.complete)
+            self.assertArrayEqual(resumed.branches, full.branches)
+
+    def test_different_grid_in_path(self):
+        with tempfile.TemporaryDirectory() as path:
+            Sweep(_system(), self.grid, path=path).run()
+            with self.assertRaises(ValueError):
+                Sweep(_system(), self.grid[:-1], path=path)
@@ -1,6 +1,8 @@
 import unittest
+import unittest.mock
 from tests.assertions import CustomAssertions
 import numpy as np
+import scipy.sparse
 import floq
 
 def transformed_matrix_equal(a, b):
@@ -91,3 +93,348 @@ class TestCanonicalOperatorForm(unittest.TestCase):
     def test_error_invalid_input(self):
         with self.assertRaises(TypeError):
             floq.system._canonicalise_operator("hello, world")
+
+
+class TestContinuationOrder(unittest.TestCase):
+    def test_1d_is_sorted(self):
+        parameters = np.array([0.3, -1.0, 2.0, 0.1])
+        order = floq.system.continuation_order(parameters)
+        self.assertTrue(np.array_equal(order, [1, 3, 0, 2]))
+
+    def test_2d_is_permutation(self):
+        parameters = np.random.RandomState(1).normal(size=(10, 2))
+        order = floq.system.continuation_order(parameters)
+        self.assertTrue(np.array_equal(np.sort(order), np.arange(10)))
+
+    def test_2d_walks_grid_neighbours(self):
+        # On a regular grid every step of the path should be to an adjacent
+        # point (scaled distance of one grid spacing).
+        x, y = np.meshgrid(np.arange(3.0), 10.0*np.arange(3.0))
+        parameters = np.column_stack((x.ravel(), y.ravel()))
+        order = floq.system.continuation_order(parameters)
+        scaled = parameters / np.ptp(parameters, axis=0)
+        steps = np.linalg.norm(np.diff(scaled[order], axis=0), axis=1)
+        self.assertTrue(np.allclose(steps, 0.5))
+
+
+class TestWarmStart(unittest.TestCase):
+    def setUp(self):
+        def hamiltonian(controls):
+            g = controls[0]
+            return np.array([[[0, 0], [g, 0]],
+                             [[1.2, 0], [0, 2.8]],
+                             [[0, g], [0, 0]]], dtype=np.complex128)
+        self.system = floq.System(hamiltonian, None, n_zones=11, frequency=5.0)
+        self.neighbour = floq.System(hamiltonian, None, n_zones=11,
+                                     frequency=5.0)
+
+    def test_warm_start_gives_same_u(self):
+        cold = self.system.u(1.5, np.array([0.5]))
+        guess = self.neighbour.eigensystem(np.array([0.51]))
+        warm_system = floq.System(self.system.hamiltonian, None, n_zones=11,
+                                  frequency=5.0)
+        warm_system.warm_start(guess)
+        warm = warm_system.u(1.5, np.array([0.5]))
+        self.assertTrue(np.allclose(cold, warm, atol=1e-8))
+
+    def test_eigensystem_is_cached(self):
+        first = self.system.eigensystem(np.array([0.5]))
+        second = self.system.eigensystem(np.array([0.5]))
+        self.assertIs(first, second)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        def hamiltonian(controls, e2=2.8):
+            return np.array([[[0, 0], [controls[0], 0]],
+                             [[controls[1], 0], [0, e2]],
+                             [[0, controls[0]], [0, 0]]],
+                            dtype=np.complex128)
+        def dhamiltonian(controls, e2=2.8):
+            return [np.array([[[0, 0], [1, 0]], [[0, 0], [0, 0]],
+                              [[0, 1], [0, 0]]], dtype=np.complex128),
+                    np.array([[[0, 0], [0, 0]], [[1, 0], [0, 0]],
+                              [[0, 0], [0, 0]]], dtype=np.complex128)]
+        self.system = floq.System(hamiltonian, dhamiltonian, n_zones=11,
+                                  frequency=5.0)
+        self.batch = np.random.RandomState(2).uniform(0.2, 1.5, size=(7, 2))
+
+    def test_u_batch_matches_single(self):
+        us = self.system.u_batch(1.5, self.batch, threads=3)
+        self.assertEqual(us.shape, (7, 2, 2))
+        for row, u in zip(self.batch, us):
+            self.assertTrue(np.allclose(u, self.system.u(1.5, row), atol=1e-7))
+
+    def test_du_dcontrols_batch_matches_single(self):
+        dus = self.system.du_dcontrols_batch(1.5, self.batch, e2=2.5)
+        self.assertEqual(dus.shape, (7, 2, 2, 2))
+        for row, du in zip(self.batch, dus):
+            self.assertTrue(np.allclose(du, self.system.du_dcontrols(
+                1.5, row, e2=2.5), atol=1e-7))
+
+    def test_cache_untouched(self):
+        controls = np.array([0.5, 1.2])
+        u = self.system.u(1.5, controls)
+        eigensystem = self.system.eigensystem(controls)
+        self.system.u_batch(1.5, self.batch)
+        self.assertIs(self.system.eigensystem(controls), eigensystem)
+
+    def test_threads_leave_zones_alone(self):
+        # Controls above 1 switch on a second harmonic, which needs more zones
+        # than the first row does.
+        def hamiltonian(controls):
+            blocks = {-1: np.array([[0, 0], [0.3, 0]]),
+                      0: np.diag([1.2, 2.8]),
+                      1: np.array([[0, 0.3], [0, 0]])}
+            if controls[0] > 1:
+                blocks[-2] = np.array([[0, 0], [0.1, 0]])
+                blocks[2] = np.array([[0, 0.1], [0, 0]])
+            return {m: b.astype(np.complex128) for m, b in blocks.items()}
+        system = floq.System(hamiltonian, None, n_zones=3, frequency=5.0)
+        batch = np.array([[0.5], [0.5], [1.5], [1.5]])
+        with unittest.mock.patch.object(floq.System, '_fit_zones',
+                                        autospec=True,
+                                        side_effect=floq.System._fit_zones)\
+             as fit:
+            eigensystems = system.eigensystem_batch(batch, threads=2)
+        self.assertEqual(fit.call_count, 1)
+        self.assertEqual(system.n_zones, 3)
+        self.assertEqual([e.k_eigenvectors.shape[1] for e in eigensystems],
+                         [3, 3, 5, 5])
+
+    def test_error_not_2d(self):
+        with self.assertRaises(ValueError):
+            self.system.u_batch(1.5, self.batch[0])
+
+
+class TestLinearSystem(unittest.TestCase):
+    def setUp(self):
+        h0 = {0: np.array([[1.2, 0], [0, 2.8]], dtype=np.complex128)}
+        hs = [{-1: np.array([[0, 0], [1, 0]], dtype=np.complex128),
+               1: np.array([[0, 1], [0, 0]], dtype=np.complex128)},
+              {0: np.array([[0, 0.5], [0.5, 0]], dtype=np.complex128)}]
+        def hamiltonian(controls):
+            return np.array([[[0, 0], [controls[0], 0]],
+                             [[1.2, 0.5*controls[1]], [0.5*controls[1], 2.8]],
+                             [[0, controls[0]], [0, 0]]],
+                            dtype=np.complex128)
+        dhamiltonian = [np.array([[[0, 0], [1, 0]], [[0, 0], [0, 0]],
+                                  [[0, 1], [0, 0]]], dtype=np.complex128),
+                        np.array([[[0, 0], [0, 0]], [[0, 0.5], [0.5, 0]],
+                                  [[0, 0], [0, 0]]], dtype=np.complex128)]
+        self.reference = floq.System(hamiltonian, dhamiltonian, n_zones=11,
+                                     frequency=5.0)
+        self.sparse = floq.LinearSystem(h0, hs, n_zones=11, frequency=5.0)
+        self.dense = floq.LinearSystem(h0, hs, n_zones=11, frequency=5.0,
+                                       sparse=False)
+        self.controls = np.array([0.7, -0.4])
+
+    def test_floquet_matrix_matches_assembly(self):
+        hamiltonian = floq.system._canonicalise_operator(
+            self.reference.hamiltonian(self.controls))
+        expected = floq.evolution.assemble_k(hamiltonian, 11, 5.0)
+        self.assertTrue(np.allclose(self.sparse.k(self.controls).toarray(),
+                                    expected))
+        self.assertTrue(np.allclose(self.dense.k(self.controls), expected))
+
+    def test_u_matches_system(self):
+        expected = self.reference.u(1.5, self.controls)
+        for system in (self.sparse, self.dense):
+            self.assertTrue(np.allclose(system.u(1.5, self.controls), expected,
+                                        atol=1e-7))
+
+    def test_du_dcontrols_matches_system(self):
+        expected = self.reference.du_dcontrols(1.5, self.controls)
+        for system in (self.sparse, self.dense):
+            self.assertTrue(np.allclose(system.du_dcontrols(1.5, self.controls),
+                                        expected, atol=1e-7))
+
+    def test_d2u_dcontrols_matches_differences(self):
+        # With little rounding of the quasienergies, Richardson-extrapolated
+        # differences of the first derivatives are a precise reference.
+        h0 = {0: np.array([[1.2, 0], [0, 2.8]], dtype=np.complex128)}
+        system = floq.LinearSystem(h0, self.sparse.hs, n_zones=21,
+                                   frequency=5.0, decimals=13)
+        def differences(step):
+            return np.array([(system.du_dcontrols(1.5, self.controls + d)
+                              - system.du_dcontrols(1.5, self.controls - d))
+                             / (2*step) for d in step*np.eye(2)])
+        expected = (4*differences(5e-4) - differences(1e-3)) / 3
+        self.assertTrue(np.allclose(system.d2u_dcontrols(1.5, self.controls),
+                                    expected, atol=1e-9))
+
+    def test_n_zones_fits_modes(self):
+        system = floq.LinearSystem(np.eye(2)[np.newaxis], [{3: np.eye(2)}])
+        self.assertEqual(system.n_zones, 7)
+
+    def test_error_wrong_number_of_controls(self):
+        with self.assertRaises(ValueError):
+            self.sparse.u(1.5, np.array([0.7]))
+
+    def test_error_extra_arguments(self):
+        with self.assertRaises(TypeError):
+            self.sparse.u(1.5, self.controls, 2.0)
+        with self.assertRaises(TypeError):
+            self.sparse.u(1.5, self.controls, scale=2.0)
+        with self.assertRaises(TypeError):
+            self.dense.u(1.5)
+
+
+class TestSparseBlocks(unittest.TestCase):
+    def setUp(self):
+        def hamiltonian(controls, sparse):
+            blocks = {-1: np.array([[0, 0], [controls[0], 0]]),
+                      0: np.array([[1.2, 0.5*controls[1]],
+                                   [0.5*controls[1], 2.8]]),
+                      1: np.array([[0, controls[0]], [0, 0]])}
+            convert = scipy.sparse.csr_matrix if sparse else np.asarray
+            return {mode: convert(matrix.astype(np.complex128))
+                    for mode, matrix in blocks.items()}
+        def dhamiltonian(controls, sparse):
+            convert = scipy.sparse.csr_matrix if sparse else np.asarray
+            return [{-1: convert(np.array([[0, 0], [1, 0]], dtype=complex)),
+                     1: convert(np.array([[0, 1], [0, 0]], dtype=complex))},
+                    {0: convert(np.array([[0, 0.5], [0.5, 0]], dtype=complex))}]
+        self.system = floq.System(hamiltonian, dhamiltonian, n_zones=11,
+                                  frequency=5.0)
+        self.controls = np.array([0.7, -0.4])
+
+    def test_u_matches_dense(self):
+        self.assertTrue(np.allclose(self.system.u(1.5, self.controls, True),
+                                    self.system.u(1.5, self.controls, False),
+                                    atol=1e-7))
+
+    def test_du_dcontrols_matches_dense(self):
+        sparse = self.system.du_dcontrols(1.5, self.controls, True)
+        dense = self.system.du_dcontrols(1.5, self.controls, False)
+        self.assertTrue(np.allclose(sparse, dense, atol=1e-7))
+
+    def test_linear_system(self):
+        h0 = {0: scipy.sparse.diags([1.2, 2.8]).astype(np.complex128)}
+        hs = self.system.dhamiltonian(self.controls, True)
+        linear = floq.LinearSystem(h0, hs, n_zones=11, frequency=5.0)
+        self.assertTrue(np.allclose(linear.u(1.5, self.controls),
+                                    self.system.u(1.5, self.controls, False),
+                                    atol=1e-7))
+
+
+class TestHermitian(unittest.TestCase):
+    def setUp(self):
+        def hamiltonian(controls):
+            return np.array([[[0, 0], [controls[0], 0]],
+                             [[1.2, 0.5*controls[1]], [0.5*controls[1], 2.8]],
+                             [[0, controls[0]], [0, 0]]], dtype=np.complex128)
+        def dhamiltonian(controls):
+            return [np.array([[[0, 0], [1, 0]], [[0, 0], [0, 0]],
+                              [[0, 1], [0, 0]]], dtype=np.complex128),
+                    np.array([[[0, 0], [0, 0]], [[0, 0.5], [0.5, 0]],
+                              [[0, 0], [0, 0]]], dtype=np.complex128)]
+        self.full = floq.System(hamiltonian, dhamiltonian, n_zones=11,
+                                frequency=5.0)
+        self.half = floq.System(lambda c: hamiltonian(c)[1:],
+                                lambda c: [d[1:] for d in dhamiltonian(c)],
+                                n_zones=11, frequency=5.0, hermitian=True)
+        self.controls = np.array([0.7, -0.4])
+
+    def test_u_matches_full(self):
+        self.assertTrue(np.allclose(self.half.u(1.5, self.controls),
+                                    self.full.u(1.5, self.controls),
+                                    atol=1e-7))
+
+    def test_du_dcontrols_matches_full(self):
+        self.assertTrue(np.allclose(self.half.du_dcontrols(1.5, self.controls),
+                                    self.full.du_dcontrols(1.5, self.controls),
+                                    atol=1e-7))
+
+    def test_linear_system(self):
+        h0 = {0: np.diag([1.2, 2.8]).astype(np.complex128)}
+        hs = [{1: np.array([[0, 1], [0, 0]], dtype=np.complex128)},
+              {0: np.array([[0, 0.5], [0.5, 0]], dtype=np.complex128)}]
+        linear = floq.LinearSystem(h0, hs, n_zones=11, frequency=5.0,
+                                   hermitian=True)
+        self.assertTrue(np.allclose(linear.u(1.5, self.controls),
+                                    self.full.u(1.5, self.controls),
+                                    atol=1e-7))
+        self.assertTrue(np.allclose(linear.du_dcontrols(1.5, self.controls),
+                                    self.full.du_dcontrols(1.5, self.controls),
+                                    atol=1e-7))
+
+    def test_d2u_dcontrols_matches_full(self):
+        self.assertTrue(np.allclose(self.half.d2u_dcontrols(1.5, self.controls),
+                                    self.full.d2u_dcontrols(1.5, self.controls),
+                                    atol=1e-7))
+
+    def test_error_negative_mode(self):
+        with self.assertRaises(ValueError):
+            floq.system._canonicalise_hermitian({-1: np.eye(2), 0: np.eye(2)})
+
+
+class TestRealSymmetric(unittest.TestCase):
+    def setUp(self):
+        # A cosine drive of a real model, so H_1 = H_-1 and all are real.
+        def hamiltonian(controls):
+            drive = np.array([[0, 0.5*controls[0]], [0.5*controls[0], 0]])
+            return {-1: drive, 0: np.diag([1.2, 2.8 + controls[1]]), 1: drive}
+        def dhamiltonian(controls):
+            drive = np.array([[0, 0.5], [0.5, 0]])
+            return [{-1: drive, 1: drive},
+                    {0: np.diag([0.0, 1.0])}]
+        self.hamiltonian, self.dhamiltonian = hamiltonian, dhamiltonian
+        self.controls = np.array([0.7, -0.4])
+
+    def system(self, **kwargs):
+        return floq.System(self.hamiltonian, self.dhamiltonian, n_zones=11,
+                           frequency=5.0, **kwargs)
+
+    def test_detection(self):
+        real = floq.system._canonicalise_operator(
+            self.hamiltonian(self.controls))
+        self.assertTrue(floq.evolution.is_real_symmetric(real))
+        odd = floq.system._canonicalise_operator(
+            {-1: -np.eye(2), 0: np.eye(2), 1: np.eye(2)})
+        self.assertFalse(floq.evolution.is_real_symmetric(odd))
+        complex_ = floq.system._canonicalise_operator(
+            {0: np.array([[0, 1j], [-1j, 0]])})
+        self.assertFalse(floq.evolution.is_real_symmetric(complex_))
+
+    def test_real_k(self):
+        hamiltonian = floq.system._canonicalise_operator(
+            self.hamiltonian(self.controls))
+        k = floq.evolution.assemble_k(hamiltonian, 11, 5.0, real=True)
+        self.assertEqual(k.dtype, np.float64)
+        self.assertTrue(np.array_equal(
+            k, floq.evolution.assemble_k(hamiltonian, 11, 5.0).real))
+        k = floq.evolution.assemble_k_sparse(hamiltonian, 11, 5.0, real=True)
+        self.assertEqual(k.dtype, np.float64)
+
+    def test_matches_complex(self):
+        for sparse in (True, False):
+            complex_ = self.system(sparse=sparse, real=False)
+            real = self.system(sparse=sparse)
+            eigensystem = real.eigensystem(self.controls)
+            self.assertEqual(eigensystem.k_eigenvectors.dtype, np.complex128)
+            self.assertTrue(np.allclose(real.u(1.5, self.controls),
+                                        complex_.u(1.5, self.controls),
+                                        atol=1e-7))
+            self.assertTrue(np.allclose(
+                real.du_dcontrols(1.5, self.controls),
+                complex_.du_dcontrols(1.5, self.controls), atol=1e-7))
+
+    def test_linear_system(self):
+        h0 = {0: np.diag([1.2, 2.8])}
+        hs = self.dhamiltonian(self.controls)
+        linear = floq.LinearSystem(h0, hs, n_zones=11, frequency=5.0)
+        self.assertTrue(linear.real)
+        self.assertEqual(linear.k(self.controls).dtype, np.float64)
+        self.assertTrue(np.allclose(linear.u(1.5, self.controls),
+                                    self.system(real=False).u(1.5,
+                                                              self.controls),
+                                    atol=1e-7))
+
+    def test_spectrum_slicing(self):
+        for real in (True, False):
+            sliced = self.system(real=real, solver='slicing', slices=3)
+            self.assertTrue(np.allclose(sliced.u(1.5, self.controls),
+                                        self.system(sparse=False)
+                                            .u(1.5, self.controls),
+                                        atol=1e-7))